@@ -0,0 +1,88 @@
+"""
+Journalisation asynchrone.
+
+Les traces sont deposees dans une file bornee par le thread qui les emet (le thread Ivy) et
+ecrites par un thread de fond : une sortie lente (terminal, collecteur de logs) ne bloque
+plus le traitement des messages. Les arguments des traces ne sont formates que dans le
+thread de fond ; ils doivent donc etre des valeurs figees (nombres, chaines, tuples).
+Lorsque la file est pleine, les traces sont perdues (et comptees) plutot que d'attendre.
+
+Equivalent de logging.handlers.QueueHandler et QueueListener, absents de Python 2.
+"""
+import threading, logging
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+CAPACITY = 10000 # Nombre maximal de traces en attente d'ecriture
+
+
+class QueueHandler(logging.Handler):
+    """Handler qui depose les traces dans une file, sans attendre"""
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+        self.dropped = 0 # Traces perdues, la file etant pleine
+
+    def emit(self, record):
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    """Thread de fond qui transmet les traces de la file aux handlers d'origine"""
+
+    def __init__(self, records, handlers):
+        self.records = records
+        self.handlers = list(handlers)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="gpws-log")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Ecrit les traces en attente puis arrete le thread"""
+        if self.thread is not None:
+            self.records.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                return
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def install(logger, capacity=CAPACITY):
+    """
+    Remplace les handlers du logger par un QueueHandler dont les traces sont ecrites en arriere-plan
+    par ces memes handlers
+    :return: (handler, listener) : le QueueHandler installe et le thread d'ecriture, demarre
+    """
+    records = queue.Queue(capacity)
+    listener = QueueListener(records, logger.handlers)
+    handler = QueueHandler(records)
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    listener.start()
+    return handler, listener
+
+def uninstall(logger, handler, listener):
+    """Ecrit les traces en attente et remet les handlers d'origine"""
+    logger.removeHandler(handler)
+    listener.stop()
+    for old in listener.handlers:
+        logger.addHandler(old)
+    if handler.dropped:
+        logger.warning("%d log records dropped (queue full)", handler.dropped)
@@ -0,0 +1,157 @@
+"""
+Lecture des alarmes sonores du GPWS.
+
+Le mixer pygame est initialise une seule fois, tous les fichiers du repertoire
+sons/ sont decodes en memoire au demarrage du lecteur et la lecture est faite par un
+thread dedie alimente par une file de priorite. Jouer un son revient donc a empiler une
+demande : le thread Ivy n'attend jamais la fin d'une alarme.
+
+pygame n'est importe qu'au demarrage d'un lecteur, et le chargement des sons est fait par
+le thread de lecture : importer ce module (ou gpws) ne coute rien aux outils qui ne jouent
+pas de sons, et l'agent rejoint le bus sans attendre le decodage des fichiers.
+"""
+import os, threading, heapq, itertools, logging
+logger = logging.getLogger('Ivy')
+
+pygame = None # Module pygame, importe par import_pygame
+TEST_SON = None # Lecture des sons possible (pygame installe), None tant que l'import n'a pas ete tente
+
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sons")
+
+CALLOUT_PRIORITY = 50 # Les callouts passent apres toutes les alarmes des enveloppes
+POLL_DELAY = 0.02 # Periode de surveillance du canal pendant une lecture (s)
+
+
+def import_pygame():
+    """:return: True si pygame est installe (importe au premier appel)"""
+    global pygame, TEST_SON
+    if TEST_SON is None:
+        try:
+            import pygame
+            TEST_SON = True
+        except ImportError:
+            logger.warning("Module pygame non installe : impossible de lire les sons")
+            TEST_SON = False
+    return TEST_SON
+
+
+class SoundPlayer(object):
+    """
+    Lecteur de sons persistant.
+    Les demandes sont classees par priorite (la plus petite passe en premier, comme Enveloppe.priority) ;
+    une demande plus prioritaire que le son en cours interrompt celui-ci.
+    """
+    def __init__(self, directory=SOUNDS_DIR):
+        self.directory = directory
+        self.cache = {} # nom du fichier -> pygame.mixer.Sound
+        self._pending = [] # tas de (priorite, numero, son)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._current = None # (priorite, son) en cours de lecture
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Lance le thread de lecture, qui commence par initialiser le mixer et charger les sons en memoire"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="gpws-audio")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Arrete le thread de lecture et libere le mixer"""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._running = False
+            self._cond.notify()
+            thread = self._thread
+        thread.join()
+        self._thread = None
+        if TEST_SON:
+            pygame.mixer.quit()
+
+    def play(self, sound, priority=CALLOUT_PRIORITY):
+        """
+        Demande la lecture d'un son et rend la main immediatement
+        :param sound: chemin du son a jouer
+        :param priority: priorite de la demande (la plus petite est jouee en premier)
+        :return: False si le son est deja en cours de lecture ou en attente
+        """
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if self._current is not None and self._current[1] == sound:
+                return False
+            for (_, _, pending) in self._pending:
+                if pending == sound:
+                    return False
+            heapq.heappush(self._pending, (priority, next(self._seq), sound))
+            self._cond.notify()
+        return True
+
+    def pending(self):
+        """Nombre de sons en attente de lecture"""
+        return len(self._pending)
+
+    def _load(self):
+        if not import_pygame():
+            return
+        try:
+            pygame.mixer.init()
+        except pygame.error as e: # Pas de peripherique audio : l'echec est trace par le thread de lecture
+            logger.error("Initialisation du mixer impossible : %s", e)
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".wav"):
+                self.cache[name] = pygame.mixer.Sound(os.path.join(self.directory, name))
+        logger.info("%d sons charges depuis %s", len(self.cache), self.directory)
+
+    def _get(self, sound):
+        """Retourne le son decode, en le chargeant s'il ne fait pas partie du repertoire sons/"""
+        name = os.path.basename(sound)
+        if name not in self.cache:
+            try:
+                self.cache[name] = pygame.mixer.Sound(sound)
+            except pygame.error:
+                logger.error("Impossible de charger le son %s", sound)
+                return None
+        return self.cache[name]
+
+    def _run(self):
+        self._load()
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                priority, _, sound = heapq.heappop(self._pending)
+                self._current = (priority, sound)
+            try:
+                self._play_one(priority, sound)
+            except Exception: # pygame.error, fichier illisible... : le thread continue avec le son suivant
+                logger.exception("Lecture du son %s impossible", sound)
+            finally:
+                with self._cond:
+                    self._current = None
+
+    def _play_one(self, priority, sound):
+        if not TEST_SON:
+            logger.info("Lecture de %s", sound)
+            return
+        song = self._get(sound)
+        if song is None:
+            return
+        channel = song.play()
+        if channel is None:
+            return
+        with self._cond:
+            while self._running and channel.get_busy():
+                if self._pending and self._pending[0][0] < priority: # Une alarme plus prioritaire coupe le son en cours
+                    channel.stop()
+                    return
+                self._cond.wait(POLL_DELAY)
@@ -0,0 +1,154 @@
+"""
+Evaluation vectorisee des enveloppes GPWS sur un grand nombre d'etats.
+
+Les etats sont donnes sous forme d'un tableau (N, 7) range comme Etat.list. Tous les
+produits vectoriels de toutes les aretes de toutes les enveloppes sont calcules en une
+seule operation NumPy par paquet d'etats, ce qui permet de rejouer ou de balayer des
+millions d'etats hors ligne avec le meme resultat que test_mode et Mode.get_enveloppe.
+"""
+import numpy as np
+import gpws, geometry
+
+CHUNK = 65536 # Nombre d'etats traites par paquet (borne la memoire utilisee)
+NO_ENV = -1 # Indice retourne lorsque le point n'est dans aucune enveloppe
+
+
+class BatchEvaluator(object):
+    """Geometrie de toutes les enveloppes d'une liste de modes, mise a plat pour le calcul vectoriel"""
+
+    def __init__(self, modes=None):
+        if modes is None:
+            modes = gpws.get_modes()
+        self.modes = modes
+        self.generation = gpws.Mode.generation # Les modes d'un profil recharge sont remplaces dans la meme liste
+        self.enveloppes = [env for mode in modes for env in mode.list_enveloppes]
+        self.env_mode = np.array([i for i, mode in enumerate(modes) for env in mode.list_enveloppes], dtype=np.intp)
+        self.mode_start = np.cumsum([0] + [len(mode.list_enveloppes) for mode in modes])
+
+        # Aretes compilees (ax, ay, abx, aby) de toutes les enveloppes, avec les axes du mode de chaque arete
+        edges, edge_abs, edge_ord, edge_start = [], [], [], []
+        for mode in modes:
+            for env in mode.list_enveloppes:
+                edge_start.append(len(edges))
+                edges.extend(env.edges)
+                edge_abs.extend([mode.abs] * len(env.edges))
+                edge_ord.extend([mode.ord] * len(env.edges))
+        edges = np.array(edges, dtype=float).reshape(-1, 4)
+        self.a_x = edges[:, 0].copy()
+        self.a_y = edges[:, 1].copy()
+        self.ab_x = edges[:, 2].copy()
+        self.ab_y = edges[:, 3].copy()
+        self.edge_abs = np.array(edge_abs, dtype=np.intp)
+        self.edge_ord = np.array(edge_ord, dtype=np.intp)
+        self.edge_start = np.array(edge_start, dtype=np.intp)
+        # Les enveloppes non convexes ne se reduisent pas a une intersection de demi-plans
+        self.concave = [(k, modes[self.env_mode[k]]) for k, env in enumerate(self.enveloppes) if env.index is not None]
+
+        # Rang de chaque enveloppe dans l'ordre de test_mode : priorite croissante, puis ordre des modes
+        priorities = np.array([env.priority for env in self.enveloppes], dtype=float)
+        order = np.lexsort((np.arange(len(self.enveloppes)), priorities))
+        self.rank = np.empty(len(self.enveloppes), dtype=np.intp)
+        self.rank[order] = np.arange(len(self.enveloppes))
+        self.no_rank = len(self.enveloppes)
+
+    def applicable(self, flaps, gear, phase):
+        """
+        :return: masque des enveloppes applicables (mode actif dans la phase et enveloppe valable dans la config)
+        """
+        mode_ok = [mode.accepts(phase) for mode in self.modes]
+        return np.array([mode_ok[m] and env.accepts(flaps, gear) for m, env in zip(self.env_mode, self.enveloppes)],
+                        dtype=bool)
+
+    def inside(self, states):
+        """
+        :param states: tableau (N, 7) d'etats ranges comme Etat.list
+        :return: tableau (N, nb enveloppes) : True si le point du mode de l'enveloppe est dans l'enveloppe
+        """
+        px = states[:, self.edge_abs]
+        py = states[:, self.edge_ord]
+        # Un produit vectoriel positif (ou indefini) sur une arete suffit a sortir de l'enveloppe
+        cross = self.ab_x * (py - self.a_y) - self.ab_y * (px - self.a_x)
+        outside = np.logical_or.reduceat(~(cross <= 0), self.edge_start, axis=1)
+        inside = ~outside
+        for (k, mode) in self.concave:
+            inside[:, k] = geometry.winding_number_array(self.enveloppes[k].vertexes, states[:, mode.abs], states[:, mode.ord])
+        return inside
+
+    def evaluate(self, states, flaps, gear, phase):
+        """
+        :param states: tableau (N, 7) d'etats ranges comme Etat.list
+        :param flaps: position des flaps
+        :param gear: position du gear
+        :param phase: phase de vol
+        :return: (par_mode, global) : par_mode (N, nb modes) donne l'indice dans mode.list_enveloppes de l'enveloppe
+                 retenue par chaque mode et global (N,) l'indice dans self.enveloppes de l'enveloppe retenue par
+                 test_mode, NO_ENV si aucune
+        """
+        return self._evaluate(states, self.applicable(flaps, gear, phase))
+
+    def classify(self, states, flaps, gear):
+        """
+        Comme Mode.get_enveloppe pour chaque mode : sans tenir compte de la phase ni de l'activation des modes
+        :param states: tableau (N, 7) d'etats ranges comme Etat.list
+        :return: tableau (N, nb modes) de l'indice dans mode.list_enveloppes de l'enveloppe contenant le point
+                 de chaque mode, NO_ENV si aucune
+        """
+        applicable = np.array([env.accepts(flaps, gear) for env in self.enveloppes], dtype=bool)
+        return self._evaluate(states, applicable)[0]
+
+    def _evaluate(self, states, applicable):
+        """
+        :param applicable: masque des enveloppes a considerer
+        :return: (par_mode, global) (voir evaluate)
+        """
+        states = np.atleast_2d(np.asarray(states, dtype=float))
+        n = len(states)
+        par_mode = np.full((n, len(self.modes)), NO_ENV, dtype=np.intp)
+        best = np.full(n, NO_ENV, dtype=np.intp)
+        if not applicable.any():
+            return par_mode, best
+        for start in range(0, n, CHUNK):
+            stop = min(start + CHUNK, n)
+            (par_mode[start:stop], best[start:stop]) = self.select(self.inside(states[start:stop]), applicable)
+        return par_mode, best
+
+    def select(self, inside, applicable):
+        """
+        :param inside: tableau (N, nb enveloppes) retourne par inside
+        :param applicable: masque des enveloppes a considerer
+        :return: (par_mode, global) (voir evaluate)
+        """
+        n = len(inside)
+        par_mode = np.full((n, len(self.modes)), NO_ENV, dtype=np.intp)
+        score = np.where(inside & applicable, self.rank, self.no_rank)
+        for m in range(len(self.modes)):
+            first, last = self.mode_start[m], self.mode_start[m + 1]
+            if first == last:
+                continue
+            k = score[:, first:last].argmin(axis=1)
+            hit = score[np.arange(n), first + k] < self.no_rank
+            par_mode[:, m] = np.where(hit, k, NO_ENV)
+        k = score.argmin(axis=1)
+        hit = score[np.arange(n), k] < self.no_rank
+        return par_mode, np.where(hit, k, NO_ENV)
+
+    def enveloppe(self, index):
+        """Retourne l'enveloppe correspondant a un indice global, None pour NO_ENV"""
+        return None if index == NO_ENV else self.enveloppes[index]
+
+
+_evaluators = {} # BatchEvaluator par liste de modes, reconstruit quand les modes changent (Mode.generation)
+
+def evaluate_batch(states_array, flaps, gear, phase, modes=None):
+    """
+    Evalue un ensemble d'etats dans une configuration donnee (voir BatchEvaluator.evaluate)
+    :param states_array: tableau (N, 7) d'etats ranges comme Etat.list
+    :param modes: liste des modes a evaluer, L_Modes par defaut
+    """
+    if modes is None:
+        modes = gpws.get_modes()
+    key = id(modes)
+    evaluator = _evaluators.get(key)
+    if evaluator is None or evaluator.modes is not modes or evaluator.generation != gpws.Mode.generation:
+        _evaluators[key] = BatchEvaluator(modes)
+    return _evaluators[key].evaluate(states_array, flaps, gear, phase)
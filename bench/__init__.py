@@ -0,0 +1,4 @@
+"""
+Mesures de performance du GPWS, sans bus Ivy ni sons.
+Chaque module se lance depuis la racine du depot : python -m bench.<module>
+"""
@@ -0,0 +1,97 @@
+"""
+Delai entre une entree capteur et l'alarme qu'elle provoque, selon la politique de
+declenchement (gpws.Trigger), sur une horloge simulee.
+
+Des avions traversent les enveloppes du mode 1 ; les messages capteurs de chaque tick
+arrivent a des instants aleatoires entre deux messages Time, comme des capteurs non
+synchronises avec l'horloge. Les messages sont traites dans l'ordre de leurs instants par
+les memes fonctions que le callback Ivy.
+
+Usage : python -m bench.declenchement [-p PERIODE_MS] [-n AVIONS] [policy ...]
+"""
+from __future__ import division
+import math, random
+import gpws
+from optparse import OptionParser
+
+POLICIES = ["tick", "input", "input:100", "input:500"]
+
+
+class Silence(gpws.Sortie):
+    """Sortie qui n'emet rien"""
+
+    def send(self, msg):
+        pass
+
+    def play(self, sound, priority):
+        pass
+
+    def emit(self, level, text, args=(), extra=None):
+        pass
+
+
+def trajectory(aircraft, nb_points, rng):
+    """:return: liste par tick des messages capteurs d'un avion traversant le mode 1 en diagonale"""
+    mode = gpws.get_modes()[0]
+    (xmin, ymin, xmax, ymax) = mode.get_xmin_ymin_xmax_ymax()
+    gamma = math.radians(-10)
+    etat = gpws.Etat(15, 5000, 0, 0, None, 0, 0, "0", gpws.DOWN, gpws.APP)
+    (x0, y0) = (xmin, ymax + 0.2 * (ymax - ymin))
+    (x1, y1) = (xmax - rng.uniform(0.1, 0.5) * (xmax - xmin), ymin + rng.uniform(0.05, 0.3) * (ymax - ymin))
+    suffix = gpws.AIRCRAFT_FIELD.format(aircraft)
+    ticks = []
+    for i in range(nb_points):
+        etat.set_xy(x0 + (x1 - x0) * i / nb_points, y0 + (y1 - y0) * i / nb_points, mode, gamma)
+        ticks.append([line.rstrip("\n") + suffix for line in
+                      (etat.generate_radioalt(), etat.generate_statevector(gamma), etat.generate_fms(),
+                       etat.generate_config())])
+    return ticks
+
+def schedule(nb_aircraft, nb_points, period, seed=0):
+    """:return: liste triee des (instant, message) : un Time par periode, les capteurs a des instants aleatoires"""
+    rng = random.Random(seed)
+    events = [(i * period, "Time t={}".format(i)) for i in range(nb_points + 1)]
+    for a in range(nb_aircraft):
+        for (i, messages) in enumerate(trajectory("AC{}".format(a), nb_points, rng)):
+            events.extend((i * period + rng.uniform(0, period), msg) for msg in messages)
+    events.sort(key=lambda event: event[0])
+    return events
+
+def run(policy, events):
+    """:return: la politique (gpws.Trigger) apres traitement des messages, ses mesures a jour"""
+    clock = [0.0]
+    trigger = gpws.parse_trigger(policy)
+    trigger.clock = lambda: clock[0]
+    previous = gpws.trigger
+    gpws.trigger = trigger
+    try:
+        fleet = gpws.Fleet(lambda aircraft, etat: Silence(aircraft, sound=False))
+        for (t, msg) in events:
+            clock[0] = t
+            message = gpws.parse_message(msg)
+            if message is not None:
+                fleet.handle(*message)
+    finally:
+        gpws.trigger = previous
+    return trigger
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] [policy...]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(period=1000, aircraft=20, points=40)
+    parser.add_option('-p', '--period', type='float', dest='period',
+                      help='Time between two Time messages (ms)')
+    parser.add_option('-n', '--aircraft', type='int', dest='aircraft',
+                      help='Number of aircraft')
+    parser.add_option('-k', '--ticks', type='int', dest='points',
+                      help='Number of ticks per trajectory')
+    (options, args) = parser.parse_args()
+
+    events = schedule(options.aircraft, options.points, options.period / 1000)
+    print("{:<12}{:>12}{:>8}{:>12}{:>12}".format("policy", "evaluations", "alerts", "mean (ms)", "max (ms)"))
+    for policy in args or POLICIES:
+        trigger = run(policy, events)
+        mean = trigger.total / trigger.count if trigger.count else 0
+        print("{:<12}{:>12}{:>8}{:>12.1f}{:>12.1f}".format(policy, trigger.evaluations, trigger.count,
+                                                         1000 * mean, 1000 * trigger.max))
@@ -0,0 +1,125 @@
+"""
+Temps de demarrage de l'agent GPWS, mesure dans des processus neufs (lancement de
+l'interpreteur compris) :
+
+- python : interpreteur seul (python -c pass), la reference ;
+- import : import gpws, ce que paient les outils (rejeu, tests, mesures) ;
+- pret : gpws.main() jusqu'a l'entree dans IvyMainLoop (options, profil d'enveloppes,
+  import d'Ivy, connexion au bus). IvyMainLoop est remplace par un signal "pret" suivi
+  de IvyStop : l'agent s'arrete aussitot apres.
+
+--check sort en erreur si la mediane du temps pret depasse le budget. -X affiche les
+modules les plus longs a importer (python -X importtime, Python 3.7 et plus).
+
+Usage : python -m bench.demarrage [-n ESSAIS] [-B BUDGET_MS] [-c] [-X] [-b BUS] [-- options de gpws]
+"""
+from __future__ import division
+import os, sys, subprocess
+from timeit import default_timer as timer
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 10 # Essais par cas
+BUDGET_MS = 100 # Budget de la mediane du temps pret
+BUS = "127.255.255.255:2019"
+READY = "ready"
+
+# Agent dont la boucle Ivy rend la main des que tout est pret
+AGENT = """
+import sys
+from ivy import std_api
+def ready():
+    sys.stdout.write("{}\\n")
+    sys.stdout.flush()
+    std_api.IvyStop()
+std_api.IvyMainLoop = ready
+import gpws
+sys.argv[0] = gpws.__file__
+gpws.main()
+""".format(READY)
+
+
+def run(args, until=None):
+    """
+    Lance un processus python dans le repertoire du depot
+    :param until: ligne de la sortie standard qui marque la fin de la mesure (fin du processus si None)
+    :return: duree (s) entre le lancement et la fin de la mesure
+    """
+    devnull = open(os.devnull, "w")
+    start = timer()
+    process = subprocess.Popen([sys.executable] + args, cwd=ROOT, stdout=subprocess.PIPE, stderr=devnull)
+    try:
+        if until is not None:
+            for line in iter(process.stdout.readline, b""):
+                if line.decode().strip() == until:
+                    break
+            else:
+                raise RuntimeError("{} : fin du processus sans la ligne '{}'".format(" ".join(args), until))
+        else:
+            process.stdout.read()
+        elapsed = timer() - start
+    finally:
+        process.stdout.close()
+        process.wait()
+        devnull.close()
+    return elapsed
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def import_times(limit=10):
+    """:return: les limit modules les plus longs a importer avec gpws : liste de (cumul en ms, module), None avant Python 3.7"""
+    if sys.version_info < (3, 7):
+        return None
+    output = subprocess.check_output([sys.executable, "-X", "importtime", "-c", "import gpws"], cwd=ROOT,
+                                     stderr=subprocess.STDOUT).decode()
+    times = []
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            (_, cumulative, name) = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                times.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(times, reverse=True)[:limit]
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] [-- gpws options]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(runs=RUNS, budget=BUDGET_MS, check=False, importtime=False, ivy_bus=BUS)
+    parser.add_option('-n', '--runs', type='int', dest='runs',
+                      help='Number of runs per case')
+    parser.add_option('-B', '--budget', type='float', dest='budget',
+                      help='Budget of the median time to readiness (ms, default to {})'.format(BUDGET_MS))
+    parser.add_option('-c', '--check', action='store_true', dest='check',
+                      help='Fail if the median time to readiness exceeds the budget')
+    parser.add_option('-X', '--importtime', action='store_true', dest='importtime',
+                      help='Print the slowest imports (python -X importtime)')
+    parser.add_option('-b', '--ivybus', type='string', dest='ivy_bus',
+                      help='Bus of the started agent (default to {})'.format(BUS))
+    (options, args) = parser.parse_args()
+
+    cases = [("python", ["-c", "pass"], None),
+             ("import", ["-c", "import gpws"], None),
+             ("pret", ["-c", AGENT, "-b", options.ivy_bus] + args, READY)]
+    run(["-c", "import gpws"]) # Chauffe (fichiers compiles, caches du systeme et du profil)
+    results = {}
+    print("{:<10}{:>12}{:>12}{:>12}".format("case", "median (ms)", "min (ms)", "max (ms)"))
+    for (name, case_args, until) in cases:
+        times = [1000 * run(case_args, until) for _ in range(options.runs)]
+        results[name] = median(times)
+        print("{:<10}{:>12.1f}{:>12.1f}{:>12.1f}".format(name, results[name], min(times), max(times)))
+    print("pret - python : {:.1f} ms (budget {:.0f} ms pour pret)".format(results["pret"] - results["python"],
+                                                                         options.budget))
+
+    if options.importtime:
+        times = import_times()
+        if times is None:
+            print("-X importtime requires Python 3.7")
+        for (ms, name) in times or []:
+            print("{:>10.1f} ms  {}".format(ms, name))
+
+    if results["pret"] > options.budget:
+        print("BUDGET DEPASSE : pret {:.1f} ms > {:.0f} ms".format(results["pret"], options.budget))
+        if options.check:
+            sys.exit(1)
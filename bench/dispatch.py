@@ -0,0 +1,65 @@
+"""
+Cout par message du decodage des messages Ivy : ancien chemin (les cinq expressions regulieres
+des abonnements testees sur chaque message, comme le fait Ivy, puis conversion de tous les champs
+captures) contre gpws.parse_message.
+
+Usage : python -m bench.dispatch [-n REPETITIONS]
+"""
+import re, timeit
+import gpws
+from optparse import OptionParser
+
+# Expressions regulieres des anciens abonnements Ivy de gpws.py
+REGEX_BINDINGS = [re.compile(regexp) for regexp in
+                  ['^Time t=(\\S+)',
+                   '^RadioAltimeter groundAlt=(\\S+)',
+                   'StateVector\\s+x=(\\S+)\\s+y=(\\S+)\\sz=(\\S+)\\sVp=(\\S+)\\sfpa=(\\S+)\\spsi=(\\S+)\\sphi=(\\S+)',
+                   '^FMS_TO_GPWS\\sphase=(\\S+),\\sda=(\\S+),\\sdh=(\\S+)',
+                   'Config\\s+GEAR=(\\S+)\\s+FLAPS=(\\S+)']]
+# Champs non numeriques des anciens traitements (phase pour FMS_TO_GPWS, gear et flaps pour Config)
+TEXT_FIELDS = [(), (), (), (0,), (0, 1)]
+
+MESSAGES = ["Time t=12.0",
+            "RadioAltimeter groundAlt=896.112",
+            "StateVector x=0 y=0 z=0 Vp=51.1956321433 fpa=-0.174532925199 psi=0 phi=0.0",
+            "FMS_TO_GPWS phase=APPROACH, da=0, dh=0",
+            "Config GEAR=Down FLAPS=0"]
+
+
+def regex_path(msg):
+    """Decodage comme avec les cinq abonnements Ivy : chaque expression est essayee, tous les champs convertis"""
+    result = None
+    for (i, regexp) in enumerate(REGEX_BINDINGS):
+        match = regexp.match(msg)
+        if match is not None:
+            result = [value if k in TEXT_FIELDS[i] else float(value) for (k, value) in enumerate(match.groups())]
+    return result
+
+def measure(function, msg, number):
+    """:return: cout moyen d'un appel en nanosecondes (meilleure de 5 series)"""
+    return min(timeit.repeat(lambda: function(msg), number=number, repeat=5)) / number * 1e9
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(number=100000)
+    parser.add_option('-n', '--number', type='int', dest='number',
+                      help='Calls per measurement')
+    (options, args) = parser.parse_args()
+
+    print("{:<16}{:>12}{:>12}{:>10}".format("message", "regex (ns)", "parse (ns)", "gain"))
+    total_regex = total_parse = 0
+    for msg in MESSAGES:
+        for suffix in ("",) if msg.startswith("Time") else ("", " ac=AF1234"):
+            regex = measure(regex_path, msg, options.number) if not suffix else None
+            parse = measure(gpws.parse_message, msg + suffix, options.number)
+            name = msg.split()[0] + (" ac" if suffix else "")
+            if regex is None:
+                print("{:<16}{:>12}{:>12.0f}{:>10}".format(name, "-", parse, "-"))
+            else:
+                total_regex += regex
+                total_parse += parse
+                print("{:<16}{:>12.0f}{:>12.0f}{:>9.1f}x".format(name, regex, parse, regex / parse))
+    print("{:<16}{:>12.0f}{:>12.0f}{:>9.1f}x".format("mean", total_regex / len(MESSAGES), total_parse / len(MESSAGES),
+                                                    total_regex / total_parse))
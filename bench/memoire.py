@@ -0,0 +1,134 @@
+"""
+Empreinte memoire des etats avion : octets par avion et par instantane, avec l'ancienne
+disposition de gpws.Etat (liste Python et attributs dans un dictionnaire, copie par le
+constructeur) et la nouvelle (__slots__ et tableau de doubles, gpws.Historique).
+
+Les objets partages entre avions (classes, chaines, petits entiers, None, booleens) ne
+sont pas comptes.
+
+Le code de sortie est 1 si la nouvelle disposition depasse le budget d'octets par avion ;
+un avertissement est affiche si elle occupe plus que l'ancienne.
+
+Usage : python -m bench.memoire [-n AVIONS] [-b OCTETS]
+"""
+from __future__ import division
+import sys, gc, types, random, timeit
+from copy import copy
+import gpws
+from optparse import OptionParser
+
+SHARED_TYPES = (type, types.ModuleType, type(""), type(u""), bool, type(None)) + \
+               ((types.ClassType,) if hasattr(types, "ClassType") else ())
+
+# Budget d'octets par avion de gpws.Etat (environ 420 avec Python 2.7 comme avec Python 3)
+BUDGET_PER_AIRCRAFT = 450
+
+
+class AncienEtat():
+    """Ancienne disposition de gpws.Etat (memes attributs, memes valeurs initiales)"""
+
+    def __init__(self, VerticalSpeed, RadioAltitude, TerrainClosureRate, MSLAltitudeLoss, ComputedAirSpeed,
+                 GlideSlopeDeviation, RollAngle, flaps, gear, phase):
+        self.list = [VerticalSpeed, RadioAltitude, TerrainClosureRate, MSLAltitudeLoss, ComputedAirSpeed,
+                     GlideSlopeDeviation, RollAngle]
+        self.flaps = flaps
+        self.gear = gear
+        self.phase = phase
+        self.da = 0
+        self.dh = 0
+        self.time = 0
+        self.last_radio = 0
+        self.is_pullup = False
+        self.last_callout = len(gpws.CALLOUTS)
+        self.max_ralt = 0
+        self.init_ralt = False
+        self.init_state = False
+        self.init_fms = False
+        self.init_config = False
+
+    def __copy__(self):
+        copy = AncienEtat(*(self.list + [self.flaps, self.gear, self.phase]))
+        copy.da = self.da
+        copy.dh = self.dh
+        copy.init_fms = self.init_fms
+        copy.init_ralt = self.init_ralt
+        copy.init_state = self.init_state
+        copy.init_config = self.init_config
+        return copy
+
+
+def deep_size(root):
+    """:return: taille en octets des objets atteignables depuis root, hors objets partages"""
+    seen = set()
+    total = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES) or (type(obj) is int and -5 <= obj <= 256):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+def make_etats(cls, n, seed=0):
+    """:return: n etats de la classe cls, aux variables toutes differentes (comme apres quelques messages)"""
+    rng = random.Random(seed)
+    etats = []
+    for _ in range(n):
+        etat = cls(*([rng.uniform(-3000, 3000) for _ in range(gpws.NB_VARIABLES)] + ["0", gpws.DOWN, gpws.APP]))
+        etat.time = float(rng.randint(0, 10 ** 6))
+        etats.append(etat)
+    return etats
+
+def per_item(container, n):
+    """:return: octets par element d'un conteneur de n elements (conteneur vide deduit)"""
+    return (deep_size(container) - deep_size(type(container)())) / n
+
+def bench_snapshots(etat, n, new):
+    """:return: octets par instantane de n instantanes de l'etat ; liste de copies, ou gpws.Historique si new"""
+    if new:
+        snapshots = gpws.Historique(n)
+        for _ in range(n):
+            snapshots.append(etat)
+        return (deep_size(snapshots) - deep_size(gpws.Historique(0))) / n
+    return per_item([copy(etat) for _ in range(n)], n)
+
+def snapshot_time(etat, new, number=20000):
+    """:return: cout moyen d'un instantane en nanosecondes (meilleure de 5 series)"""
+    if new:
+        snapshots = gpws.Historique(number * 5)
+        function = lambda: snapshots.append(etat)
+    else:
+        snapshots = []
+        function = lambda: snapshots.append(copy(etat))
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e9
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(number=10000, budget=BUDGET_PER_AIRCRAFT)
+    parser.add_option('-n', '--number', type='int', dest='number',
+                      help='Number of aircraft (and of snapshots)')
+    parser.add_option('-b', '--budget', type='int', dest='budget',
+                      help='Maximum bytes per aircraft of the new layout')
+    (options, args) = parser.parse_args()
+    n = options.number
+
+    old = make_etats(AncienEtat, n)
+    new = make_etats(gpws.Etat, n)
+    rows = [("octets / avion", per_item(old, n), per_item(new, n)),
+            ("octets / copie", bench_snapshots(old[0], n, False), bench_snapshots(new[0], n, False)),
+            ("octets / instantane", bench_snapshots(old[0], n, False), bench_snapshots(new[0], n, True)),
+            ("ns / instantane", snapshot_time(old[0], False), snapshot_time(new[0], True))]
+    print("{:<22}{:>12}{:>12}{:>10}".format("", "avant", "apres", "gain"))
+    for (name, before, after) in rows:
+        print("{:<22}{:>12.0f}{:>12.0f}{:>9.1f}x".format(name, before, after, before / after))
+
+    (before, after) = rows[0][1:]
+    if after > before:
+        sys.stderr.write("warning: {:.0f} bytes per aircraft, {:.0f} with the old layout\n".format(after, before))
+    if after > options.budget:
+        sys.stderr.write("error: {:.0f} bytes per aircraft, budget {}\n".format(after, options.budget))
+        sys.exit(1)
@@ -0,0 +1,290 @@
+"""
+Suite de mesures des chemins critiques : Enveloppe.collision, Mode.get_enveloppe, test_mode,
+tick complet (messages capteurs puis on_time, avec ou sans anticipation des alarmes) et rejeu
+d'un fichier de trajectoire, sur toutes les configurations (flaps, gear, phase) des modes de
+Creation_Modes.
+
+Chaque cas est une serie d'appels (un appel par point, par etat ou par tick). Le debit est
+mesure sur des series completes : nombre d'appels par seconde et cout moyen d'un appel.
+p50 et p99 sont les quantiles du cout d'un appel mesure par paquets d'appels consecutifs
+(duree du paquet divisee par son nombre d'appels), chaque paquet durant au moins
+MIN_SAMPLE_TIME : sous Python 2, l'horloge (time.time) n'est precise qu'a la microseconde.
+Les allocations (pic de memoire pendant une serie, memoire conservee par appel) sont
+mesurees avec tracemalloc, donc seulement sous Python 3 ; sous Python 2 ces colonnes ne
+sont ni affichees ni enregistrees.
+
+Les resultats sont ajoutes a un historique JSON (une ligne par execution) ; --check compare
+le cout moyen d'un appel de chaque cas a la mediane des executions precedentes sur la meme
+machine et le meme Python, et sort en erreur si un cas est plus lent que la tolerance.
+
+Usage : python -m bench.suite [-k FILTRE] [-c] [-t TOLERANCE] [-o HISTORIQUE]
+"""
+from __future__ import division
+import os, sys, json, random, functools, platform, tempfile, shutil, subprocess, datetime
+from timeit import default_timer as timer
+import gpws, replay
+from bench.declenchement import Silence, trajectory
+from optparse import OptionParser
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historique.jsonl")
+HISTORY_FORMAT = 3 # 3 : quantiles par paquets d'appels (2 : appels un a un, 1 : moyennes par serie)
+PHASES = [gpws.APP, gpws.CLIMB, gpws.TAKEOFF, gpws.LDG, gpws.CRZ]
+CONFIGS = [(flaps, gear) for flaps in gpws.FLAPS for gear in gpws.GEARS]
+SAMPLES = 30 # Nombre de series par cas
+TIMER_CALIBRATION = 1000 # Lectures de l'horloge pour estimer son cout
+MIN_SAMPLE_TIME = 50e-6 # Duree minimale (s) d'un paquet d'appels mesure pour les quantiles
+GRID = 16 # Points par axe de la grille de chaque mode
+NB_ETATS = 64 # Etats par configuration pour test_mode
+NB_TICKS = 200 # Ticks de la trajectoire du tick complet et du rejeu
+WINDOW = 5 # Nombre d'executions precedentes de reference pour --check
+TOLERANCE = 0.25 # Ralentissement admis du cout moyen pour --check
+
+
+def grid_points(mode, n=GRID):
+    """:return: grille n x n de points couvrant les enveloppes du mode (et 10% autour)"""
+    (xmin, ymin, xmax, ymax) = mode.get_xmin_ymin_xmax_ymax()
+    wx = 0.1 * (xmax - xmin)
+    wy = 0.1 * (ymax - ymin)
+    return [(xmin - wx + (xmax - xmin + 2 * wx) * i / (n - 1), ymin - wy + (ymax - ymin + 2 * wy) * j / (n - 1))
+            for i in range(n) for j in range(n)]
+
+def random_etats(flaps, gear, phase, n, rng):
+    """:return: n etats de la configuration, chaque variable tiree dans l'etendue des axes des modes qui l'utilisent"""
+    ranges = [[] for _ in range(gpws.NB_VARIABLES)]
+    for mode in gpws.get_modes():
+        (xmin, ymin, xmax, ymax) = mode.get_xmin_ymin_xmax_ymax()
+        ranges[mode.abs].append((xmin, xmax))
+        ranges[mode.ord].append((ymin, ymax))
+    etats = []
+    for _ in range(n):
+        values = [rng.uniform(min(lo for (lo, hi) in r), max(hi for (lo, hi) in r)) if r else 0 for r in ranges]
+        etats.append(gpws.Etat(*(values + [flaps, gear, phase])))
+    return etats
+
+def trajectory_lines(nb_ticks, seed=0):
+    """:return: messages d'une trajectoire traversant le mode 1 (voir bench.declenchement), un Time par tick"""
+    lines = []
+    for (i, messages) in enumerate(trajectory("AC0", nb_ticks, random.Random(seed))):
+        lines.append("Time t={}".format(i))
+        lines.extend(messages)
+    lines.append("Time t={}".format(nb_ticks))
+    return lines
+
+
+def cases(tmpdir):
+    """
+    :return: liste de (nom, fonction preparant une serie) ; la fonction retourne la liste des appels de la serie,
+             fonctions sans argument
+    """
+    result = []
+    for mode in gpws.get_modes():
+        points = grid_points(mode)
+        envs = mode.list_enveloppes
+        collision = [functools.partial(env.collision, P) for P in points for env in envs]
+        result.append(("collision:" + mode.name, lambda collision=collision: collision))
+        get_enveloppe = [functools.partial(mode.get_enveloppe, P, flaps, gear)
+                         for (flaps, gear) in CONFIGS for P in points]
+        result.append(("get_enveloppe:" + mode.name, lambda get_enveloppe=get_enveloppe: get_enveloppe))
+
+    def dirty_test_mode(etat):
+        etat.dirty = gpws.ALL_VARIABLES
+        gpws.test_mode(etat)
+
+    rng = random.Random(0)
+    for phase in PHASES:
+        etats = [etat for (flaps, gear) in CONFIGS for etat in random_etats(flaps, gear, phase, NB_ETATS, rng)]
+        test_mode = [functools.partial(dirty_test_mode, etat) for etat in etats]
+        result.append(("test_mode:" + phase, lambda test_mode=test_mode: test_mode))
+
+    # Etats deja evalues (par la chauffe de measure) : aucune variable modifiee
+    clean = [etat for (flaps, gear) in CONFIGS for etat in random_etats(flaps, gear, gpws.CRZ, NB_ETATS, rng)]
+    test_mode_clean = [functools.partial(gpws.test_mode, etat) for etat in clean]
+    result.append(("test_mode:clean", lambda: test_mode_clean))
+
+    # Un tick : messages capteurs puis Time
+    lines = trajectory_lines(NB_TICKS)
+    ticks = [[]]
+    for message in (gpws.parse_message(line) for line in lines):
+        if message is not None:
+            ticks[-1].append(message)
+            if message[0] is gpws.on_time:
+                ticks.append([])
+
+    def tick_calls():
+        fleet = gpws.Fleet(lambda aircraft, etat: Silence(aircraft, sound=False))
+
+        def tick(messages):
+            for message in messages:
+                fleet.handle(*message)
+        return [functools.partial(tick, messages) for messages in ticks if messages]
+    result.append(("tick", tick_calls))
+
+    def with_lookahead(lookahead, call):
+        previous = gpws.lookahead
+        gpws.lookahead = lookahead
+        try:
+            call()
+        finally:
+            gpws.lookahead = previous
+
+    def tick_lookahead_calls():
+        return [functools.partial(with_lookahead, lookahead, call) for lookahead in [gpws.Lookahead()]
+                for call in tick_calls()]
+    result.append(("tick:lookahead", tick_lookahead_calls))
+
+    path = os.path.join(tmpdir, "trajectoire.txt")
+    with open(path, "w") as fic:
+        fic.write("\n".join(lines) + "\n")
+    result.append(("replay", lambda: [functools.partial(replay.replay_file, path)]))
+    return result
+
+
+def quantile(values, q):
+    """:return: quantile q d'une liste triee"""
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def timer_overhead(n=TIMER_CALIBRATION):
+    """:return: cout median (s) d'une mesure a vide (deux lectures de l'horloge)"""
+    times = []
+    for _ in range(n):
+        start = timer()
+        times.append(timer() - start)
+    times.sort()
+    return quantile(times, 0.5)
+
+def run(calls):
+    """Execute les appels d'une serie"""
+    for call in calls:
+        call()
+
+def allocations(calls):
+    """:return: (pic de memoire allouee pendant une serie, memoire conservee par appel) en octets (tracemalloc)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        run(calls)
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before, (current - before) / len(calls)
+
+def measure(name, prepare, samples=SAMPLES, overhead=0.):
+    """
+    :param prepare: fonction preparant une serie (voir cases)
+    :param overhead: cout d'une mesure a vide, deduit de la duree de chaque paquet
+    :return: mesures d'un cas (dictionnaire enregistre dans l'historique)
+    """
+    run(prepare()) # Chauffe (tables de dispatch, caches)
+    calls = prepare()
+    start = timer()
+    run(calls) # Premiere estimation du cout d'un appel, pour la taille des paquets
+    batch = max(1, int(MIN_SAMPLE_TIME * len(calls) / max(timer() - start, 1e-9)) + 1)
+    (elapsed, nb_calls, times) = (0., 0, [])
+    for _ in range(samples):
+        # Serie complete, pour le debit
+        calls = prepare()
+        start = timer()
+        run(calls)
+        elapsed += timer() - start
+        nb_calls += len(calls)
+        # Paquets d'appels consecutifs, pour les quantiles
+        calls = prepare()
+        for first in range(0, len(calls), batch):
+            packet = calls[first:first + batch]
+            start = timer()
+            run(packet)
+            times.append(max(timer() - start - overhead, 0.) / len(packet))
+    times.sort()
+    result = {"name": name, "ops_per_s": nb_calls / elapsed, "mean_ns": elapsed / nb_calls * 1e9,
+              "p50_ns": quantile(times, 0.5) * 1e9, "p99_ns": quantile(times, 0.99) * 1e9, "batch": batch,
+              "samples": len(times)}
+    if tracemalloc is not None:
+        (result["alloc_peak_bytes"], result["alloc_retained_bytes"]) = allocations(prepare())
+    return result
+
+
+def environment():
+    """:return: description de l'execution (date, commit, Python, machine)"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=open(os.devnull, "w"),
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"format": HISTORY_FORMAT, "date": datetime.datetime.now().isoformat(), "commit": commit,
+            "python": platform.python_version(), "machine": platform.node()}
+
+def load_history(path):
+    """:return: executions de l'historique (liste de dictionnaires), de la plus ancienne a la plus recente"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as fic:
+        return [json.loads(line) for line in fic if line.strip()]
+
+def check(results, history, env, window=WINDOW, tolerance=TOLERANCE):
+    """
+    Compare le cout moyen d'un appel de chaque cas a la mediane de ses couts moyens dans les executions
+    precedentes comparables
+    :return: liste de (nom, cout moyen, cout moyen de reference) des cas ralentis au-dela de la tolerance
+    """
+    runs = [run for run in history if run.get("format", 1) == env["format"] and run["python"] == env["python"]
+            and run["machine"] == env["machine"]][-window:]
+    regressions = []
+    for result in results:
+        previous = sorted(r["mean_ns"] for run in runs for r in run["results"] if r["name"] == result["name"])
+        if previous:
+            reference = quantile(previous, 0.5)
+            if result["mean_ns"] > reference * (1 + tolerance):
+                regressions.append((result["name"], result["mean_ns"], reference))
+    return regressions
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(history=HISTORY, save=True, check=False, tolerance=TOLERANCE, samples=SAMPLES, filter="")
+    parser.add_option('-k', '--filter', type='string', dest='filter',
+                      help='Only run the cases whose name contains this text')
+    parser.add_option('-s', '--samples', type='int', dest='samples',
+                      help='Number of series per case')
+    parser.add_option('-o', '--history', type='string', dest='history',
+                      help='History file (JSON lines)')
+    parser.add_option('-n', '--no-save', action='store_false', dest='save',
+                      help='Do not append the results to the history')
+    parser.add_option('-c', '--check', action='store_true', dest='check',
+                      help='Fail if a case is slower than the previous runs')
+    parser.add_option('-t', '--tolerance', type='float', dest='tolerance',
+                      help='Accepted slowdown of the mean call time for --check (default to {})'.format(TOLERANCE))
+    (options, args) = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = []
+        overhead = timer_overhead()
+        header = "{:<24}{:>14}{:>12}{:>12}{:>12}".format("case", "ops/s", "mean (ns)", "p50 (ns)", "p99 (ns)")
+        print(header + ("{:>14}{:>14}".format("peak (B)", "kept (B)") if tracemalloc is not None else ""))
+        for (name, prepare) in cases(tmpdir):
+            if options.filter in name:
+                result = measure(name, prepare, options.samples, overhead)
+                results.append(result)
+                line = "{:<24}{:>14.0f}{:>12.0f}{:>12.0f}{:>12.0f}".format(
+                    name, result["ops_per_s"], result["mean_ns"], result["p50_ns"], result["p99_ns"])
+                if tracemalloc is not None:
+                    line += "{:>14}{:>14.1f}".format(result["alloc_peak_bytes"], result["alloc_retained_bytes"])
+                print(line)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    env = environment()
+    regressions = check(results, load_history(options.history), env, tolerance=options.tolerance)
+    if options.save:
+        env["results"] = results
+        with open(options.history, "a") as fic:
+            fic.write(json.dumps(env, sort_keys=True) + "\n")
+    for (name, mean, reference) in regressions:
+        print("REGRESSION {} : mean {:.0f} ns, reference {:.0f} ns".format(name, mean, reference))
+    if options.check and regressions:
+        sys.exit(1)
@@ -0,0 +1,271 @@
+"""
+Campagne de Monte Carlo sur les enveloppes GPWS.
+
+Des etats aleatoires sont tires, pour chaque configuration (flaps, gear), uniformement
+dans l'etendue des axes des modes (Mode.get_xmin_ymin_xmax_ymax, elargie de MARGIN) ; ils
+sont evalues par paquets avec batch.BatchEvaluator dans un groupe de processus. Les tests
+de collision d'un paquet sont faits une seule fois, puis reutilises pour chaque phase de vol.
+
+Les resultats sont des compteurs, additionnes au fil des paquets et ecrits dans un fichier
+npz compresse :
+- heatmap_<mode> : pour chaque (flaps, gear), nombre d'etats par cellule de la grille du
+  mode (extent_<mode>) et par enveloppe retenue par le mode (Mode.get_enveloppe, la
+  derniere classe etant 'hors enveloppe')
+- winners : pour chaque (flaps, gear, phase), nombre d'etats par enveloppe retenue par
+  test_mode (la derniere colonne etant 'aucune alarme')
+- overlaps : pour chaque (flaps, gear, phase), nombre d'etats par nombre d'enveloppes
+  declenchees en meme temps
+- conflicts : pour chaque (flaps, gear, phase), conflicts[w, l] nombre d'etats ou
+  l'enveloppe w l'emporte alors que l'enveloppe l est aussi declenchee
+Les tirages ne dependent que de la graine : le resultat est le meme quel que soit le
+nombre de processus.
+
+Usage : python campagne.py [-n ETATS] [-j PROCESSUS] [FICHIER] pour lancer une campagne,
+python campagne.py -l FICHIER pour relire le resume d'une campagne.
+"""
+from __future__ import division
+import sys, time, logging
+import numpy as np
+import gpws, batch, profil
+logger = logging.getLogger('Ivy')
+from optparse import OptionParser
+
+PHASES = [gpws.APP, gpws.CLIMB, gpws.TAKEOFF, gpws.LDG, gpws.CRZ]
+SAMPLES = 1000000 # Etats tires par configuration (flaps, gear)
+RESOLUTION = 64 # Cellules par axe des cartes de couverture
+MARGIN = 0.1 # Elargissement relatif de l'etendue des axes de chaque mode
+TASK = batch.CHUNK # Etats par tache confiee a un processus
+COUNTS = np.uint32 # Type des compteurs ecrits sur disque
+TOP = 10 # Conflits affiches dans le resume
+
+
+def extent(mode, margin=MARGIN):
+    """:return: (xmin, xmax, ymin, ymax) des axes du mode, elargis de margin"""
+    (xmin, ymin, xmax, ymax) = mode.get_xmin_ymin_xmax_ymax()
+    (wx, wy) = (margin * (xmax - xmin), margin * (ymax - ymin))
+    return (xmin - wx, xmax + wx, ymin - wy, ymax + wy)
+
+def ranges(modes, margin=MARGIN):
+    """:return: (bas, haut) : tableaux des bornes de tirage de chaque variable de Etat.list, 0 si aucun mode ne l'utilise"""
+    low = np.zeros(gpws.NB_VARIABLES)
+    high = np.zeros(gpws.NB_VARIABLES)
+    used = np.zeros(gpws.NB_VARIABLES, dtype=bool)
+    for mode in modes:
+        (xmin, xmax, ymin, ymax) = extent(mode, margin)
+        for (i, lo, hi) in ((mode.abs, xmin, xmax), (mode.ord, ymin, ymax)):
+            low[i] = min(low[i], lo) if used[i] else lo
+            high[i] = max(high[i], hi) if used[i] else hi
+            used[i] = True
+    return low, high
+
+
+class Campaign(object):
+    """Compteurs d'une campagne, indexes par (flaps, gear[, phase])"""
+
+    def __init__(self, modes, resolution=RESOLUTION, margin=MARGIN):
+        self.modes = modes
+        self.resolution = resolution
+        self.margin = margin
+        self.names = ["{}:{}".format(mode.name, env.name) for mode in modes for env in mode.list_enveloppes]
+        self.priorities = np.array([env.priority for mode in modes for env in mode.list_enveloppes], dtype=float)
+        self.env_mode = np.array([m for (m, mode) in enumerate(modes) for env in mode.list_enveloppes], dtype=np.intp)
+        self.extents = [extent(mode, margin) for mode in modes]
+        (F, G, P, E) = (len(gpws.FLAPS), len(gpws.GEARS), len(PHASES), len(self.names))
+        self.samples = np.zeros((F, G), dtype=np.int64)
+        self.heatmaps = [np.zeros((F, G, len(mode.list_enveloppes) + 1, resolution, resolution), dtype=np.int64)
+                         for mode in modes]
+        self.winners = np.zeros((F, G, P, E + 1), dtype=np.int64)
+        self.overlaps = np.zeros((F, G, P, E + 1), dtype=np.int64)
+        self.conflicts = np.zeros((F, G, P, E, E), dtype=np.int64)
+
+    def add(self, result):
+        """Ajoute les compteurs d'une tache (voir run_task)"""
+        (f, g, n, heatmaps, winners, overlaps, conflicts) = result
+        self.samples[f, g] += n
+        for (total, heatmap) in zip(self.heatmaps, heatmaps):
+            total[f, g] += heatmap
+        self.winners[f, g] += winners
+        self.overlaps[f, g] += overlaps
+        self.conflicts[f, g] += conflicts
+
+    def save(self, path):
+        """Ecrit les compteurs dans un fichier npz compresse"""
+        arrays = {"flaps": np.array(gpws.FLAPS), "gears": np.array(gpws.GEARS), "phases": np.array(PHASES),
+                  "modes": np.array([mode.name for mode in self.modes]), "enveloppes": np.array(self.names),
+                  "priorities": self.priorities, "env_mode": self.env_mode, "samples": self.samples,
+                  "winners": self.winners.astype(COUNTS), "overlaps": self.overlaps.astype(COUNTS),
+                  "conflicts": self.conflicts.astype(COUNTS)}
+        for (mode, bounds, heatmap) in zip(self.modes, self.extents, self.heatmaps):
+            arrays["extent_" + mode.name] = np.array(bounds)
+            arrays["heatmap_" + mode.name] = heatmap.astype(COUNTS)
+        np.savez_compressed(path, **arrays)
+
+    def report(self, top=TOP):
+        """:return: lignes du resume : alarmes de chaque enveloppe, enveloppes jamais retenues, principaux conflits"""
+        return summary(self.names, self.priorities, self.samples, self.winners, self.overlaps, self.conflicts, top)
+
+
+def summary(names, priorities, samples, winners, overlaps, conflicts, top=TOP):
+    """:return: lignes du resume d'une campagne (voir Campaign.report)"""
+    E = len(names)
+    total = samples.sum() * winners.shape[2] # Etats evalues, toutes phases confondues
+    wins = winners.sum(axis=(0, 1, 2))
+    configs = (winners[..., :E] > 0).sum(axis=(0, 1, 2))
+    lines = ["{} etats x {} phases, {:.1%} sans alarme, {:.1%} avec plusieurs enveloppes declenchees".format(
+             samples.sum(), winners.shape[2], wins[E] / total, overlaps[..., 2:].sum() / total)]
+    lines.append("{:<32}{:>10}{:>12}{:>10}".format("enveloppe", "priorite", "retenue", "configs"))
+    for k in range(E):
+        lines.append("{:<32}{:>10g}{:>11.2%}{:>10}".format(names[k], priorities[k], wins[k] / total, configs[k]))
+    never = [names[k] for k in range(E) if wins[k] == 0]
+    if never:
+        lines.append("jamais retenues : {}".format(", ".join(never)))
+    masked = conflicts.sum(axis=(0, 1, 2))
+    order = np.argsort(masked, axis=None)[::-1][:top]
+    lines.append("{:<32}{:<32}{:>12}".format("retenue", "masquee", "etats"))
+    for index in order:
+        (w, l) = np.unravel_index(index, masked.shape)
+        if masked[w, l]:
+            tie = " (meme priorite)" if priorities[w] == priorities[l] else ""
+            lines.append("{:<32}{:<32}{:>12}{}".format(names[w], names[l], masked[w, l], tie))
+    return lines
+
+def load_summary(path, top=TOP):
+    """:return: lignes du resume d'une campagne ecrite par Campaign.save"""
+    data = np.load(path)
+    return summary([str(name) for name in data["enveloppes"]], data["priorities"], data["samples"],
+                   data["winners"].astype(np.int64), data["overlaps"].astype(np.int64),
+                   data["conflicts"].astype(np.int64), top)
+
+
+# Etat d'un processus de travail (voir init_worker)
+_evaluator = None
+_config = None
+
+def init_worker(profile, resolution, margin):
+    """Charge le profil dans un processus de travail et prepare l'evaluateur"""
+    global _evaluator, _config
+    gpws.load_profile(profile)
+    modes = gpws.get_modes()
+    _evaluator = batch.BatchEvaluator(modes)
+    _config = (resolution, margin, ranges(modes, margin), [extent(mode, margin) for mode in modes])
+
+def tasks(samples, seed, task=TASK):
+    """:return: liste des taches (indice des flaps, indice du gear, graine, nombre d'etats)"""
+    result = []
+    for f in range(len(gpws.FLAPS)):
+        for g in range(len(gpws.GEARS)):
+            for (i, first) in enumerate(range(0, samples, task)):
+                result.append((f, g, (seed, f, g, i), min(task, samples - first)))
+    return result
+
+def run_task(task):
+    """
+    Tire et evalue les etats d'une tache
+    :return: (f, g, n, heatmaps, winners, overlaps, conflicts) : compteurs de la tache (voir Campaign)
+    """
+    (f, g, seed, n) = task
+    ev = _evaluator
+    (resolution, margin, (low, high), extents) = _config
+    (flaps, gear) = (gpws.FLAPS[f], gpws.GEARS[g])
+    states = np.random.RandomState(seed).uniform(low, high, (n, gpws.NB_VARIABLES))
+    inside = ev.inside(states)
+    E = len(ev.enveloppes)
+
+    # Cartes de couverture : enveloppe retenue par chaque mode, sans tenir compte de la phase
+    par_mode = ev.select(inside, np.array([env.accepts(flaps, gear) for env in ev.enveloppes], dtype=bool))[0]
+    heatmaps = []
+    for (m, mode) in enumerate(ev.modes):
+        (xmin, xmax, ymin, ymax) = extents[m]
+        ix = np.floor((states[:, mode.abs] - xmin) * (resolution / (xmax - xmin))).astype(np.intp)
+        iy = np.floor((states[:, mode.ord] - ymin) * (resolution / (ymax - ymin))).astype(np.intp)
+        ok = (ix >= 0) & (ix < resolution) & (iy >= 0) & (iy < resolution)
+        nb_classes = len(mode.list_enveloppes) + 1
+        cls = np.where(par_mode[:, m] == batch.NO_ENV, nb_classes - 1, par_mode[:, m])
+        cells = (cls * resolution + iy) * resolution + ix
+        heatmaps.append(np.bincount(cells[ok], minlength=nb_classes * resolution * resolution)
+                        .reshape(nb_classes, resolution, resolution))
+
+    # Alarme retenue par test_mode et enveloppes masquees, pour chaque phase
+    winners = np.zeros((len(PHASES), E + 1), dtype=np.int64)
+    overlaps = np.zeros((len(PHASES), E + 1), dtype=np.int64)
+    conflicts = np.zeros((len(PHASES), E, E), dtype=np.int64)
+    for (p, phase) in enumerate(PHASES):
+        applicable = ev.applicable(flaps, gear, phase)
+        best = ev.select(inside, applicable)[1]
+        triggered = inside & applicable
+        winners[p] = np.bincount(np.where(best == batch.NO_ENV, E, best), minlength=E + 1)
+        overlaps[p] = np.bincount(triggered.sum(axis=1), minlength=E + 1)
+        hit = best != batch.NO_ENV
+        won = np.zeros((hit.sum(), E))
+        won[np.arange(len(won)), best[hit]] = 1
+        conflicts[p] = np.rint(np.dot(won.T, triggered[hit])).astype(np.int64)
+        conflicts[p][np.diag_indices(E)] = 0
+    return f, g, n, heatmaps, winners, overlaps, conflicts
+
+def run(samples=SAMPLES, processes=None, seed=0, profile=profil.DEFAULT, resolution=RESOLUTION, margin=MARGIN):
+    """
+    Lance une campagne
+    :param samples: nombre d'etats tires par configuration (flaps, gear)
+    :param processes: nombre de processus (None : autant que de coeurs, 1 : dans ce processus)
+    :return: la campagne (Campaign)
+    """
+    init_worker(profile, resolution, margin)
+    campaign = Campaign(gpws.get_modes(), resolution, margin)
+    todo = tasks(samples, seed)
+    if processes == 1:
+        for task in todo:
+            campaign.add(run_task(task))
+        return campaign
+    import multiprocessing
+    pool = multiprocessing.Pool(processes, init_worker, (profile, resolution, margin))
+    try:
+        for result in pool.imap_unordered(run_task, todo):
+            campaign.add(result)
+    finally:
+        pool.close()
+        pool.join()
+    return campaign
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] [file]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(samples=SAMPLES, processes=0, seed=0, profile=profil.DEFAULT, resolution=RESOLUTION,
+                        top=TOP, load=False)
+    parser.add_option('-n', '--samples', type='int', dest='samples',
+                      help='Number of random states per (flaps, gear) configuration')
+    parser.add_option('-j', '--jobs', type='int', dest='processes',
+                      help='Number of worker processes (0 : one per core)')
+    parser.add_option('-s', '--seed', type='int', dest='seed',
+                      help='Random seed')
+    parser.add_option('-p', '--profile', type='string', dest='profile',
+                      help='Envelope profile (name in profils/ or JSON file)')
+    parser.add_option('-r', '--resolution', type='int', dest='resolution',
+                      help='Number of cells per axis of the coverage heatmaps')
+    parser.add_option('-t', '--top', type='int', dest='top',
+                      help='Number of priority conflicts shown')
+    parser.add_option('-l', '--load', action='store_true', dest='load',
+                      help='Only print the summary of an existing campaign file')
+    (options, args) = parser.parse_args()
+    if len(args) > 1:
+        parser.error("at most one campaign file expected")
+    path = args[0] if args else "campagne.npz"
+    gpws.init_logging()
+
+    if options.load:
+        lines = load_summary(path, options.top)
+    else:
+        if not 0 < options.samples < np.iinfo(COUNTS).max:
+            parser.error("the number of samples must be between 1 and {}".format(np.iinfo(COUNTS).max))
+        start = time.time()
+        try:
+            campaign = run(options.samples, options.processes or None, options.seed, options.profile,
+                           options.resolution)
+        except (ValueError, IOError) as e:
+            parser.error(str(e))
+        elapsed = time.time() - start
+        campaign.save(path)
+        total = campaign.samples.sum()
+        logger.info("%d etats evalues en %.1f s (%.0f etats/s), resultats dans %s", total, elapsed, total / elapsed, path)
+        lines = campaign.report(options.top)
+    sys.stdout.write("\n".join(lines) + "\n")
@@ -0,0 +1,157 @@
+"""
+Emission sur le bus d'un fichier de vol (fichier de test ou vol enregistre) au rythme de ses messages Time.
+
+Le fichier est lu en flux, ligne a ligne : un tick (message Time et messages capteurs qui le
+suivent, jusqu'au Time suivant) est envoye d'un bloc a l'instant que dicte son temps t,
+divise par le facteur de vitesse (1 : temps reel, 10 : dix fois plus vite, 0 : aussi vite que
+possible). Un tick en retard est envoye aussitot ; les suivants restent cales sur l'horloge
+de depart, le retard est donc rattrape. Un temps qui recule (fichiers mis bout a bout)
+recale l'horloge sur le tick courant. Les lignes precedant le premier Time sont envoyees
+des le depart.
+
+Usage : python emetteur.py [-x VITESSE] [-b BUS] FICHIER...
+"""
+from __future__ import division
+import sys, time, logging
+logger = logging.getLogger('Ivy')
+from optparse import OptionParser
+
+TIME_PREFIX = "Time t="
+SPEED = 1.0 # Facteur de vitesse par defaut (temps reel)
+START_DELAY = 1.0 # Attente (s) avant l'emission, le temps que les agents se connectent
+
+
+def frames(lines):
+    """
+    Regroupe les lignes d'un fichier par tick, en flux
+    :param lines: iterable de lignes (un fichier ouvert par exemple)
+    :return: generateur de (t, messages) : temps du tick (None pour les lignes precedant le premier Time) et
+             liste de ses messages, le Time en tete, sans fin de ligne ni lignes vides
+    """
+    (t, messages) = (None, [])
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        if line.startswith(TIME_PREFIX):
+            if messages:
+                yield t, messages
+            (t, messages) = (float(line[len(TIME_PREFIX):].split()[0]), [])
+        messages.append(line)
+    if messages:
+        yield t, messages
+
+
+class Scheduler(object):
+    """Envoi de ticks au rythme de leurs temps, et mesure du rythme obtenu"""
+
+    def __init__(self, send, speed=SPEED, clock=time.time, sleep=time.sleep):
+        """
+        :param send: fonction d'envoi d'un message (IvySendMsg par exemple)
+        :param speed: facteur de vitesse, 0 ou None pour envoyer aussi vite que possible
+        """
+        self.send = send
+        self.speed = speed or None
+        self.clock = clock
+        self.sleep = sleep
+        self.frames = 0
+        self.messages = 0
+        self.late = 0 # Ticks envoyes apres leur instant (plus d'une milliseconde de retard)
+        self.max_lag = 0.0 # Plus grand retard (s) d'un tick
+        self.span = 0.0 # Duree simulee (s), somme des intervalles de temps des ticks
+        self.start = None
+        self.stop = None
+        self.origin = None # (temps du tick, instant) de reference de l'horloge
+
+    def play(self, ticks):
+        """
+        Envoie les ticks, chacun d'un bloc a son instant
+        :param ticks: iterable de (t, messages) (voir frames)
+        :return: self
+        """
+        if self.start is None:
+            self.start = self.clock()
+        previous = None
+        for (t, messages) in ticks:
+            if t is not None:
+                if previous is not None and t >= previous:
+                    self.span += t - previous
+                if self.origin is None or previous is None or t < previous:
+                    self.origin = (t, self.clock()) # Premier tick ou temps qui recule : recalage
+                elif self.speed is not None:
+                    self.wait(self.origin[1] + (t - self.origin[0]) / self.speed)
+                previous = t
+            for msg in messages:
+                self.send(msg)
+            self.frames += 1
+            self.messages += len(messages)
+        self.stop = self.clock()
+        return self
+
+    def wait(self, due):
+        """Attend l'instant due, ou note le retard s'il est passe"""
+        delay = due - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+        elif delay < -1e-3:
+            self.late += 1
+            self.max_lag = max(self.max_lag, -delay)
+
+    def play_file(self, filename):
+        """Envoie les ticks d'un fichier, lu en flux"""
+        with open(filename, "r") as fic:
+            return self.play(frames(fic))
+
+    def report(self):
+        """
+        :return: liste de (cle, valeur) : facteur de vitesse demande et obtenu, ticks et messages envoyes et
+                 debits obtenus, ticks en retard et plus grand retard
+        """
+        elapsed = max((self.stop or self.clock()) - (self.start or 0), 1e-9)
+        return [("speed_requested", self.speed or "max"), ("speed_achieved", round(self.span / elapsed, 2)),
+                ("frames", self.frames), ("frames_per_s_requested", round(self.frames * self.speed / self.span, 2)
+                                          if self.speed and self.span else "max"),
+                ("frames_per_s", round(self.frames / elapsed, 2)), ("messages_per_s", round(self.messages / elapsed, 2)),
+                ("late_frames", self.late), ("max_lag_ms", round(1000 * self.max_lag, 1)),
+                ("elapsed_s", round(elapsed, 3))]
+
+
+def format_report(report):
+    """:return: le compte rendu d'une emission (voir Scheduler.report) sur une ligne : cle=valeur ..."""
+    return " ".join("{}={}".format(key, value) for (key, value) in report)
+
+
+if __name__ == '__main__':
+    import gpws
+    usage = "usage: %prog [options] file..."
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(ivy_bus="127.255.255.255:2010", app_name="Emetteur", speed=SPEED, delay=START_DELAY)
+    parser.add_option('-b', '--ivybus', type='string', dest='ivy_bus',
+                      help='Bus id (format @IP:port, default to 127.255.255.255:2010)')
+    parser.add_option('-a', '--appname', type='string', dest='app_name',
+                      help='Application Name')
+    parser.add_option('-x', '--speed', type='float', dest='speed',
+                      help='Speed factor (1 : real time, 10 : ten times faster, 0 : as fast as possible)')
+    parser.add_option('-d', '--delay', type='float', dest='delay',
+                      help='Wait before sending, for the other agents to connect (seconds)')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("no file to send")
+    if options.speed < 0:
+        parser.error("the speed factor must be positive (0 : as fast as possible)")
+    ivy = gpws.import_ivy()
+    gpws.init_logging()
+
+    ivy.IvyInit(options.app_name, "[%s ready]" % options.app_name, 0, lambda agent, connected: None,
+                lambda agent, _id: None)
+    ivy.IvyStart(options.ivy_bus)
+    time.sleep(options.delay)
+    try:
+        for filename in args:
+            scheduler = Scheduler(ivy.IvySendMsg, options.speed).play_file(filename)
+            logger.info("%s : %s", filename, format_report(scheduler.report()))
+    except (IOError, ValueError) as e:
+        logger.error("%s", e)
+        sys.exit(1)
+    finally:
+        ivy.IvyStop()
@@ -0,0 +1,338 @@
+"""
+Enregistrement binaire des vols : format compact en colonnes, lisible par projection memoire.
+
+Un enregistrement (RECORD) resume, pour un tick (intervalle entre deux messages Time) et un
+avion, les messages capteurs recus : temps du tick, avion, masque des messages presents
+(PRESENT_*), radio altitude, Vp, fpa, phi, phase, DA, DH, flaps et gear, dans les unites
+des messages du bus. Les champs d'un message absent valent NaN (ou MISSING pour les
+champs codes) ; si un avion envoie deux fois le meme message dans un tick, le dernier est
+garde. Le premier enregistrement d'un tick porte le bit PRESENT_TIME (un tick sans message
+capteur donne un enregistrement sans avion). Les avions, phases, flaps et gear sont codes
+par leur indice dans des tables gardees a cote des donnees (fichier .json), completees au
+fil de l'enregistrement.
+
+Un enregistrement est un repertoire contenant un fichier par champ de RECORD (t.bin,
+ralt.bin...) et le fichier des tables (tables.json). Chaque fichier de colonne est un en-tete
+de HEADER_SIZE octets suivi des valeurs du champ, bout a bout : l'enregistreur ajoute a
+chaque ecriture un paquet de valeurs a la fin de chaque colonne, et load projette chaque
+colonne en memoire (numpy.memmap), sans copie ni analyse, y compris pendant
+l'enregistrement. Une analyse ne lit que les colonnes qu'elle utilise (columns["ralt"],
+columns["t"]...). Les valeurs sont en double precision : la conversion
+texte -> binaire -> texte redonne les memes messages (x, y, z et psi, que le GPWS n'utilise
+pas, valant 0), les messages d'un tick etant regroupes par avion.
+
+Usage : python enregistrement.py record REPERTOIRE (agent Ivy enregistrant les messages du GPWS)
+        python enregistrement.py text2bin TEXTE REPERTOIRE | bin2text REPERTOIRE TEXTE | info REPERTOIRE
+"""
+from __future__ import division
+import os, sys, time, struct, threading, logging
+import numpy as np
+import gpws
+logger = logging.getLogger('Ivy')
+from optparse import OptionParser
+
+MAGIC = b"GPWSREC"
+FORMAT_VERSION = 2 # 1 : un seul fichier d'enregistrements de RECORD.itemsize octets
+HEADER = struct.Struct("<7sBI4x") # Signature, version, taille d'une valeur de la colonne
+HEADER_SIZE = HEADER.size
+
+# Masque des messages presents dans un enregistrement
+PRESENT_TIME = 1
+PRESENT_RADIOALT = 2
+PRESENT_STATEVECTOR = 4
+PRESENT_FMS = 8
+PRESENT_CONFIG = 16
+
+MISSING = 255 # Code d'une phase, de flaps ou d'un gear absent
+NO_AIRCRAFT = 0 # Indice des messages sans identifiant d'avion (avion unique) dans la table des avions
+
+# Champs d'un enregistrement, une colonne chacun
+RECORD = np.dtype([("t", "<f8"), ("aircraft", "<u4"), ("present", "u1"), ("ralt", "<f8"), ("vp", "<f8"),
+                   ("fpa", "<f8"), ("phi", "<f8"), ("phase", "u1"), ("da", "<f8"), ("dh", "<f8"),
+                   ("flaps", "u1"), ("gear", "u1")])
+TABLES = ("aircraft", "phase", "flaps", "gear")
+FLUSH_DELAY = 1.0 # Intervalle maximal (s) entre deux ecritures de l'agent d'enregistrement
+CHUNK = 65536 # Enregistrements convertis ou ecrits par paquet
+
+(TIME, RADIOALT, STATEVECTOR, FMS, CONFIG) = (gpws.MESSAGES[name][0] for name in
+                                              ("Time", "RadioAltimeter", "StateVector", "FMS_TO_GPWS", "Config"))
+
+
+def tables_path(path):
+    """:return: le chemin du fichier des tables d'un enregistrement"""
+    return os.path.join(path, "tables.json")
+
+def column_path(path, name):
+    """:return: le chemin du fichier d'une colonne d'un enregistrement"""
+    return os.path.join(path, name + ".bin")
+
+
+class Writer(object):
+    """Ecriture d'un enregistrement, message par message (voir add)"""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.columns = []
+        for name in RECORD.names:
+            fic = open(column_path(path, name), "wb")
+            fic.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD[name].itemsize))
+            self.columns.append((name, fic))
+        self.tables = dict((name, []) for name in TABLES)
+        self.tables["aircraft"].append(None)
+        self.codes = dict((name, {}) for name in TABLES)
+        self.codes["aircraft"][None] = NO_AIRCRAFT
+        self.tables_changed = True
+        self.t = float("nan")
+        self.time_pending = False # Message Time pas encore porte par un enregistrement
+        self.tick = {} # avion -> enregistrement du tick courant
+        self.order = [] # avions du tick courant, dans l'ordre de leur premier message
+        self.done = [] # Enregistrements termines, pas encore ecrits
+        self.count = 0 # Enregistrements ecrits
+
+    def code(self, table, value):
+        """:return: l'indice de value dans une table, ajoutee si besoin"""
+        codes = self.codes[table]
+        index = codes.get(value)
+        if index is None:
+            index = codes[value] = len(self.tables[table])
+            if table != "aircraft" and index >= MISSING:
+                raise ValueError("plus de {} valeurs de {}".format(MISSING, table))
+            self.tables[table].append(value)
+            self.tables_changed = True
+        return index
+
+    def current(self, aircraft):
+        """:return: l'enregistrement du tick courant de l'avion (liste des valeurs des champs de RECORD)"""
+        record = self.tick.get(aircraft)
+        if record is None:
+            record = self.tick[aircraft] = [self.t, self.code("aircraft", aircraft), 0, float("nan"), float("nan"),
+                                            float("nan"), float("nan"), MISSING, float("nan"), float("nan"),
+                                            MISSING, MISSING]
+            if self.time_pending:
+                record[2] = PRESENT_TIME
+                self.time_pending = False
+            self.order.append(aircraft)
+        return record
+
+    def add(self, msg):
+        """
+        Enregistre un message du bus
+        :return: False si le message n'est pas un message du GPWS
+        """
+        message = gpws.parse_message(msg)
+        if message is None:
+            return False
+        self.handle(*message)
+        return True
+
+    def handle(self, handler, aircraft, args):
+        """Enregistre un message decode par gpws.parse_message"""
+        if handler is TIME:
+            self.end_tick()
+            self.t = args[0]
+            self.time_pending = True
+            return
+        record = self.current(aircraft)
+        if handler is RADIOALT:
+            record[2] |= PRESENT_RADIOALT
+            record[3] = args[0]
+        elif handler is STATEVECTOR:
+            record[2] |= PRESENT_STATEVECTOR
+            record[4:7] = args
+        elif handler is FMS:
+            record[2] |= PRESENT_FMS
+            record[7:10] = (self.code("phase", args[0]), args[1], args[2])
+        elif handler is CONFIG:
+            record[2] |= PRESENT_CONFIG
+            record[10:12] = (self.code("flaps", args[1]), self.code("gear", args[0]))
+
+    def end_tick(self):
+        """Termine le tick courant"""
+        if self.time_pending: # Tick sans message capteur
+            self.current(None)
+        self.done.extend(tuple(self.tick[aircraft]) for aircraft in self.order)
+        self.tick = {}
+        self.order = []
+        if len(self.done) >= CHUNK:
+            self.flush()
+
+    def flush(self):
+        """Ecrit les enregistrements termines a la fin des colonnes, et les tables si elles ont change"""
+        if self.done:
+            records = np.array(self.done, dtype=RECORD)
+            for (name, fic) in self.columns:
+                fic.write(records[name].tobytes())
+            self.count += len(self.done)
+            self.done = []
+        for (name, fic) in self.columns:
+            fic.flush()
+        if self.tables_changed:
+            write_tables(tables_path(self.path), self.tables)
+            self.tables_changed = False
+
+    def close(self):
+        """Termine le dernier tick et ferme le fichier"""
+        self.end_tick()
+        self.flush()
+        for (name, fic) in self.columns:
+            fic.close()
+
+
+def write_tables(path, tables):
+    """Ecrit les tables d'un enregistrement, remplacees d'un coup"""
+    import json
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fic:
+        json.dump(dict((name, tables[name]) for name in TABLES), fic)
+    os.rename(tmp, path)
+
+def load(path):
+    """
+    :param path: repertoire de l'enregistrement
+    :return: (colonnes, tables) : dictionnaire nom -> tableau des valeurs du champ projete en memoire (lecture
+             seule), pour chaque champ de RECORD, et dictionnaire nom -> liste des valeurs de chaque table (TABLES)
+    :raise ValueError: si le repertoire n'est pas un enregistrement de ce format
+    """
+    import json
+    (sizes, columns) = ({}, {})
+    for name in RECORD.names:
+        try:
+            with open(column_path(path, name), "rb") as fic:
+                header = fic.read(HEADER_SIZE)
+        except IOError:
+            header = b""
+        if len(header) != HEADER_SIZE or HEADER.unpack(header)[0] != MAGIC:
+            raise ValueError("{} : pas un enregistrement GPWS".format(path))
+        (magic, version, size) = HEADER.unpack(header)
+        if version != FORMAT_VERSION or size != RECORD[name].itemsize:
+            raise ValueError("{} : version {} du format non prise en charge".format(path, version))
+        sizes[name] = (os.path.getsize(column_path(path, name)) - HEADER_SIZE) // size
+    with open(tables_path(path)) as fic:
+        tables = dict((name, [None if value is None else _str(value) for value in values])
+                      for (name, values) in json.load(fic).items())
+    count = min(sizes.values()) # Pendant l'enregistrement, les colonnes les plus longues attendent les autres
+    for name in RECORD.names:
+        if count == 0:
+            columns[name] = np.zeros(0, dtype=RECORD[name])
+        else:
+            columns[name] = np.memmap(column_path(path, name), dtype=RECORD[name], mode="r", offset=HEADER_SIZE,
+                                      shape=(count,))
+    return columns, tables
+
+def length(columns):
+    """:return: le nombre d'enregistrements des colonnes retournees par load"""
+    return len(columns["t"])
+
+
+def from_text(lines, path):
+    """
+    Convertit des messages texte (fichier de test) en enregistrement binaire
+    :param path: repertoire de l'enregistrement
+    :return: nombre d'enregistrements ecrits
+    """
+    writer = Writer(path)
+    try:
+        for line in lines:
+            writer.add(line)
+    finally:
+        writer.close()
+    return writer.count
+
+def to_text(columns, tables):
+    """:return: generateur des lignes de texte (messages du bus, avec fin de ligne) d'un enregistrement"""
+    (aircraft, phases, flaps, gears) = (tables[name] for name in TABLES)
+    for start in range(0, length(columns), CHUNK):
+        for record in zip(*[columns[name][start:start + CHUNK].tolist() for name in RECORD.names]):
+            (t, a, present, ralt, vp, fpa, phi, phase, da, dh, flap, gear) = record
+            suffix = "" if aircraft[a] is None else gpws.AIRCRAFT_FIELD.format(aircraft[a])
+            if present & PRESENT_TIME:
+                yield "Time t={}\n".format(_number(t))
+            if present & PRESENT_RADIOALT:
+                yield "RadioAltimeter groundAlt={}{}\n".format(ralt, suffix)
+            if present & PRESENT_STATEVECTOR:
+                yield "StateVector x=0 y=0 z=0 Vp={} fpa={} psi=0 phi={}{}\n".format(vp, fpa, phi, suffix)
+            if present & PRESENT_FMS:
+                yield "FMS_TO_GPWS phase={}, da={}, dh={}{}\n".format(phases[phase], _number(da), _number(dh), suffix)
+            if present & PRESENT_CONFIG:
+                yield "Config GEAR={} FLAPS={}{}\n".format(gears[gear], flaps[flap], suffix)
+
+def _str(text):
+    """:return: le texte en str (json produit des unicode sous Python 2)"""
+    return text if isinstance(text, str) else text.encode("utf-8")
+
+def _number(value):
+    """:return: value sous la forme ecrite par les fichiers de test pour le temps, DA et DH (entier sans partie decimale)"""
+    return int(value) if value.is_integer() and abs(value) < 2 ** 53 else value
+
+
+def info(columns, tables):
+    """:return: lignes du resume d'un enregistrement : enregistrements, ticks, avions, duree et messages par type"""
+    ticks = columns["present"] & PRESENT_TIME != 0
+    times = columns["t"][ticks]
+    lines = ["{} enregistrements de {} octets, {} ticks, {} avions".format(
+             length(columns), RECORD.itemsize, int(ticks.sum()), len(set(columns["aircraft"].tolist())))]
+    if len(times):
+        lines.append("temps de {} a {}".format(_number(float(times[0])), _number(float(times[-1]))))
+    for (name, bit) in (("RadioAltimeter", PRESENT_RADIOALT), ("StateVector", PRESENT_STATEVECTOR),
+                        ("FMS_TO_GPWS", PRESENT_FMS), ("Config", PRESENT_CONFIG)):
+        lines.append("{:<16}{:>12}".format(name, int((columns["present"] & bit != 0).sum())))
+    return lines
+
+
+def record(path, ivy_bus, app_name):
+    """Agent Ivy enregistrant les messages du GPWS jusqu'a son arret"""
+    ivy = gpws.import_ivy()
+    gpws.init_logging()
+    writer = Writer(path)
+    lock = threading.Lock() # Les messages arrivent sur les fils d'Ivy
+    last_flush = [time.time()]
+
+    def on_message(agent, msg):
+        with lock:
+            writer.add(msg)
+            now = time.time()
+            if msg.startswith("Time") and now - last_flush[0] >= FLUSH_DELAY:
+                writer.flush()
+                last_flush[0] = now
+
+    ivy.IvyInit(app_name, "[%s ready]" % app_name, 0, lambda agent, connected: None,
+                lambda agent, _id: None)
+    ivy.IvyStart(ivy_bus)
+    ivy.IvyBindMsg(on_message, gpws.MESSAGE_REGEX)
+    try:
+        ivy.IvyMainLoop()
+    finally:
+        with lock:
+            writer.close()
+        logger.info("%s : %d enregistrements", path, writer.count)
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] record dir | text2bin text dir | bin2text dir text | info dir"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(ivy_bus="127.255.255.255:2010", app_name="Enregistreur")
+    parser.add_option('-b', '--ivybus', type='string', dest='ivy_bus',
+                      help='Bus id (format @IP:port, default to 127.255.255.255:2010)')
+    parser.add_option('-a', '--appname', type='string', dest='app_name',
+                      help='Application Name')
+    (options, args) = parser.parse_args()
+    commands = {"record": 2, "text2bin": 3, "bin2text": 3, "info": 2}
+    if not args or commands.get(args[0]) != len(args):
+        parser.error("expected one of: record dir, text2bin text dir, bin2text dir text, info dir")
+
+    try:
+        if args[0] == "record":
+            record(args[1], options.ivy_bus, options.app_name)
+        elif args[0] == "text2bin":
+            with open(args[1]) as fic:
+                from_text(fic, args[2])
+        elif args[0] == "bin2text":
+            with open(args[2], "w") as fic:
+                fic.writelines(to_text(*load(args[1])))
+        else:
+            sys.stdout.write("\n".join(info(*load(args[1]))) + "\n")
+    except (IOError, ValueError) as e:
+        sys.stderr.write("{}\n".format(e))
+        sys.exit(1)
@@ -0,0 +1,253 @@
+"""
+Geometrie des enveloppes GPWS pour des polygones simples quelconques (convexes ou non).
+
+Les polygones sont ramenes au sens horaire, convention de Enveloppe.collision. La
+localisation d'un point se fait dans une decomposition en tranches verticales (slabs) :
+les abscisses des sommets et des croisements d'aretes decoupent le plan en tranches dans
+lesquelles les aretes ne se croisent pas ; chaque tranche range ses aretes de bas en haut
+et connait les polygones contenant chaque trapeze. Une recherche dichotomique sur les
+tranches puis une sur les aretes donnent le resultat en O(log n). Les points situes sur
+(ou tout pres d') un bord sont confies au test exact, par defaut le nombre d'enroulement.
+"""
+from __future__ import division
+from bisect import bisect_right
+
+REL_TOL = 1e-9 # Marge relative en deca de laquelle un point est considere sur un bord
+
+
+def signed_area(vertexes):
+    """:return: l'aire algebrique du polygone (positive dans le sens trigonometrique)"""
+    nbp = len(vertexes)
+    area = 0
+    for i in range(nbp):
+        (ax, ay) = vertexes[i]
+        (bx, by) = vertexes[(i + 1) % nbp]
+        area += ax * by - bx * ay
+    return area / 2
+
+def normalize(vertexes):
+    """:return: les sommets sous forme de tuple, parcourus dans le sens horaire"""
+    vertexes = tuple((x, y) for (x, y) in vertexes)
+    if signed_area(vertexes) > 0:
+        vertexes = vertexes[::-1]
+    return vertexes
+
+def is_convex(vertexes):
+    """:return: True si le polygone (sens horaire) est convexe, les sommets alignes ou repetes etant toleres"""
+    points = [P for i, P in enumerate(vertexes) if P != vertexes[i - 1]]
+    nbp = len(points)
+    for i in range(nbp):
+        (ax, ay) = points[i - 1]
+        (bx, by) = points[i]
+        (cx, cy) = points[(i + 1) % nbp]
+        if (bx - ax) * (cy - by) - (by - ay) * (cx - bx) > 0: # Virage a gauche
+            return False
+    return True
+
+def compile_polygon(vertexes):
+    """
+    Precalcule les aretes d'un polygone convexe parcouru dans le sens horaire
+    :param vertexes: liste des sommets (x,y)
+    :return: (edges, bbox) : edges est un tuple de (ax, ay, abx, aby), origine A et vecteur AB de chaque arete,
+             tel qu'un point P est hors du polygone des que abx*(P[1]-ay) - aby*(P[0]-ax) > 0 pour une arete
+             (produit vectoriel AB x AP, calcule comme le test d'origine : un sommet donne exactement 0),
+             bbox vaut (xmin, ymin, xmax, ymax)
+    """
+    edges = []
+    nbp = len(vertexes)
+    for i in range(nbp):
+        (ax, ay) = vertexes[i]
+        (bx, by) = vertexes[(i + 1) % nbp]
+        abx = bx - ax
+        aby = by - ay
+        if abx == 0 and aby == 0: # Arete de longueur nulle (sommet repete)
+            continue
+        edges.append((ax, ay, abx, aby))
+    xs = [x for (x, y) in vertexes]
+    ys = [y for (x, y) in vertexes]
+    return tuple(edges), (min(xs), min(ys), max(xs), max(ys))
+
+def winding_number(vertexes, x, y):
+    """
+    Test de reference : nombre d'enroulement du polygone autour du point, les points du bord etant a l'interieur
+    :return: True si le point (x, y) est dans le polygone ferme
+    """
+    wn = 0
+    nbp = len(vertexes)
+    for i in range(nbp):
+        (ax, ay) = vertexes[i]
+        (bx, by) = vertexes[(i + 1) % nbp]
+        is_left = (bx - ax) * (y - ay) - (x - ax) * (by - ay)
+        if is_left == 0 and min(ax, bx) <= x <= max(ax, bx) and min(ay, by) <= y <= max(ay, by):
+            return True # Sur le bord
+        if ay <= y:
+            if by > y and is_left > 0:
+                wn += 1
+        elif by <= y and is_left < 0:
+            wn -= 1
+    return wn != 0
+
+def winding_number_array(vertexes, x, y):
+    """Version vectorisee (NumPy) de winding_number, avec exactement les memes calculs"""
+    import numpy as np
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    wn = np.zeros(x.shape, dtype=int)
+    on_edge = np.zeros(x.shape, dtype=bool)
+    nbp = len(vertexes)
+    for i in range(nbp):
+        (ax, ay) = vertexes[i]
+        (bx, by) = vertexes[(i + 1) % nbp]
+        is_left = (bx - ax) * (y - ay) - (x - ax) * (by - ay)
+        on_edge |= (is_left == 0) & (min(ax, bx) <= x) & (x <= max(ax, bx)) & (min(ay, by) <= y) & (y <= max(ay, by))
+        wn += (ay <= y) & (by > y) & (is_left > 0)
+        wn -= (ay > y) & (by <= y) & (is_left < 0)
+    return on_edge | (wn != 0)
+
+def ray_entry_convex(edges, x, y, dx, dy, horizon):
+    """
+    Entree dans un polygone convexe d'un point en mouvement uniforme (x + t*dx, y + t*dy), par intersection
+    de la demi-droite avec les demi-plans des aretes compilees (voir compile_polygon)
+    :return: le premier instant t de [0, horizon] ou le point est dans le polygone, None s'il n'y entre pas
+    """
+    (t_in, t_out) = (0.0, horizon)
+    for (ax, ay, abx, aby) in edges:
+        num = aby * (x - ax) - abx * (y - ay) # Positif ou nul : du bon cote de l'arete au depart
+        den = abx * dy - aby * dx
+        if den > 0: # S'eloigne du demi-plan : en sort a num / den
+            t_out = min(t_out, num / den)
+        elif den < 0: # S'en rapproche : y entre a num / den
+            t_in = max(t_in, num / den)
+        elif num < 0: # Parallele a l'arete, du mauvais cote
+            return None
+        if t_in > t_out:
+            return None
+    return t_in
+
+def ray_entry(vertexes, x, y, dx, dy, horizon):
+    """
+    Comme ray_entry_convex pour un polygone quelconque, le point etant hors du polygone au depart : premier
+    croisement de la demi-droite avec une arete
+    :return: le premier instant t de [0, horizon] ou le point atteint le bord du polygone, None s'il ne l'atteint pas
+    """
+    best = None
+    nbp = len(vertexes)
+    for i in range(nbp):
+        (ax, ay) = vertexes[i]
+        (ex, ey) = (vertexes[(i + 1) % nbp][0] - ax, vertexes[(i + 1) % nbp][1] - ay)
+        cross = dx * ey - dy * ex
+        if cross == 0: # Parallele a l'arete : le croisement se fait par une arete voisine
+            continue
+        (px, py) = (ax - x, ay - y)
+        t = (px * ey - py * ex) / cross
+        s = (px * dy - py * dx) / cross
+        if 0 <= s <= 1 and 0 <= t <= horizon and (best is None or t < best):
+            best = t
+    return best
+
+
+class SlabIndex(object):
+    """Index de localisation d'un point dans un ensemble de polygones simples"""
+
+    def __init__(self, polygons, keys=None, contains=None):
+        """
+        :param polygons: liste de polygones (listes de sommets (x,y))
+        :param keys: cles retournees pour chaque polygone (indices des polygones par defaut)
+        :param contains: test exact contains(cle, x, y) utilise pres des bords (winding_number par defaut)
+        """
+        self.polygons = [tuple(poly) for poly in polygons]
+        self.keys = list(range(len(polygons))) if keys is None else list(keys)
+        if contains is None:
+            vertexes = dict(zip(self.keys, self.polygons))
+            contains = lambda key, x, y: winding_number(vertexes[key], x, y)
+        self.contains = contains
+
+        # Aretes non verticales, orientees de gauche a droite : (cle, x0, y0, x1, y1)
+        edges = []
+        xs = set()
+        for key, poly in zip(self.keys, self.polygons):
+            nbp = len(poly)
+            for i in range(nbp):
+                (ax, ay) = poly[i]
+                (bx, by) = poly[(i + 1) % nbp]
+                xs.add(ax)
+                if ax < bx:
+                    edges.append((key, ax, ay, bx, by))
+                elif bx < ax:
+                    edges.append((key, bx, by, ax, ay))
+        xs.update(_crossings(edges))
+        self.xs = sorted(xs)
+        xext = self.xs[-1] - self.xs[0] if self.xs else 0
+        yext = max([abs(y) for poly in self.polygons for (x, y) in poly] or [0])
+        self.eps_x = REL_TOL * (xext + 1)
+
+        # Pour chaque tranche : aretes (x0, y0, pente, marge) de bas en haut, et cles des polygones de chaque trapeze
+        self.slabs = []
+        for s in range(len(self.xs) - 1):
+            xa, xb = self.xs[s], self.xs[s + 1]
+            xm = (xa + xb) / 2
+            lines = []
+            for (key, x0, y0, x1, y1) in edges:
+                if x0 <= xa and x1 >= xb:
+                    slope = (y1 - y0) / (x1 - x0)
+                    lines.append((y0 + (xm - x0) * slope, key, (x0, y0, slope, REL_TOL * (yext + abs(slope) * xext + 1))))
+            lines.sort(key=lambda line: line[0])
+            labels = [frozenset()]
+            for (_, key, _) in lines:
+                labels.append(labels[-1] ^ frozenset([key])) # Traverser une arete fait entrer ou sortir de son polygone
+            self.slabs.append((tuple(line for (_, _, line) in lines), tuple(labels)))
+
+    def locate(self, x, y):
+        """:return: l'ensemble (frozenset) des cles des polygones contenant le point (x, y)"""
+        xs = self.xs
+        if not xs or not (xs[0] <= x <= xs[-1]):
+            return frozenset()
+        s = bisect_right(xs, x) - 1
+        if s == len(xs) - 1 or x - xs[s] <= self.eps_x or xs[s + 1] - x <= self.eps_x:
+            return self.exact(x, y) # Sur une frontiere de tranche
+        lines, labels = self.slabs[s]
+        lo, hi = 0, len(lines)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (x0, y0, slope, eps) = lines[mid]
+            if y0 + (x - x0) * slope < y:
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in (lo - 1, lo): # Aretes encadrant le point
+            if 0 <= i < len(lines):
+                (x0, y0, slope, eps) = lines[i]
+                if abs(y0 + (x - x0) * slope - y) <= eps:
+                    return self.exact(x, y)
+        return labels[lo]
+
+    def exact(self, x, y):
+        """Test exact de tous les polygones"""
+        return frozenset(key for key in self.keys if self.contains(key, x, y))
+
+    def validate(self, points):
+        """
+        Compare la localisation au nombre d'enroulement
+        :return: liste des points en desaccord
+        """
+        return [(x, y) for (x, y) in points
+                if self.locate(x, y) != frozenset(key for key, poly in zip(self.keys, self.polygons)
+                                                  if winding_number(poly, x, y))]
+
+
+def _crossings(edges):
+    """:return: les abscisses des croisements entre aretes (strictement a l'interieur des deux aretes)"""
+    xs = []
+    for i in range(len(edges)):
+        (_, ax, ay, bx, by) = edges[i]
+        for j in range(i + 1, len(edges)):
+            (_, cx, cy, dx, dy) = edges[j]
+            if cx >= bx or dx <= ax:
+                continue
+            denom = (bx - ax) * (dy - cy) - (by - ay) * (dx - cx)
+            if denom == 0:
+                continue # Aretes paralleles
+            t = ((cx - ax) * (dy - cy) - (cy - ay) * (dx - cx)) / denom
+            u = ((cx - ax) * (by - ay) - (cy - ay) * (bx - ax)) / denom
+            if 0 < t < 1 and 0 < u < 1:
+                xs.append(ax + t * (bx - ax))
+    return xs
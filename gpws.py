@@ -1,15 +1,8 @@
-from ivy.std_api import *
-import sys, logging, math
+import sys, re, logging, math, time
+from array import array
 logger = logging.getLogger('Ivy')
 from optparse import OptionParser
-
-
-try:
-    import pygame
-    TEST_SON = True
-except ImportError:
-    print("Module pygame non installe : impossible de lire les sons")
-    TEST_SON = False
+import audio, geometry, sensors, asynclog, metrics, profil
 
 # Abcsisses/Ordornnees des modes
 VZ = 0
@@ -19,6 +12,9 @@ MSL_ALT_LOSS = 3
 COMPUTED_AIR_SPEED = 4
 GLIDE_SLOPE_DEVIATION = 5
 ROLL_ANGLE = 6
+NB_VARIABLES = 7
+ALL_VARIABLES = (1 << NB_VARIABLES) - 1 # Masque de toutes les variables (bit i pour Etat.list[i])
+UNKNOWN = float("nan") # Valeur d'une variable inconnue dans Etat.list
 
 
 #Coefficents de conversion
@@ -30,6 +26,10 @@ MS_TO_KTS = 1.94384
 #Gear
 DOWN = "Down"
 UP = "Up"
+GEARS = [DOWN, UP]
+
+#Flaps
+FLAPS = ["Full", "3", "2", "1", "0"]
 
 #Phase
 APP = "APPROACH"
@@ -38,69 +38,138 @@ TAKEOFF  = "TAKE-OFF"
 LDG = "LANDING"
 CRZ  = "CRUISE"
 
+#Valeurs admises dans les profils d'enveloppes
+VOCABULARY = profil.Vocabulary({"VZ": VZ, "RADIOALT": RADIOALT, "TERRAIN_CLOSURE_RATE": TERRAIN_CLOSURE_RATE,
+                                "MSL_ALT_LOSS": MSL_ALT_LOSS, "COMPUTED_AIR_SPEED": COMPUTED_AIR_SPEED,
+                                "GLIDE_SLOPE_DEVIATION": GLIDE_SLOPE_DEVIATION, "ROLL_ANGLE": ROLL_ANGLE},
+                               FLAPS, GEARS, [APP, CLIMB, TAKEOFF, LDG, CRZ])
+
 #Callouts
 CALLOUTS = [(0, "sons/nappminimuns.wav)"), (10,"sons/abn10.wav"), (20,"sons/abn20.wav"), (30,"sons/abn30.wav"),
             (40,"sons/abn40.wav"),
             (50,"sons/abn50.wav"), (100, "sons/abn100.wav"), (500, "sons/abn500"),
             (1000, "sons/abn1000.wav"), (2500, "sons/abn2500.wav")]
 
+#Nombre total de sommets a partir duquel un mode localise les points avec un index en tranches (geometry.SlabIndex)
+SLAB_INDEX_MIN_VERTEXES = 32
+
+#Nombre d'echantillons gardes par mesure pour estimer les derivees (voir sensors.SensorHistory)
+SENSOR_SAMPLES = 5
+
+#Declenchement de l'evaluation des enveloppes (option --trigger)
+TRIGGER_TICK = "tick" # A chaque message Time
+TRIGGER_INPUT = "input" # Aussi apres chaque message capteur ("input:<ms>" : au plus une fois par intervalle et par avion)
+
+#Traces de l'etat complet : tous les STATE_EVERY ticks (option --state-every) et a chaque changement d'alarme ou de configuration
+STATE_EVERY = 10
+STATE_FORMAT = ("Vertical speed = %s\nRadio_alt = %s\nTerrain closure rate = %s\nMSl altitude loss = %s\n"
+                "Computed airspeed = %s\nGlideslopeDeviation = %s\nRoll angle = %s\nPhase = %s\n")
+
+#Periode de publication des mesures de fonctionnement (message GPWS_STATS, voir metrics.py), en secondes
+STATS_PERIOD = 10
+
 #Ivy messages
+LOOKAHEAD_HORIZON = 30 # Horizon (s) par defaut de l'anticipation des alarmes (voir Lookahead)
+TIME_TO_ALERT_MSG = "TimeToAlert" # Prefixe du message d'anticipation : TimeToAlert <mode>=<s> ...
+
 PULLUP_MSG = "Pullup={}"
 STOP_PULLUP_UP_MSG = "StopPullup"
+AIRCRAFT_KEY = "ac="
+AIRCRAFT_FIELD = " " + AIRCRAFT_KEY + "{}" # Identifiant de l'avion, en fin des messages concernant un avion en particulier
+
 
+player = audio.SoundPlayer() # Demarre par main ou a la premiere alarme (voir audio.py)
+ivy_api = None # Module ivy.std_api, importe par import_ivy : seuls les agents connectes au bus le chargent
+
+def import_ivy():
+    """
+    Importe Ivy au premier appel (l'import d'Ivy installe aussi le handler des traces du logger 'Ivy')
+    :return: le module ivy.std_api
+    """
+    global ivy_api
+    if ivy_api is None:
+        from ivy import std_api
+        ivy_api = std_api
+    return ivy_api
+
+def init_logging(level=logging.INFO):
+    """Traces sur la sortie d'erreur, au format d'Ivy, pour les outils qui n'importent pas Ivy"""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(level)
 
-def play_sound(sound):
+def play_sound(sound, priority=audio.CALLOUT_PRIORITY):
     """
-    Joue un son
+    Demande la lecture d'un son au lecteur audio, sans attendre la fin de la lecture
     :param sound: chemin du sons a jouer
+    :param priority: priorite du son (la plus petite coupe les sons moins prioritaires)
     :return: ()
     """
-    if TEST_SON:
-        pygame.init()
-        song = pygame.mixer.Sound(sound)
-        song.play()
-        while pygame.mixer.get_busy():
-             pygame.time.delay(100)
-        pygame.quit()
-    else:
-        print("Lecture de ", sound)
+    player.play(sound, priority)
 
 #Classes
-class Enveloppe():
-    def __init__(self, vertexes, alertlevel, priority, flaps, gear, name, sound, pullup=False):
+class Enveloppe(object):
+    __slots__ = ('vertexes', 'alertlevel', 'priority', 'flaps', 'gear', 'sound', 'name', 'pullup', 'edges', 'bbox',
+                 'index')
+
+    def __init__(self, vertexes, alertlevel, priority, flaps, gear, name, sound, pullup=False, compiled=None):
+        """
+        :param compiled: (edges, bbox, convexe) deja calcules pour les sommets, alors deja dans le sens horaire
+                         (profils compiles, voir profil.py)
+        """
+        if compiled is None:
+            vertexes = geometry.normalize(vertexes) # Sens horaire
+            compiled = geometry.compile_polygon(vertexes) + (geometry.is_convex(vertexes),)
         self.vertexes = vertexes
         self.alertlevel = alertlevel
         self.priority = priority
-        self.flaps = flaps
-        self.gear = gear
+        self.flaps = tuple(flaps)
+        self.gear = tuple(gear)
         self.sound = sound
         self.name = name
         self.pullup = pullup
+        (self.edges, self.bbox, convex) = compiled # Geometrie compilee une fois pour toutes
+        self.index = None # Index de localisation, pour les polygones non convexes uniquement
+        if not convex:
+            self.index = geometry.SlabIndex([self.vertexes])
 
     def collision(self,P):
         """
         :param P: point de coordonees (x,y)
         :return: True si le point est dans le polygone definissant l'enveloppe
         """
-        graphe = self.vertexes
-        nbp = len(graphe)
-        for i in range(0,nbp):
-            A = graphe[i]
-            if i == nbp-1:
-                B = graphe[0]
-            else:
-                B = graphe[i+1]
-            AB = [0,0]
-            AP = [0,0]
-            AB[0] = B[0] - A[0]
-            AB[1] = B[1] - A[1]
-            AP[0] = P[0] - A[0]
-            AP[1] = P[1] - A[1]
-            d = AB[0]*AP[1] - AB[1]*AP[0]
-            if d>0 :
+        x = P[0]
+        y = P[1]
+        (xmin, ymin, xmax, ymax) = self.bbox
+        if not (xmin <= x <= xmax and ymin <= y <= ymax): # Rejet rapide par la boite englobante
+            return False
+        if self.index is not None:
+            return bool(self.index.locate(x, y))
+        for (ax, ay, abx, aby) in self.edges:
+            if abx * (y - ay) - aby * (x - ax) > 0:
                 return False
         return True
 
+    def time_to_entry(self, P, velocity, horizon):
+        """
+        :param P: point de coordonees (x,y)
+        :param velocity: variation (dx/dt, dy/dt) du point
+        :param horizon: instant au-dela duquel l'entree n'est pas cherchee
+        :return: le temps avant que le point, prolonge a vitesse constante, entre dans l'enveloppe (0 s'il y est deja),
+                 None s'il n'y entre pas avant l'horizon
+        """
+        if self.collision(P):
+            return 0.0
+        (x, y) = (P[0] + horizon * velocity[0], P[1] + horizon * velocity[1]) # Point a l'horizon
+        (xmin, ymin, xmax, ymax) = self.bbox
+        if max(P[0], x) < xmin or min(P[0], x) > xmax or max(P[1], y) < ymin or min(P[1], y) > ymax:
+            return None # Rejet rapide : le segment parcouru ne rencontre pas la boite englobante
+        if self.index is not None:
+            return geometry.ray_entry(self.vertexes, P[0], P[1], velocity[0], velocity[1], horizon)
+        return geometry.ray_entry_convex(self.edges, P[0], P[1], velocity[0], velocity[1], horizon)
+
     def have_inside(self, point, flaps, gear):
         """
 
@@ -109,19 +178,29 @@ class Enveloppe():
         :param gear: position des gears
         :return: True si dans la config consideree, le point est dans l'enveloppe
         """
-        if (flaps not in self.flaps and self.flaps[0] != None) or (gear not in self.gear and self.gear[0] != None): # Si la config n'est pas bonne
+        if not self.accepts(flaps, gear): # Si la config n'est pas bonne
             return False
         else:
             return self.collision(point)
 
+    def accepts(self, flaps, gear):
+        """
+        :param flaps: position des flaps
+        :param gear: position des gears
+        :return: True si l'enveloppe s'applique dans cette configuration
+        """
+        return (flaps in self.flaps or self.flaps[0] == None) and (gear in self.gear or self.gear[0] == None)
+
     def play_sound(self):
         """Joue l'alarme de l'env"""
-        play_sound(self.sound)
+        play_sound(self.sound, self.priority)
 
     def __repr__(self):
         return self.name
 
 class Mode():
+    generation = 0 # Incremente a chaque activation/desactivation d'un mode pour invalider les tables de dispatch
+
     def __init__(self, list_enveloppes, phase, abs, ord, name):
         self.list_enveloppes = list_enveloppes
         self.phase = phase
@@ -129,6 +208,12 @@ class Mode():
         self.ord = ord
         self.abs = abs
         self.name = name
+        self.tables = {} # (flaps, gear) -> enveloppes applicables triees par priorite
+        self.lut = None # Table de correspondance rasterisee optionnelle (voir lut.py)
+        self.index = None # Index de localisation commun aux enveloppes, pour les modes a nombreux sommets
+        if sum(len(env.vertexes) for env in list_enveloppes) >= SLAB_INDEX_MIN_VERTEXES:
+            self.index = geometry.SlabIndex([env.vertexes for env in list_enveloppes], keys=list_enveloppes,
+                                            contains=lambda env, x, y: env.collision((x, y)))
 
     def get_enveloppe(self, point, flaps, gear):
         """
@@ -138,45 +223,79 @@ class Mode():
         :param gear: position du gear
         :return: L'enveloppe dans lequel se trouve le point dans la configuration consideree, None sion
         """
-        enveloppe_eff = [] #listes des enveloppes ou se trouve le point
-        for env in self.list_enveloppes:
-            if env.have_inside(point, flaps, gear):
-                enveloppe_eff.append(env)
-        if len(enveloppe_eff) == 0:
-            return None #Le point n'est dans aucune enveloppe
-        else:
-            key_sort = lambda env : env.priority
-            enveloppe_eff.sort(key=key_sort) #On trie selon la plus petite prioritee
-            return enveloppe_eff[0]
+        if self.lut is not None:
+            return self.lut.get_enveloppe(point, flaps, gear)
+        return self.find_enveloppe(point, flaps, gear)
+
+    def find_enveloppe(self, point, flaps, gear):
+        """Comme get_enveloppe, en testant exactement les polygones"""
+        if self.index is not None:
+            inside = self.index.locate(point[0], point[1])
+            for env in self.get_table(flaps, gear):
+                if env in inside:
+                    return env
+            return None
+        for env in self.get_table(flaps, gear):
+            if env.collision(point):
+                return env
+        return None #Le point n'est dans aucune enveloppe
+
+    def get_table(self, flaps, gear):
+        """
+        :return: les enveloppes applicables dans la configuration, triees par priorite croissante
+        """
+        key = (flaps, gear)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = tuple(sorted((env for env in self.list_enveloppes if env.accepts(flaps, gear)),
+                                                    key=lambda env: env.priority))
+        return table
 
 
     def get_xmin_ymin_xmax_ymax(self):
         """ Retourne les coordonnees extremes des enveloppes du mode (utile pour les tests)"""
 
-        xmin = xmax = self.list_enveloppes[0].vertexes[0][0]
-        ymin = ymax = self.list_enveloppes[0].vertexes[0][1]
+        (xmin, ymin, xmax, ymax) = self.list_enveloppes[0].bbox
         for env in self.list_enveloppes:
-            for (x, y) in env.vertexes:
-                if x < xmin:
-                   xmin = x
-                elif x > xmax:
-                    xmax = x
-                if y < ymin:
-                    ymin = y
-                elif y > ymax:
-                    ymax = y
+            xmin = min(xmin, env.bbox[0])
+            ymin = min(ymin, env.bbox[1])
+            xmax = max(xmax, env.bbox[2])
+            ymax = max(ymax, env.bbox[3])
         return (xmin, ymin, xmax, ymax)
 
 
+    def accepts(self, phase):
+        """
+        :param phase: phase de vol
+        :return: True si le mode est actif et s'applique dans cette phase
+        """
+        return self.on and (phase in self.phase or self.phase[0] == None)
+
     def disable(self):
         self.on = False
+        Mode.generation += 1
 
     def enable(self):
         self.on = True
+        Mode.generation += 1
+
+class Etat(object):
+    """
+    Etat d'un avion. Les sept variables sont rangees dans un tableau de doubles (array 'd', indices VZ a ROLL_ANGLE),
+    une variable inconnue (None) y etant codee UNKNOWN ; les autres attributs sont fixes par __slots__.
+    """
+    __slots__ = ('list', 'flaps', 'gear', 'phase', 'da', 'dh', 'time', 'last_radio', 'is_pullup', 'last_callout',
+                 'max_ralt', 'init_ralt', 'init_state', 'init_fms', 'init_config', 'dispatch', 'dispatch_generation',
+                 'ralt_history', 'vz_history', 'cas_history', 'dirty', 'results', 'result',
+                 'input_time', 'last_evaluation', 'alerted', 'state_ticks', 'state_key')
 
-class Etat():
     def __init__(self,VerticalSpeed,RadioAltitude,TerrainClosureRate,MSLAltitudeLoss,ComputedAirSpeed,GlideSlopeDeviation,RollAngle,flaps,gear,phase):
-        self.list = [VerticalSpeed, RadioAltitude, TerrainClosureRate, MSLAltitudeLoss, ComputedAirSpeed, GlideSlopeDeviation, RollAngle]
+        self.list = array('d', [UNKNOWN if value is None else value for value in
+                                (VerticalSpeed, RadioAltitude, TerrainClosureRate, MSLAltitudeLoss, ComputedAirSpeed, GlideSlopeDeviation, RollAngle)])
+        self._init(flaps, gear, phase)
+
+    def _init(self, flaps, gear, phase):
+        """Initialise les attributs autres que les variables"""
         self.flaps = flaps
         self.gear = gear
         self.phase = phase
@@ -192,33 +311,95 @@ class Etat():
 
         self.max_ralt = 0 # POur connaitre le msl altitude loss
 
+        # Derniers echantillons de radio altitude, vitesse verticale et vitesse air, crees au premier message
+        # (les copies et les instantanes n'en ont pas)
+        self.ralt_history = None
+        self.vz_history = None
+        self.cas_history = None
+
         # Attribut permettant de savoir si l'etat est correctement initialise
         self.init_ralt = False
         self.init_state = False
         self.init_fms = False
         self.init_config = False
 
+        # Table de dispatch de la configuration courante (voir build_dispatch), reconstruite a la demande
+        self.dispatch = None
+        self.dispatch_generation = Mode.generation
+
+        # Evaluation incrementale (voir test_mode) : variables modifiees depuis la derniere evaluation,
+        # enveloppe retenue par chaque mode de la table de dispatch et enveloppe retenue au total
+        self.dirty = ALL_VARIABLES
+        self.results = None
+        self.result = None
+
+        # Declenchement (voir evaluate) : heure de la premiere entree non encore evaluee, heure de la derniere
+        # evaluation et enveloppe retenue par celle-ci
+        self.input_time = None
+        self.last_evaluation = None
+        self.alerted = None
+
+        # Echantillonnage des traces de l'etat (voir StateSampling) : ticks depuis la derniere trace, et
+        # (enveloppe, phase, flaps, gear) a la derniere trace
+        self.state_ticks = 0
+        self.state_key = None
+
 
     def get_VerticalSpeed(self):
-        return self.list[VZ]
+        value = self.list[VZ]
+        return None if value != value else value
 
     def get_RadioAltitude(self):
-        return self.list[RADIOALT]
+        value = self.list[RADIOALT]
+        return None if value != value else value
 
     def get_TerrainClosureRate(self):
-        return self.list[TERRAIN_CLOSURE_RATE]
+        value = self.list[TERRAIN_CLOSURE_RATE]
+        return None if value != value else value
 
     def get_MSLAltitudeLoss(self):
-        return self.list[MSL_ALT_LOSS]
+        value = self.list[MSL_ALT_LOSS]
+        return None if value != value else value
 
     def get_ComputedAirSpeed(self):
-        return self.list[COMPUTED_AIR_SPEED]
+        value = self.list[COMPUTED_AIR_SPEED]
+        return None if value != value else value
 
     def get_GlideSlopeDeviation(self):
-        return self.list[GLIDE_SLOPE_DEVIATION]
+        value = self.list[GLIDE_SLOPE_DEVIATION]
+        return None if value != value else value
 
     def get_RollAngle(self):
-        return self.list[ROLL_ANGLE]
+        value = self.list[ROLL_ANGLE]
+        return None if value != value else value
+
+    def rates(self):
+        """
+        :return: liste des variations (par unite de temps des messages Time) des variables de Etat.list, estimees par
+                 les pentes lissees des mesures (voir sensors.py) ; 0 pour les variables sans historique
+        """
+        rates = [0.0] * NB_VARIABLES
+        ralt = None if self.ralt_history is None else self.ralt_history.slope()
+        if ralt is not None:
+            rates[RADIOALT] = ralt
+            if self.phase == TAKEOFF and ralt < 0: # La perte d'altitude augmente tant que l'avion descend
+                rates[MSL_ALT_LOSS] = - ralt
+        for (i, history) in ((VZ, self.vz_history), (COMPUTED_AIR_SPEED, self.cas_history)):
+            slope = None if history is None else history.slope()
+            if slope is not None:
+                rates[i] = slope
+        return rates
+
+    def _set(self, i, value):
+        """Modifie la variable i, en la marquant modifiee si sa valeur change"""
+        if self.list[i] != value:
+            self.list[i] = value
+            self.dirty |= 1 << i
+
+    def view(self):
+        """:return: vue NumPy (NB_VARIABLES,) des variables, sans copie (une variable inconnue y vaut NaN)"""
+        import numpy
+        return numpy.frombuffer(self.list, dtype=float)
 
     def generate_radioalt(self):
         """ Pour les tests uniquement """
@@ -264,61 +445,92 @@ class Etat():
             self.list[COMPUTED_AIR_SPEED]  =   abs(self.get_VerticalSpeed() * FTMIN_TO_MS/( math.sin(gamma) * KTS_TO_MS))
         if self.get_ComputedAirSpeed() == None:
             self.list[COMPUTED_AIR_SPEED] = 0
+        self.dirty = ALL_VARIABLES
 
 
 
     def change_radio_alt(self, z):
         z = z / FT_TO_M #conversion m to ft
-        if global_etat.init_ralt and  (self.time - self.last_radio) != 0: #On met a jour le terrain closure rate si possible
-            self.list[TERRAIN_CLOSURE_RATE] = ((self.get_RadioAltitude() - z)/ (self.time - self.last_radio) )  * 60
-        self.list[RADIOALT] = z
+        if self.ralt_history is None:
+            self.ralt_history = sensors.SensorHistory(SENSOR_SAMPLES)
+        self.ralt_history.add(self.time, z)
+        slope = self.ralt_history.slope()
+        if slope is not None: #On met a jour le terrain closure rate si possible (pente lissee, ft/s -> ft/min)
+            self._set(TERRAIN_CLOSURE_RATE, - slope * 60)
+        self._set(RADIOALT, z)
         self.last_radio = self.time
         if self.phase == TAKEOFF :
-            if z > self.max_ralt:
-                self.max_ralt = z
+            ralt = self.ralt_history.estimate()
+            if ralt > self.max_ralt:
+                self.max_ralt = ralt
         else:self.max_ralt = 0
 
-    def change_state(self, x, y, z, vp, fpa, psi, phi):
-        self.list[COMPUTED_AIR_SPEED] = vp * MS_TO_KTS #conversion ms to kts
-        self.list[VZ] =  - (math.sin(fpa) * vp) / FTMIN_TO_MS #conversion m/s to - ft/min
-        self.list[ROLL_ANGLE] = math.degrees(abs(phi))
+    def change_state(self, vp, fpa, phi):
+        self._set(COMPUTED_AIR_SPEED, vp * MS_TO_KTS) #conversion ms to kts
+        self._set(VZ, - (math.sin(fpa) * vp) / FTMIN_TO_MS) #conversion m/s to - ft/min
+        if self.cas_history is None:
+            self.cas_history = sensors.SensorHistory(SENSOR_SAMPLES)
+            self.vz_history = sensors.SensorHistory(SENSOR_SAMPLES)
+        self.cas_history.add(self.time, self.list[COMPUTED_AIR_SPEED])
+        self.vz_history.add(self.time, self.list[VZ])
+        self._set(ROLL_ANGLE, math.degrees(abs(phi)))
 
     def change_fmsinfo(self, phase, da, dh):
+        if phase != self.phase:
+            self.dispatch = None
+            self.dirty = ALL_VARIABLES
         self.phase = phase
         self.da = da
         self.dh = dh
-        alt_diff = self.max_ralt - self.get_RadioAltitude()
-        if self.phase == TAKEOFF and self.init_ralt and (self.max_ralt - self.get_RadioAltitude() > 0) and self.get_VerticalSpeed() > 0:
-            self.list[MSL_ALT_LOSS] = alt_diff
+        # Perte mesuree sur la radio altitude lissee
+        ralt = None if self.ralt_history is None else self.ralt_history.estimate()
+        if ralt is None:
+            ralt = self.get_RadioAltitude()
+        alt_diff = self.max_ralt - ralt
+        if self.phase == TAKEOFF and self.init_ralt and alt_diff > 0 and self.get_VerticalSpeed() > 0:
+            self._set(MSL_ALT_LOSS, alt_diff)
         else:
-            self.list[MSL_ALT_LOSS] = 0
+            self._set(MSL_ALT_LOSS, 0)
 
 
     def change_config(self, flaps, gear):
+        if flaps != self.flaps or gear != self.gear:
+            self.dispatch = None
+            self.dirty = ALL_VARIABLES
         self.flaps = flaps
         self.gear = gear
 
-    def callout(self):
+    def callout(self, sortie=None):
+        if sortie is None:
+            sortie = bus
         if self.phase == APP and self.get_VerticalSpeed() > 0 :
             ralt = self.get_RadioAltitude()
             for i in range(self.last_callout):
                 (callout, sound) = CALLOUTS[i]
                 if ralt <= callout + self.dh:
-                    play_sound(sound)
-                    print("Callout:  {}".format(callout))
+                    sortie.play(sound, audio.CALLOUT_PRIORITY)
+                    sortie.log("Callout:  %s", callout)
                     self.last_callout = i
                     break
 
 
 
+    def get_dispatch(self):
+        """Retourne la table de dispatch de la configuration courante, reconstruite si la configuration a change"""
+        if self.dispatch is None or self.dispatch_generation != Mode.generation:
+            self.dispatch = build_dispatch(get_modes(), self.flaps, self.gear, self.phase)
+            self.dispatch_generation = Mode.generation
+            self.results = None
+            self.dirty = ALL_VARIABLES
+        return self.dispatch
+
     def is_init(self):
         return self.init_config and self.init_fms and self.init_ralt and self.init_state
 
     def __copy__(self):
-        copy = Etat(self.get_VerticalSpeed(), self.get_RadioAltitude(), self.get_TerrainClosureRate(),
-                    self.get_MSLAltitudeLoss(), self.get_ComputedAirSpeed(), self.get_GlideSlopeDeviation(),
-                    self.get_RollAngle(), self.flaps, self.gear, self.phase
-                    )
+        copy = Etat.__new__(Etat)
+        copy.list = self.list[:]
+        copy._init(self.flaps, self.gear, self.phase)
         copy.da = self.da
         copy.dh = self.dh
         copy.init_fms = self.init_fms
@@ -328,94 +540,586 @@ class Etat():
         return copy
 
 
+    def values(self):
+        """:return: tuple fige des variables et de la phase, arguments de STATE_FORMAT"""
+        return (self.get_VerticalSpeed(), self.get_RadioAltitude(), self.get_TerrainClosureRate(),
+                self.get_MSLAltitudeLoss(), self.get_ComputedAirSpeed(), self.get_GlideSlopeDeviation(),
+                self.get_RollAngle(), self.phase)
+
     def __repr__(self):
-        to_print = ""
-        to_print +=  "Vertical speed = {}\n".format(self.get_VerticalSpeed())
-        to_print +=  "Radio_alt = {}\n".format(self.get_RadioAltitude())
-        to_print +=  "Terrain closure rate = {}\n".format(self.get_TerrainClosureRate())
-        to_print +=  "MSl altitude loss = {}\n".format(self.get_MSLAltitudeLoss())
-        to_print +=  "Computed airspeed = {}\n".format(self.get_ComputedAirSpeed())
-        to_print +=  "GlideslopeDeviation = {}\n".format(self.get_GlideSlopeDeviation())
-        to_print +=  "Roll angle = {}\n".format(self.get_RollAngle())
-        to_print += "Phase = {}\n".format(self.phase)
-        return to_print
-
-def Creation_Modes():
-
-    PullUp1 = Enveloppe([[1750,370],[3000,1000],[6225,2075],[8000,2075],[8000,0],[1750,0]],'W',2,[None],[None],
-                        "Pullup_rate_sink", "sons/nabpullup.wav", pullup=True)
-    SinkRate1 = Enveloppe([[1750,370],[2610,1180],[5150,2450],[8000,2450],[8000,0],[1750,0]],'C',17,[None],[None],
-                          "Sink rate", "sons/nabsinkrate.wav")
-    PullUp2 = Enveloppe([[2277,220],[3000,790],[8000,790],[8000,0],[2277,0]],'W',3,[None],[None], "Pullup_terrain",
-                        "sons/nabterrainaheadpullup.wav", pullup=True)
-    Terrain2 = Enveloppe([[2277,220],[3000,790],[3900,1500],[6000,1800],[8000,1800],[8000,0],[2277,0]],'C',9,["0"],
-                         [None], "Terrain", "sons/nabterrain.wav")
-    DontSink3 = Enveloppe([[0,0],[143,1500],[400,1500],[400,0]],'C',18,[None],[None], "Don't sink",
-                          "sons/ndontsink.wav")
-    TooLowTerrain4 = Enveloppe([[190,0],[190,500],[250,1000],[400,1000],[400,0],[190,0]],'W',4,[None],[None],
-                               "Too low terrain", "sons/TooLowTerrain.wav")
-    TooLowFlaps4 = Enveloppe([[0,0],[0,245],[190,245],[190,0]],'C',16,["0"],[None], "Too low flaps",
-                             "sons/nabtoolowflaps.wav")
-    TooLowGear4 = Enveloppe([[0,0],[0,500],[190,500],[190,0]],'C',15,[None],[UP], "Too low gear",
-                            "sons/nabtoolowgear.wav")
-    GlideSlope5 = Enveloppe([[2,300],[4,300],[4,0],[3.68,0],[2,150]],'C',19,[None],[DOWN],
-                            "GLIDESLOPE", "sons/nabglideslope2.wav")
-    GlideSlopeReduced5 = Enveloppe([[1.3,1000],[4,1000],[4,0],[2.98,0],[1.3,150]],'C',19.5,[None],[DOWN],
-                                   "Glideslope (reduced)", "sons/nabglideslope.wav")
-    ExRollAngle_16 = Enveloppe([[10,30],[40,150],[40,0],[10,0]],'C',22,[None],[None], "Bank angle",
-                               "sons/nbankangle.wav")
-    ExRollAngle_26 = Enveloppe([[40,0],[40,5000],[180,5000],[180,0]],'C',22,[None],[None], "Bank angle",
-                               "sons/nbankangle.wav")
-
-
-    Mode1 = Mode([PullUp1,SinkRate1],[None],VZ,RADIOALT, "mode1")
-    Mode2 = Mode([PullUp2,Terrain2], [None],TERRAIN_CLOSURE_RATE,RADIOALT, "mode2")
-    Mode3 = Mode([DontSink3],[TAKEOFF],MSL_ALT_LOSS,RADIOALT, "mode3")
-    Mode4 = Mode([TooLowTerrain4,TooLowFlaps4,TooLowGear4], [APP, LDG, TAKEOFF], COMPUTED_AIR_SPEED, RADIOALT, "mode4")
-    Mode5 = Mode([GlideSlopeReduced5,GlideSlope5],[APP],GLIDE_SLOPE_DEVIATION,RADIOALT, "mode5")
-    Mode5.disable()
-    Mode6 = Mode([ExRollAngle_16, ExRollAngle_26],[None],ROLL_ANGLE,RADIOALT, "mode6")
-
-    return [Mode1,Mode2,Mode3,Mode4,Mode5,Mode6]
-
-L_Modes = Creation_Modes()
+        return STATE_FORMAT % self.values()
+
+class Historique(object):
+    """
+    Instantanes successifs d'etats. Les variables sont rangees bout a bout dans un seul tableau de doubles
+    (NB_VARIABLES par instantane) et la configuration (flaps, gear, phase, da, dh) n'est stockee qu'une fois
+    tant qu'elle ne change pas.
+    """
+    __slots__ = ('values', 'configs', 'size')
+
+    def __init__(self, capacity=64):
+        """:param capacity: nombre d'instantanes prevus (le tableau double de taille lorsqu'il est plein)"""
+        self.values = array('d', [0.0]) * (NB_VARIABLES * max(1, capacity))
+        self.configs = []
+        self.size = 0
+
+    def append(self, etat):
+        """Ajoute un instantane de l'etat"""
+        start = self.size * NB_VARIABLES
+        if start == len(self.values):
+            # Nouveau tableau plutot qu'agrandissement : les vues deja retournees restent valables
+            self.values = self.values + array('d', [0.0]) * len(self.values)
+        self.values[start:start + NB_VARIABLES] = etat.list
+        config = (etat.flaps, etat.gear, etat.phase, etat.da, etat.dh)
+        if self.configs and self.configs[-1] == config:
+            config = self.configs[-1]
+        self.configs.append(config)
+        self.size += 1
+
+    def extend(self, values, etat):
+        """
+        Ajoute des instantanes calcules par ailleurs (voir trajectoire.py)
+        :param values: tableau NumPy (n, NB_VARIABLES) des variables des instantanes
+        :param etat: etat dont la configuration (flaps, gear, phase, da, dh) est celle des instantanes
+        """
+        start = self.size * NB_VARIABLES
+        end = start + values.size
+        if end > len(self.values):
+            capacity = len(self.values)
+            while capacity < end:
+                capacity *= 2
+            self.values = self.values + array('d', [0.0]) * (capacity - len(self.values))
+        self.values[start:end] = array('d', values.astype(float).tobytes())
+        config = (etat.flaps, etat.gear, etat.phase, etat.da, etat.dh)
+        if self.configs and self.configs[-1] == config:
+            config = self.configs[-1]
+        self.configs.extend([config] * len(values))
+        self.size += len(values)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        """:return: copie (voir Etat.__copy__) de l'etat du i-eme instantane"""
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("instantane {} hors de l'historique".format(i))
+        (flaps, gear, phase, da, dh) = self.configs[i]
+        etat = Etat.__new__(Etat)
+        etat.list = self.values[i * NB_VARIABLES:(i + 1) * NB_VARIABLES]
+        etat._init(flaps, gear, phase)
+        etat.da = da
+        etat.dh = dh
+        return etat
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def view(self):
+        """
+        :return: vue NumPy (n, NB_VARIABLES) des instantanes, sans copie, rangee comme Etat.list (voir batch.py) ;
+                 elle ne voit pas les instantanes ajoutes ensuite
+        """
+        import numpy
+        return numpy.frombuffer(self.values, dtype=float)[:self.size * NB_VARIABLES].reshape(self.size, NB_VARIABLES)
+
+def Creation_Modes(profile=profil.DEFAULT):
+    """
+    :param profile: nom d'un profil d'enveloppes de profils/ ou chemin d'un fichier JSON (voir profil.py)
+    :return: les modes du profil
+    :raise ValueError: si le profil est invalide
+    """
+    modes = []
+    for (name, phases, abs, ord, on, enveloppes) in profil.load(profile, VOCABULARY):
+        mode = Mode([Enveloppe(vertexes, alertlevel, priority, flaps, gear, env_name, sound, pullup, compiled=compiled)
+                     for (env_name, vertexes, alertlevel, priority, flaps, gear, sound, pullup, compiled) in enveloppes],
+                    list(phases), abs, ord, name)
+        if not on:
+            mode.disable()
+        modes.append(mode)
+    return modes
+
+L_Modes = [] # Modes du profil courant, charges par load_profile ou au premier appel de get_modes
+
+def load_profile(profile=profil.DEFAULT):
+    """Remplace les modes par ceux d'un profil d'enveloppes (les tables de dispatch des etats sont reconstruites)"""
+    L_Modes[:] = Creation_Modes(profile)
+    Mode.generation += 1
+
+def get_modes():
+    """:return: les modes du profil courant (L_Modes), ceux du profil par defaut s'il n'a pas ete charge"""
+    if not L_Modes:
+        load_profile()
+    return L_Modes
+
+def build_dispatch(modes, flaps, gear, phase):
+    """
+    Construit la table de dispatch d'une configuration
+    :param modes: liste des modes
+    :param flaps: position des flaps
+    :param gear: position du gear
+    :param phase: phase de vol
+    :return: (par_mode, a_plat, tous) :
+             par_mode : tuple de (masque des axes, mode, abscisse, ordonnee, enveloppes) pour les modes actifs ayant
+             une enveloppe applicable, dans l'ordre des modes ; enveloppes est la table du mode (triee par priorite)
+             si ses enveloppes sont testees une a une, None s'il passe par une table rasterisee ou un index ;
+             a_plat : tuple de (enveloppe, abscisse, ordonnee) de toutes ces enveloppes triees par priorite croissante
+             (a priorite egale, dans l'ordre des modes puis des enveloppes), None si un mode n'est pas teste une a une ;
+             tous : tous[dirty] est vrai si le masque de variables modifiees dirty touche tous les modes
+    """
+    par_mode = tuple(((1 << mode.abs) | (1 << mode.ord), mode, mode.abs, mode.ord,
+                      mode.get_table(flaps, gear) if mode.lut is None and mode.index is None else None)
+                     for mode in modes if mode.accepts(phase) and mode.get_table(flaps, gear))
+    a_plat = None
+    if all(table is not None for (_, _, _, _, table) in par_mode):
+        a_plat = [(env, abs, ord) for (_, _, abs, ord, table) in par_mode for env in table]
+        a_plat.sort(key=lambda item: item[0].priority) # Tri stable
+        a_plat = tuple(a_plat)
+    tous = tuple(all(dirty & mask for (mask, _, _, _, _) in par_mode) for dirty in range(ALL_VARIABLES + 1))
+    return par_mode, a_plat, tous
 
 def test_mode(Etat):
-    active_mode = [mode for mode in L_Modes if mode.on]
-    flaps = Etat.flaps
-    gear = Etat.gear
-    L = []
-    for Mode in active_mode:
-        if Etat.phase in Mode.phase or Mode.phase[0] == None:
-            x,y = Etat.get_xy(Mode)
-            L.append(Mode.get_enveloppe([x,y],flaps,gear))
-    L = [e for e in L if e!= None]
-    key_sort = lambda env : env.priority
-    L.sort(key=key_sort) #On trie selon la plus petite prioritee
-    return (L[0] if len(L)!=0 else None)
-
-def alert(env, etat):
-    print ("alert : {}".format(env.name))
-    env.play_sound()
+    """
+    Evaluation incrementale : seuls les modes dont une variable a change depuis la derniere evaluation sont
+    recalcules, les autres gardent leur resultat. Lorsque tous les modes sont a recalculer, la table a plat est
+    parcourue jusqu'a la premiere enveloppe touchee (les resultats par mode sont alors a refaire au tick suivant).
+    :return: l'enveloppe la plus prioritaire contenant l'etat, None sinon
+    """
+    (par_mode, a_plat, tous) = Etat.get_dispatch()
+    dirty = Etat.dirty
+    if not dirty:
+        return Etat.result
+    values = Etat.list
+    Etat.dirty = 0
+    if a_plat is not None and tous[dirty]:
+        Etat.results = None
+        Etat.result = None
+        for (env, abs, ord) in a_plat:
+            if env.collision((values[abs], values[ord])): # La premiere enveloppe touchee est la plus prioritaire
+                Etat.result = env
+                break
+        return Etat.result
+
+    results = Etat.results
+    if results is None:
+        results = Etat.results = [None] * len(par_mode)
+        dirty = ALL_VARIABLES
+    best = None
+    for i in range(len(par_mode)):
+        (mask, mode, abs, ord, table) = par_mode[i]
+        if dirty & mask:
+            point = (values[abs], values[ord])
+            if table is None:
+                env = mode.get_enveloppe(point, Etat.flaps, Etat.gear)
+            else:
+                env = None
+                for candidate in table:
+                    if candidate.collision(point): # La premiere enveloppe touchee est la plus prioritaire du mode
+                        env = candidate
+                        break
+            results[i] = env
+        else:
+            env = results[i]
+        # A priorite egale, le premier mode l'emporte
+        if env is not None and (best is None or env.priority < best.priority):
+            best = env
+    Etat.result = best
+    return best
+
+class Sortie(object):
+    """Destination des alarmes d'un avion : bus Ivy, haut-parleurs et console"""
+
+    def __init__(self, aircraft=None, sound=True):
+        """
+        :param aircraft: identifiant de l'avion, ajoute aux messages emis (None : messages sans identifiant)
+        :param sound: False pour ne pas jouer les alarmes de cet avion
+        """
+        self.aircraft = aircraft
+        self.sound = sound
+        self.suffix = "" if aircraft is None else AIRCRAFT_FIELD.format(aircraft)
+        self.prefix = "" if aircraft is None else "[{}] ".format(aircraft)
+
+    def send(self, msg):
+        import_ivy().IvySendMsg(msg + self.suffix)
+
+    def play(self, sound, priority):
+        if self.sound:
+            play_sound(sound, priority)
+
+    def emit(self, level, text, args=(), extra=None):
+        """
+        Trace prefixee par l'identifiant de l'avion, formatee seulement si le niveau est actif (voir logging)
+        :param args: arguments de text, valeurs figees (la trace est formatee plus tard, voir asynclog)
+        :param extra: champs ajoutes a la trace
+        """
+        logger.log(level, "%s" + text, self.prefix, *args, extra=extra)
+
+    def log(self, text, *args):
+        self.emit(logging.INFO, text, args)
+
+    def state(self, etat):
+        """Trace l'etat complet"""
+        self.emit(logging.INFO, STATE_FORMAT, etat.values())
+
+    def report(self, env):
+        """Signale une alarme (trace structuree : avion, enveloppe, priorite, pullup)"""
+        self.emit(logging.WARNING, "alert : %s", (env.name,),
+                  {"aircraft": self.aircraft, "enveloppe": env.name, "priority": env.priority, "pullup": env.pullup})
+
+bus = Sortie()
+
+
+class Trigger(object):
+    """Politique de declenchement de l'evaluation, et mesure du delai entre une entree et l'alarme qu'elle provoque"""
+
+    def __init__(self, on_input=False, interval=0):
+        """
+        :param on_input: True pour evaluer aussi apres chaque message capteur
+        :param interval: intervalle minimal (en secondes) entre deux evaluations d'un avion sur entree
+        """
+        self.on_input = on_input
+        self.interval = interval
+        self.clock = time.time
+        self.evaluations = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, latency):
+        """Compte le delai (en secondes) entre la premiere entree non evaluee et l'alarme"""
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def report(self):
+        """:return: resume des delais mesures"""
+        mean = self.total / self.count if self.count else 0
+        return "trigger {} : {} evaluations, {} alerts, input to alert {:.1f} ms mean, {:.1f} ms max".format(
+            self, self.evaluations, self.count, 1000 * mean, 1000 * self.max)
+
+    def __str__(self):
+        if not self.on_input:
+            return TRIGGER_TICK
+        if self.interval:
+            return "{}:{:g}".format(TRIGGER_INPUT, 1000 * self.interval)
+        return TRIGGER_INPUT
+
+def parse_trigger(text):
+    """
+    :param text: "tick", "input" ou "input:<ms>"
+    :return: la politique de declenchement (Trigger) correspondante ; ValueError si le texte est invalide
+    """
+    (policy, _, interval) = text.partition(":")
+    if policy == TRIGGER_TICK and not interval:
+        return Trigger()
+    if policy == TRIGGER_INPUT:
+        interval = float(interval) / 1000 if interval else 0
+        if interval >= 0:
+            return Trigger(True, interval)
+    raise ValueError("invalid trigger policy: {!r}".format(text))
+
+trigger = Trigger()
+
+
+class StateSampling(object):
+    """Echantillonnage des traces de l'etat complet"""
+
+    def __init__(self, every=STATE_EVERY, on_change=True):
+        """
+        :param every: nombre de ticks entre deux traces (0 : pas de trace periodique)
+        :param on_change: True pour tracer aussi lorsque l'alarme, la phase ou la configuration change
+        """
+        self.every = every
+        self.on_change = on_change
+
+    def due(self, etat, env):
+        """:return: True si l'etat est a tracer a ce tick, env etant l'enveloppe retenue"""
+        etat.state_ticks += 1
+        key = (env, etat.phase, etat.flaps, etat.gear)
+        if (self.every and etat.state_ticks >= self.every) or (self.on_change and key != etat.state_key):
+            etat.state_ticks = 0
+            etat.state_key = key
+            return True
+        return False
+
+state_sampling = StateSampling()
+
+
+class Lookahead(object):
+    """
+    Anticipation des alarmes : pour chaque mode actif, temps avant que son point (abscisse, ordonnee), prolonge
+    selon les variations courantes des variables (voir Etat.rates), n'entre dans une enveloppe applicable
+    """
+
+    def __init__(self, horizon=LOOKAHEAD_HORIZON):
+        """:param horizon: temps (s) au-dela duquel une entree n'est pas annoncee"""
+        self.horizon = horizon
+
+    def times(self, etat):
+        """
+        :return: liste de (mode, temps, enveloppe) des modes de la table de dispatch : temps avant la premiere
+                 enveloppe atteinte (0 si le point y est deja, la plus prioritaire a temps egal), (None, None) si
+                 aucune ne l'est avant l'horizon ou si une variable du mode est inconnue
+        """
+        (par_mode, _, _) = etat.get_dispatch()
+        values = etat.list
+        rates = etat.rates()
+        result = []
+        for (_, mode, abs, ord, _) in par_mode:
+            (best, found) = (None, None)
+            point = (values[abs], values[ord])
+            if point[0] == point[0] and point[1] == point[1]: # Variables connues (UNKNOWN vaut NaN)
+                velocity = (rates[abs], rates[ord])
+                for env in mode.get_table(etat.flaps, etat.gear): # Par priorite croissante
+                    t = env.time_to_entry(point, velocity, self.horizon if best is None else best)
+                    if t is not None and (best is None or t < best):
+                        (best, found) = (t, env)
+                        if t == 0:
+                            break
+            result.append((mode, best, found))
+        return result
+
+    def publish(self, etat, sortie):
+        """Emet le message TimeToAlert <mode>=<temps> ... (temps en secondes, inf si aucune entree avant l'horizon)"""
+        times = self.times(etat)
+        if times:
+            sortie.send(" ".join([TIME_TO_ALERT_MSG] + ["{}={}".format(mode.name, "inf" if t is None else round(t, 2))
+                                                         for (mode, t, _) in times]))
+
+lookahead = None # Anticipation des alarmes (Lookahead), None si desactivee
+
+stats = metrics.Metrics() # Mesures de fonctionnement de la periode en cours
+
+def publish_stats(sortie=None, path=None):
+    """
+    Publie le resume des mesures de la periode ecoulee et commence une nouvelle periode (timer de publication :
+    le resume est calcule hors du verrou des mesures, sur la periode retiree)
+    :param path: fichier texte ou ecrire aussi le resume (None : aucun)
+    """
+    if sortie is None:
+        sortie = bus
+    summary = stats.take().summary(sounds=player.pending())
+    sortie.send(metrics.format_message(summary))
+    if path is not None:
+        metrics.write_file(path, summary)
+
+def alert(env, etat, sortie=None):
+    if sortie is None:
+        sortie = bus
+    sortie.report(env)
+    sortie.play(env.sound, env.priority)
     if env.pullup:
-        IvySendMsg(PULLUP_MSG.format(env.name))
+        sortie.send(PULLUP_MSG.format(env.name))
         etat.is_pullup = True
     else:
         if etat.is_pullup:
-            print("Stop pull up")
-            IvySendMsg(STOP_PULLUP_UP_MSG)
+            sortie.log("Stop pull up")
+            sortie.send(STOP_PULLUP_UP_MSG)
         etat.is_pullup = False
 
 
-## Variables globals
-global_etat = Etat(0,0,0, 0, 0, 0, 0, 0,DOWN, TAKEOFF)
+#### Traitement des messages ####
+# Chaque fonction recoit l'etat a mettre a jour, la sortie des alarmes et les champs du message deja convertis
 
+def evaluate(etat, sortie, on_change=False):
+    """
+    Evalue les enveloppes de l'etat et emet l'alarme
+    :param on_change: True pour n'emettre l'alarme que si l'enveloppe retenue a change depuis la derniere evaluation
+    :return: l'enveloppe retenue, None sinon
+    """
+    env = test_mode(etat)
+    now = trigger.clock()
+    trigger.evaluations += 1
+    changed = env is not etat.alerted
+    if changed and env is not None and etat.input_time is not None:
+        trigger.record(now - etat.input_time)
+    etat.input_time = None
+    etat.last_evaluation = now
+    etat.alerted = env
+    if env is not None and (changed or not on_change):
+        start = time.time()
+        alert(env, etat, sortie)
+        stats.record("alert", time.time() - start)
+    return env
+
+def on_input(etat, sortie):
+    """Apres un message capteur : date l'entree et, selon la politique de declenchement, evalue les enveloppes"""
+    if etat.input_time is None and etat.dirty:
+        etat.input_time = trigger.clock()
+    if trigger.on_input and etat.is_init() and (etat.last_evaluation is None or
+                                                trigger.clock() - etat.last_evaluation >= trigger.interval):
+        evaluate(etat, sortie, on_change=True)
+
+def on_time(etat, sortie, t):
+    """:return: l'enveloppe ayant declenche une alarme, None sinon"""
+    etat.time = t
+    if etat.init_ralt and etat.init_fms:
+        etat.callout(sortie)
+    env = None
+    if etat.is_init():
+        env = evaluate(etat, sortie)
+        if lookahead is not None:
+            lookahead.publish(etat, sortie)
+    else:
+        stats.skip()
+        sortie.log("GPWS NOT INITIALIZED")
+    if logger.isEnabledFor(logging.INFO) and state_sampling.due(etat, env):
+        sortie.state(etat)
+    return env
+
+def on_radioalt(etat, sortie, z):
+    logger.info("Receive radio altitude : %s", z)
+    etat.change_radio_alt(z)
+    etat.init_ralt = True
+    on_input(etat, sortie)
+
+def on_statevector(etat, sortie, vp, fpa, phi):
+    etat.change_state(vp, fpa, phi)
+    etat.init_state = True
+    on_input(etat, sortie)
+
+def on_fms(etat, sortie, phase, da, dh):
+    etat.change_fmsinfo(phase, da, dh)
+    etat.init_fms = True
+    on_input(etat, sortie)
+
+def on_config(etat, sortie, gear, flaps):
+    etat.change_config(flaps, gear)
+    etat.init_config = True
+    on_input(etat, sortie)
+
+#### Decodage des messages ####
+# Le message est route sur son premier mot ; le reste est decoupe par l'expression reguliere (compilee une fois) du
+# type de message, qui verifie le nom et l'ordre des champs : un message aux champs renommes, dans un autre ordre
+# ou en trop est rejete. Chaque fonction recoit le reste du message et retourne (arguments du traitement,
+# identifiant de l'avion). Le temps est commun a tous les avions ; les autres messages peuvent se terminer par
+# l'identifiant de l'avion concerne (" ac=<id>"), sans identifiant ils concernent l'avion unique.
+
+AIRCRAFT_REGEX = r"(?:\s+" + AIRCRAFT_KEY + r"(\S+))?\s*$" # Identifiant de l'avion facultatif, puis fin du message
+TIME_REGEX = re.compile(r"t=(\S+)\s*$")
+RADIOALT_REGEX = re.compile(r"groundAlt=(\S+)" + AIRCRAFT_REGEX)
+STATEVECTOR_REGEX = re.compile(r"x=\S+\s+y=\S+\s+z=\S+\s+Vp=(\S+)\s+fpa=(\S+)\s+psi=\S+\s+phi=(\S+)" + AIRCRAFT_REGEX)
+FMS_REGEX = re.compile(r"phase=(\S+),\s+da=(\S+),\s+dh=(\S+)" + AIRCRAFT_REGEX)
+CONFIG_REGEX = re.compile(r"GEAR=(\S+)\s+FLAPS=(\S+)" + AIRCRAFT_REGEX)
+
+def fields_of(regex, rest):
+    """
+    :return: les groupes de l'expression reguliere d'un type de message sur le reste du message
+    :raise ValueError: si les champs ne sont pas ceux attendus
+    """
+    match = regex.match(rest)
+    if match is None:
+        raise ValueError("champs inattendus : {!r}".format(rest))
+    return match.groups()
+
+def parse_time(rest):
+    # Time t=<t>
+    (t,) = fields_of(TIME_REGEX, rest)
+    return (float(t),), None
+
+def parse_radioalt(rest):
+    # RadioAltimeter groundAlt=<z>
+    (z, aircraft) = fields_of(RADIOALT_REGEX, rest)
+    return (float(z),), aircraft
+
+def parse_statevector(rest):
+    # StateVector x=<x> y=<y> z=<z> Vp=<vp> fpa=<fpa> psi=<psi> phi=<phi>
+    (vp, fpa, phi, aircraft) = fields_of(STATEVECTOR_REGEX, rest)
+    return (float(vp), float(fpa), float(phi)), aircraft
+
+def parse_fms(rest):
+    # FMS_TO_GPWS phase=<phase>, da=<da>, dh=<dh>
+    (phase, da, dh, aircraft) = fields_of(FMS_REGEX, rest)
+    return (phase, float(da), float(dh)), aircraft
+
+def parse_config(rest):
+    # Config GEAR=<gear> FLAPS=<flaps>
+    (gear, flaps, aircraft) = fields_of(CONFIG_REGEX, rest)
+    return (gear, flaps), aircraft
+
+# Premier mot du message -> (traitement, decodage)
+MESSAGES = {"Time": (on_time, parse_time),
+            "RadioAltimeter": (on_radioalt, parse_radioalt),
+            "StateVector": (on_statevector, parse_statevector),
+            "FMS_TO_GPWS": (on_fms, parse_fms),
+            "Config": (on_config, parse_config)}
+
+# Unique abonnement Ivy du GPWS
+MESSAGE_REGEX = r'^((?:{})\s.*)'.format("|".join(sorted(MESSAGES)))
+
+def parse_message(msg):
+    """
+    :param msg: message Ivy
+    :return: (traitement, identifiant de l'avion, arguments du traitement), None si le message n'est pas pour le GPWS
+    """
+    fields = msg.split(None, 1)
+    entry = MESSAGES.get(fields[0]) if fields else None
+    if entry is None:
+        return None
+    (handler, parse) = entry
+    try:
+        (args, aircraft) = parse(fields[1] if len(fields) > 1 else "")
+    except ValueError:
+        logger.warning("Message mal forme : %r", msg)
+        return None
+    return handler, aircraft, args
+
+def new_etat():
+    """:return: l'etat d'un avion dont on n'a encore recu aucun message"""
+    return Etat(0,0,0, 0, 0, 0, 0, 0,DOWN, TAKEOFF)
+
+
+class Fleet(object):
+    """Registre des avions suivis : identifiant -> (etat, sortie)"""
+
+    def __init__(self, new_sortie=None, sound_aircraft=None):
+        """
+        :param new_sortie: fonction (identifiant, etat) -> sortie des alarmes d'un nouvel avion
+        :param sound_aircraft: identifiant du seul avion dont les alarmes sont jouees
+        """
+        if new_sortie is None:
+            new_sortie = lambda aircraft, etat: Sortie(aircraft, sound=(aircraft == sound_aircraft))
+        self.new_sortie = new_sortie
+        self.aircraft = {}
+
+    def get(self, aircraft):
+        """:return: (etat, sortie) de l'avion, cree a son premier message"""
+        entry = self.aircraft.get(aircraft)
+        if entry is None:
+            etat = new_etat()
+            entry = self.aircraft[aircraft] = (etat, self.new_sortie(aircraft, etat))
+        return entry
+
+    def handle(self, handler, aircraft, args):
+        """
+        Applique le traitement d'un message (voir parse_message) : a tous les avions pour le temps,
+        a l'avion designe sinon
+        """
+        stats.count(handler)
+        if handler is on_time:
+            start = time.time()
+            for (etat, sortie) in self.aircraft.values():
+                on_time(etat, sortie, *args)
+            stats.record("tick", time.time() - start)
+        else:
+            (etat, sortie) = self.get(aircraft)
+            handler(etat, sortie, *args)
 
-if __name__ == '__main__':
+    def __len__(self):
+        return len(self.aircraft)
+
+
+def main():
+    """Agent Ivy GPWS : lit les options de la ligne de commande et traite les messages du bus jusqu'a l'arret"""
+    global trigger, state_sampling, lookahead
     #parse
     usage = "usage: %prog [options]"
     parser = OptionParser(usage=usage)
-    parser.set_defaults(ivy_bus="127.255.255.255:2010", interval=5, verbose=False, app_name="GPWS")
+    parser.set_defaults(ivy_bus="127.255.255.255:2010", interval=5, verbose=False, app_name="GPWS", lut=False,
+                        sound_aircraft=None, workers=1, trigger=TRIGGER_TICK, state_every=STATE_EVERY,
+                        stats_period=STATS_PERIOD, stats_file=None, profile=profil.DEFAULT, lookahead=0)
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose',
                       help='Be verbose.')
     parser.add_option('-i', '--interval', type='int', dest='interval',
@@ -424,7 +1128,37 @@ if __name__ == '__main__':
                       help='Bus id (format @IP:port, default to 127.255.255.255:2010)')
     parser.add_option('-a', '--appname', type='string', dest='app_name',
                       help='Application Name')
+    parser.add_option('-p', '--profile', type='string', dest='profile',
+                      help='Envelope profile: name of a file of profils/ or path of a JSON file '
+                           '(default to {}, see profil.py)'.format(profil.DEFAULT))
+    parser.add_option('-l', '--lut', action='store_true', dest='lut',
+                      help='Evaluate envelopes through rasterized lookup tables (see lut.py)')
+    parser.add_option('-s', '--sound', type='string', dest='sound_aircraft',
+                      help='Only play the alerts of this aircraft (default to the aircraft without identifier)')
+    parser.add_option('-w', '--workers', type='int', dest='workers',
+                      help='Number of worker processes the aircraft are spread over (see sharding.py)')
+    parser.add_option('-t', '--trigger', type='string', dest='trigger',
+                      help='When envelopes are evaluated: tick (on Time messages, default), input (also after every '
+                           'sensor message) or input:<ms> (at most once per interval and aircraft after sensor messages)')
+    parser.add_option('-e', '--state-every', type='int', dest='state_every',
+                      help='Log the full state every N ticks, and when the alert or configuration changes '
+                           '(0: only on change, default to {})'.format(STATE_EVERY))
+    parser.add_option('--stats-period', type='float', dest='stats_period',
+                      help='Seconds between two GPWS_STATS messages (0: none, default to {})'.format(STATS_PERIOD))
+    parser.add_option('--stats-file', type='string', dest='stats_file',
+                      help='Also write the GPWS_STATS summary to this text file')
+    parser.add_option('--lookahead', type='float', dest='lookahead',
+                      help='Publish each tick the time before every active mode reaches an envelope, looking ahead '
+                           'this many seconds (0: none, default)')
     (options, args) = parser.parse_args()
+    ivy = import_ivy()
+    state_sampling = StateSampling(options.state_every)
+    if options.lookahead > 0:
+        lookahead = Lookahead(options.lookahead)
+    try:
+        trigger = parse_trigger(options.trigger)
+    except ValueError as e:
+        parser.error(str(e))
 
     # init log
     level = logging.INFO
@@ -432,9 +1166,18 @@ if __name__ == '__main__':
         level = logging.DEBUG
     logger.setLevel(level)
 
+    try:
+        load_profile(options.profile)
+    except (ValueError, IOError) as e:
+        parser.error(str(e))
+
+    if options.lut:
+        import lut
+        lut.enable()
+
     #### IVY ####
     def on_cx_proc(agent, connected):
-        if connected == IvyApplicationDisconnected:
+        if connected == ivy.IvyApplicationDisconnected:
             logger.error('Ivy application %r was disconnected', agent)
         else:
             logger.info('Ivy application %r was connected', agent)
@@ -445,62 +1188,42 @@ if __name__ == '__main__':
 
 
     def connect(app_name, ivy_bus):
-        IvyInit(app_name,                   # application name for Ivy
-                "[%s ready]" % app_name,    # ready message
-                0,                          # main loop is local (ie. using IvyMainloop)
-                on_cx_proc,                 # handler called on connection/disconnection
-                on_die_proc)
-        IvyStart(ivy_bus)
-
-    def on_time(agent, *larg):
-        t = float(larg[0])
-        global_etat.time = t
-        if global_etat.init_ralt and global_etat.init_fms:
-            global_etat.callout()
-        if global_etat.is_init():
-            env = test_mode(global_etat)
-            if env != None:
-                alert(env, global_etat)
-        else:
-            print("GPWS NOT INITIALIZED")
-        print global_etat
-
-
-    def on_radioalt(agent, *larg):
-        z = float(larg[0])
-        logger.info("Receive radio altitude : %s" % z)
-        global_etat.change_radio_alt(z)
-        global_etat.init_ralt = True
-
-    def on_statevector(agent, *larg):
-        x = float(larg[0])
-        y = float(larg[1])
-        z = float(larg[2])
-        vp = float(larg[3])
-        fpa = float(larg[4])
-        psi = float(larg[5])
-        phi = float(larg[6])
-        global_etat.change_state(x, y, z, vp, fpa, psi, phi)
-        global_etat.init_state = True
-
-    def on_fms(agent, *larg):
-        phase = larg[0]
-        da = float(larg[1])
-        dh = float(larg[2])
-        global_etat.change_fmsinfo(phase, da, dh)
-        global_etat.init_fms = True
-
-    def on_config(agent, *larg):
-        gear = larg[0]
-        flaps = larg[1]
-        global_etat.change_config(flaps, gear)
-        global_etat.init_config = True
+        ivy.IvyInit(app_name,                   # application name for Ivy
+                    "[%s ready]" % app_name,    # ready message
+                    0,                          # main loop is local (ie. using IvyMainloop)
+                    on_cx_proc,                 # handler called on connection/disconnection
+                    on_die_proc)
+        ivy.IvyStart(ivy_bus)
+
+    if options.workers > 1:
+        import sharding
+        fleet = sharding.Supervisor(options.workers, sound_aircraft=options.sound_aircraft, trigger=trigger)
+    else:
+        fleet = Fleet(sound_aircraft=options.sound_aircraft)
+
+    def on_message(agent, msg):
+        """Callback Ivy unique : decode le message et le transmet aux avions concernes"""
+        message = parse_message(msg)
+        if message is not None:
+            fleet.handle(*message)
 
 
+    # Traces ecrites en arriere-plan (apres le lancement des processus de travail, qui tracent directement)
+    (log_handler, log_listener) = asynclog.install(logger)
+    player.start()
     connect(options.app_name, options.ivy_bus)
-    IvyBindMsg(on_time, '^Time t=(\S+)')
-    IvyBindMsg(on_radioalt, '^RadioAltimeter groundAlt=(\S+)')
-    IvyBindMsg(on_statevector, 'StateVector\s+x=(\S+)\s+y=(\S+)\sz=(\S+)\sVp=(\S+)\sfpa=(\S+)\spsi=(\S+)\sphi=(\S+)')
-    IvyBindMsg(on_fms, '^FMS_TO_GPWS\sphase=(\S+),\sda=(\S+),\sdh=(\S+)')
-    IvyBindMsg(on_config, 'Config\s+GEAR=(\S+)\s+FLAPS=(\S+)')
-    IvyMainLoop()
+    ivy.IvyBindMsg(on_message, MESSAGE_REGEX)
+    if options.stats_period > 0:
+        # Publication sur un timer Ivy (thread arrete avec le bus), bus au repos compris
+        ivy.IvyTimerRepeatAfter(0, int(1000 * options.stats_period), lambda: publish_stats(path=options.stats_file))
+    ivy.IvyMainLoop()
+    if options.workers > 1:
+        fleet.stop()
+    else:
+        logger.info(trigger.report())
+    asynclog.uninstall(logger, log_handler, log_listener)
+
+
+if __name__ == '__main__':
+    import gpws # Module partage avec lut.py et sharding.py (le script lui-meme est le module __main__)
+    gpws.main()
@@ -0,0 +1,216 @@
+"""
+Tables de correspondance (lookup tables) des enveloppes GPWS.
+
+Les enveloppes d'un mode sont rasterisees une fois pour toutes sur une grille couvrant
+les axes du mode, pour chaque combinaison (flaps, gear). Une cellule entierement dans une
+enveloppe (ou hors de toutes) donne directement le resultat de Mode.get_enveloppe par un
+simple acces indexe ; seules les cellules traversees par un bord d'enveloppe retombent sur
+le test exact des polygones. Les grilles sont gardees en cache sur disque.
+
+Usage : python lut.py [-r RESOLUTION] pour construire les tables et les valider.
+"""
+from __future__ import division
+import os, sys, hashlib, logging
+import numpy as np
+import gpws, geometry
+logger = logging.getLogger('Ivy')
+from optparse import OptionParser
+
+RESOLUTION = 256 # Nombre de cellules par axe
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+FORMAT_VERSION = 1
+
+# Codes des cellules : l'enveloppe d'indice k dans mode.list_enveloppes est codee k + FIRST_ENV
+EDGE = 0 # Cellule a cheval sur un bord : test exact
+NO_ENV = 1 # Cellule hors de toute enveloppe applicable
+FIRST_ENV = 2
+
+REL_TOL = 1e-9 # Marge relative pour considerer qu'un bord touche une cellule
+
+
+class ModeLUT(object):
+    """Grilles rasterisees des enveloppes d'un mode, une par configuration (flaps, gear)"""
+
+    def __init__(self, mode, resolution=RESOLUTION, cache_dir=CACHE_DIR):
+        self.mode = mode
+        self.nx = self.ny = resolution
+        (self.xmin, self.ymin, self.xmax, self.ymax) = mode.get_xmin_ymin_xmax_ymax()
+        self.sx = self.nx / (self.xmax - self.xmin)
+        self.sy = self.ny / (self.ymax - self.ymin)
+        self.cache_dir = cache_dir
+        self.grids = {} # signature -> grille (bytearray de ny*nx codes)
+        self.cells = {} # (flaps, gear) -> grille
+
+    def get_enveloppe(self, point, flaps, gear):
+        """Meme resultat que Mode.find_enveloppe"""
+        cells = self.cells.get((flaps, gear))
+        if cells is None:
+            cells = self.build(flaps, gear)
+        x = point[0]
+        y = point[1]
+        if not (self.xmin <= x <= self.xmax and self.ymin <= y <= self.ymax):
+            return None # Hors de la boite englobante de toutes les enveloppes du mode
+        i = int((x - self.xmin) * self.sx)
+        j = int((y - self.ymin) * self.sy)
+        code = cells[min(j, self.ny - 1) * self.nx + min(i, self.nx - 1)]
+        if code >= FIRST_ENV:
+            return self.mode.list_enveloppes[code - FIRST_ENV]
+        if code == NO_ENV:
+            return None
+        return self.mode.find_enveloppe(point, flaps, gear)
+
+    def signature(self, flaps, gear):
+        """Enveloppes applicables dans la configuration : deux configurations de meme signature partagent leur grille"""
+        return tuple(env.accepts(flaps, gear) for env in self.mode.list_enveloppes)
+
+    def build(self, flaps, gear):
+        """Retourne la grille de la configuration, en la rasterisant (ou en la lisant en cache) si besoin"""
+        sig = self.signature(flaps, gear)
+        if sig not in self.grids:
+            self.grids[sig] = bytearray(self._load_or_rasterize(sig).tobytes())
+        self.cells[(flaps, gear)] = self.grids[sig]
+        return self.grids[sig]
+
+    def key(self, sig):
+        """Empreinte de la geometrie du mode, de la signature et de la resolution (nom du fichier de cache)"""
+        envs = [(env.vertexes, env.priority) for env in self.mode.list_enveloppes]
+        description = repr((FORMAT_VERSION, self.mode.abs, self.mode.ord, envs, sig, self.nx, self.ny))
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def _load_or_rasterize(self, sig):
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, "lut_{}_{}.npy".format(self.mode.name, self.key(sig)))
+            if os.path.exists(path):
+                return np.load(path)
+        grid = self.rasterize(sig)
+        if path is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            np.save(path, grid)
+        return grid
+
+    def rasterize(self, sig):
+        """
+        :param sig: signature de la configuration
+        :return: grille (ny, nx) des codes de cellules
+        """
+        envs = self.mode.list_enveloppes
+        order = sorted((k for k in range(len(envs)) if sig[k]), key=lambda k: envs[k].priority)
+        X = np.linspace(self.xmin, self.xmax, self.nx + 1)
+        Y = np.linspace(self.ymin, self.ymax, self.ny + 1)
+        grid = np.full((self.ny, self.nx), NO_ENV, dtype=np.uint8)
+        decided = np.zeros((self.ny, self.nx), dtype=bool)
+        for k in order: # Par priorite decroissante : la premiere enveloppe qui touche une cellule la decide
+            touched, inside = self._classify(envs[k], X, Y)
+            grid[~decided & touched] = EDGE
+            grid[~decided & ~touched & inside] = k + FIRST_ENV
+            decided |= touched | inside
+        return grid
+
+    def _classify(self, env, X, Y):
+        """
+        :return: (touched, inside) : cellules traversees par un bord de l'enveloppe, et cellules
+                 entierement dans l'enveloppe parmi les autres
+        """
+        tol_x = REL_TOL * (self.xmax - self.xmin)
+        tol_y = REL_TOL * (self.ymax - self.ymin)
+        touched = np.zeros((self.ny, self.nx), dtype=bool)
+        nbp = len(env.vertexes)
+        for i in range(nbp):
+            (ax, ay) = env.vertexes[i]
+            (bx, by) = env.vertexes[(i + 1) % nbp]
+            # Recouvrement de la cellule et de la boite englobante de l'arete
+            over_x = (X[1:] >= min(ax, bx) - tol_x) & (X[:-1] <= max(ax, bx) + tol_x)
+            over_y = (Y[1:] >= min(ay, by) - tol_y) & (Y[:-1] <= max(ay, by) + tol_y)
+            # La droite de l'arete passe entre les coins de la cellule
+            d = (bx - ax) * (Y[:, None] - ay) - (by - ay) * (X[None, :] - ax)
+            tol = abs(bx - ax) * tol_y + abs(by - ay) * tol_x
+            corners = np.stack([d[:-1, :-1], d[:-1, 1:], d[1:, :-1], d[1:, 1:]])
+            crossed = (corners.max(axis=0) >= -tol) & (corners.min(axis=0) <= tol)
+            touched |= over_y[:, None] & over_x[None, :] & crossed
+        # Une cellule qu'aucun bord ne traverse est entierement dedans ou dehors : on teste son centre
+        cx = (X[:-1] + X[1:]) / 2
+        cy = (Y[:-1] + Y[1:]) / 2
+        return touched, geometry.winding_number_array(env.vertexes, cx[None, :], cy[:, None]) & ~touched
+
+
+def enable(modes=None, resolution=RESOLUTION, cache_dir=CACHE_DIR):
+    """
+    Rasterise les modes pour toutes les configurations connues : Mode.get_enveloppe (et donc test_mode) passe alors par les tables
+    :param modes: liste des modes, L_Modes par defaut
+    """
+    if modes is None:
+        modes = gpws.get_modes()
+    for mode in modes:
+        mode.lut = ModeLUT(mode, resolution, cache_dir)
+        for flaps in gpws.FLAPS:
+            for gear in gpws.GEARS:
+                mode.lut.build(flaps, gear)
+    gpws.Mode.generation += 1 # Reconstruit les tables de dispatch des etats
+
+def disable(modes=None):
+    """Revient au test exact des polygones"""
+    if modes is None:
+        modes = gpws.get_modes()
+    for mode in modes:
+        mode.lut = None
+    gpws.Mode.generation += 1
+
+def validate(lut, flaps, gear, density=2, n_random=20000, seed=0):
+    """
+    Compare la table a Mode.find_enveloppe sur un echantillon dense : grille density fois plus fine que la table
+    (et debordant de 5%), sommets des enveloppes et points aleatoires
+    :return: (nombre de points testes, liste des points en desaccord)
+    """
+    mode = lut.mode
+    wx = 0.05 * (lut.xmax - lut.xmin)
+    wy = 0.05 * (lut.ymax - lut.ymin)
+    xs = np.linspace(lut.xmin - wx, lut.xmax + wx, density * lut.nx + 1)
+    ys = np.linspace(lut.ymin - wy, lut.ymax + wy, density * lut.ny + 1)
+    rng = np.random.RandomState(seed)
+    points = [(x, y) for y in ys for x in xs]
+    points += [(x, y) for env in mode.list_enveloppes for (x, y) in env.vertexes]
+    points += zip(rng.uniform(lut.xmin - wx, lut.xmax + wx, n_random), rng.uniform(lut.ymin - wy, lut.ymax + wy, n_random))
+    errors = [(x, y) for (x, y) in points
+              if lut.get_enveloppe((x, y), flaps, gear) is not mode.find_enveloppe((x, y), flaps, gear)]
+    return len(points), errors
+
+def validate_all(modes=None, **kwargs):
+    """
+    Valide les tables de tous les modes pour toutes les configurations connues
+    (une seule fois par signature, les configurations de meme signature donnant les memes resultats)
+    :return: nombre total de desaccords
+    """
+    if modes is None:
+        modes = gpws.get_modes()
+    total = 0
+    for mode in modes:
+        seen = set()
+        for flaps in gpws.FLAPS:
+            for gear in gpws.GEARS:
+                sig = mode.lut.signature(flaps, gear)
+                if sig in seen:
+                    continue
+                seen.add(sig)
+                n, errors = validate(mode.lut, flaps, gear, **kwargs)
+                codes = np.frombuffer(bytes(mode.lut.build(flaps, gear)), dtype=np.uint8)
+                logger.info("%s flaps=%s gear=%s : %d points, %d desaccords, %.1f%% de cellules de bord",
+                            mode.name, flaps, gear, n, len(errors), 100.0 * np.count_nonzero(codes == EDGE) / len(codes))
+                total += len(errors)
+    return total
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(resolution=RESOLUTION, cache_dir=CACHE_DIR)
+    parser.add_option('-r', '--resolution', type='int', dest='resolution',
+                      help='Number of cells per axis')
+    parser.add_option('-c', '--cache', type='string', dest='cache_dir',
+                      help='Cache directory')
+    (options, args) = parser.parse_args()
+    gpws.init_logging()
+
+    enable(resolution=options.resolution, cache_dir=options.cache_dir)
+    sys.exit(1 if validate_all() else 0)
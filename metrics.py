@@ -0,0 +1,162 @@
+"""
+Mesures de fonctionnement du GPWS, assez legeres pour rester actives en permanence.
+
+Les messages sont comptes par traitement, les durees des ticks et des alarmes sont rangees
+dans des histogrammes a intervalles logarithmiques (a la maniere des histogrammes HDR : un
+enregistrement coute un frexp et une incrementation, la precision relative des quantiles
+est bornee). Un resume de la periode ecoulee est publie sur le bus (message GPWS_STATS) et
+peut etre ecrit dans un fichier texte, sur un timer : le resume part meme si le bus est au repos.
+"""
+from __future__ import division
+import os, math, time, threading
+from math import frexp
+
+SUB_BUCKETS = 8 # Intervalles par octave : quantiles a 1/SUB_BUCKETS pres en relatif
+MIN_EXP = -30 # Plus petite duree distinguee : 2^(MIN_EXP - 1) = 2^-31 s (environ 0.5 ns)
+MAX_EXP = 8 # Plus grande duree distinguee : 2^(MAX_EXP - 1) = 2^7 s, au-dela tout va dans le dernier intervalle
+NB_BUCKETS = (MAX_EXP - MIN_EXP) * SUB_BUCKETS
+OFFSET = MIN_EXP * SUB_BUCKETS + SUB_BUCKETS # Indice de value = m * 2^e : e * SUB_BUCKETS + int(2 * SUB_BUCKETS * m) - OFFSET
+
+STATS_MSG = "GPWS_STATS" # Prefixe du message publie
+QUANTILES = [("p50", 0.5), ("p99", 0.99)]
+
+
+class Histogram(object):
+    """Histogramme de durees (en secondes) a intervalles logarithmiques"""
+    __slots__ = ('buckets', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * NB_BUCKETS
+        self.max = 0.0
+
+    def record(self, value):
+        (m, e) = frexp(value) # value = m * 2^e avec 0.5 <= m < 1
+        i = e * SUB_BUCKETS + int(2 * SUB_BUCKETS * m) - OFFSET
+        if not 0 <= i < NB_BUCKETS or value <= 0:
+            i = NB_BUCKETS - 1 if value > 0 and i > 0 else 0
+        self.buckets[i] += 1
+        if value > self.max:
+            self.max = value
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def quantile(self, q):
+        """:return: borne superieure de l'intervalle contenant le quantile q (0 si l'histogramme est vide)"""
+        count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                (e, sub) = divmod(i, SUB_BUCKETS)
+                return min(self.max, math.ldexp(0.5 + (sub + 1) / (2 * SUB_BUCKETS), e + MIN_EXP))
+        return self.max
+
+    def merge(self, other):
+        """Ajoute les enregistrements d'un autre histogramme"""
+        self.buckets = [a + b for (a, b) in zip(self.buckets, other.buckets)]
+        self.max = max(self.max, other.max)
+
+
+class Metrics(object):
+    """
+    Mesures d'une periode : messages par traitement, etats non initialises, durees des ticks et des alarmes.
+    Les enregistrements (fils d'Ivy) et take (timer de publication) passent par un verrou : un enregistrement
+    compte dans une seule periode.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.start = time.time()
+        self.messages = {} # traitement (fonction) -> nombre de messages
+        self.not_init = 0 # Evaluations sautees, l'etat n'etant pas initialise
+        self.tick = Histogram() # Duree du traitement d'un message Time (tous les avions)
+        self.alert = Histogram() # Duree d'une alarme (trace, son, message)
+
+    def __getstate__(self):
+        """Sans le verrou (mesures envoyees par les processus de travail, voir sharding.py)"""
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def count(self, handler):
+        """Compte un message traite par la fonction handler"""
+        with self.lock:
+            self.messages[handler] = self.messages.get(handler, 0) + 1
+
+    def skip(self):
+        """Compte une evaluation sautee, l'etat n'etant pas initialise"""
+        with self.lock:
+            self.not_init += 1
+
+    def record(self, name, value):
+        """Enregistre une duree dans l'histogramme name ('tick' ou 'alert')"""
+        with self.lock:
+            getattr(self, name).record(value)
+
+    def take(self):
+        """:return: les mesures de la periode ecoulee, les mesures repartant de zero"""
+        period = Metrics()
+        with self.lock:
+            (period.start, period.messages, period.not_init, period.tick, period.alert) = \
+                (self.start, self.messages, self.not_init, self.tick, self.alert)
+            self._reset()
+        return period
+
+    def merge(self, other, messages=True):
+        """
+        Ajoute les mesures d'une autre periode (celles d'un processus de travail par exemple)
+        :param messages: False pour ne pas ajouter les compteurs de messages
+        """
+        with self.lock:
+            if messages:
+                for (handler, n) in other.messages.items():
+                    self.messages[handler] = self.messages.get(handler, 0) + n
+            self.not_init += other.not_init
+            self.tick.merge(other.tick)
+            self.alert.merge(other.alert)
+
+    def summary(self, sounds=0, now=None):
+        """
+        :param sounds: nombre de sons en attente de lecture
+        :return: liste de (cle, valeur) : debit de chaque traitement (messages/s), evaluations sautees,
+                 quantiles et maximum des durees (us) et sons en attente
+        """
+        if now is None:
+            now = time.time()
+        elapsed = max(now - self.start, 1e-9)
+        items = [("period_s", round(elapsed, 3))]
+        for (name, n) in sorted((handler.__name__, n) for (handler, n) in self.messages.items()):
+            items.append(("{}_per_s".format(name), round(n / elapsed, 2)))
+        items.append(("not_init", self.not_init))
+        for (prefix, histogram) in (("tick", self.tick), ("alert", self.alert)):
+            items.append(("{}_count".format(prefix), histogram.count))
+            for (name, q) in QUANTILES:
+                items.append(("{}_{}_us".format(prefix, name), round(1e6 * histogram.quantile(q), 1)))
+            items.append(("{}_max_us".format(prefix), round(1e6 * histogram.max, 1)))
+        items.append(("sounds_pending", sounds))
+        return items
+
+
+def format_message(summary):
+    """:return: le message Ivy du resume : GPWS_STATS cle=valeur ..."""
+    return " ".join([STATS_MSG] + ["{}={}".format(key, value) for (key, value) in summary])
+
+def write_file(path, summary):
+    """Ecrit le resume dans un fichier texte (une ligne 'gpws_cle valeur' par mesure), remplace d'un coup"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fic:
+        for (key, value) in summary:
+            fic.write("gpws_{} {}\n".format(key, value))
+    os.rename(tmp, path)
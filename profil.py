@@ -0,0 +1,215 @@
+"""
+Profils d'enveloppes GPWS.
+
+Un profil est un fichier JSON (voir profils/defaut.json) decrivant les modes d'un type
+d'avion : nom, phases, axes (noms des variables de Etat) et actif ou non de chaque mode,
+et pour chaque enveloppe ses sommets, son niveau d'alerte, sa priorite, les flaps et gear
+auxquels elle s'applique (null : toutes les positions), son son et si elle demande une
+ressource (pullup).
+
+A la premiere lecture, un profil est valide puis compile : sommets ramenes au sens horaire,
+aretes (origine et vecteur), boites englobantes et convexite precalcules (voir
+geometry.compile_polygon). Le resultat est garde en cache (marshal) sous l'empreinte du
+contenu du fichier ; les lectures suivantes du meme contenu ne font que relire le cache,
+sans analyse ni calcul.
+Le cache ne depend que de la bibliotheque standard : NumPy n'est pas charge au demarrage.
+
+Usage : python profil.py [PROFIL ...] pour valider et compiler des profils.
+"""
+from __future__ import division
+import os, sys, math, marshal, hashlib, logging
+import geometry
+logger = logging.getLogger('Ivy')
+from optparse import OptionParser
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profils")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+DEFAULT = "defaut"
+FORMAT_VERSION = 2 # 2 : aretes compilees (ax, ay, abx, aby)
+ALERT_LEVELS = ("W", "C") # Warning, Caution
+NUMBERS = (int, float) if sys.version_info[0] >= 3 else (int, long, float)
+
+PROFILE_KEYS = {"name", "description", "modes"}
+MODE_KEYS = {"name", "phases", "abs", "ord", "on", "enveloppes"}
+ENVELOPPE_KEYS = {"name", "vertexes", "alertlevel", "priority", "flaps", "gear", "sound", "pullup"}
+
+
+class Vocabulary(object):
+    """Valeurs admises dans un profil : variables des axes (nom -> indice dans Etat.list), flaps, gear et phases"""
+
+    def __init__(self, axes, flaps, gears, phases):
+        self.axes = dict(axes)
+        self.flaps = list(flaps)
+        self.gears = list(gears)
+        self.phases = list(phases)
+
+    def __repr__(self):
+        return repr((sorted(self.axes.items()), self.flaps, self.gears, self.phases))
+
+
+def path_of(profile):
+    """:return: le chemin du fichier d'un profil, donne par son nom (fichier de profils/) ou son chemin"""
+    if os.path.splitext(profile)[1] or os.sep in profile:
+        return profile
+    return os.path.join(PROFILES_DIR, profile + ".json")
+
+def key(content, vocabulary):
+    """Empreinte du contenu du fichier, du vocabulaire et du format de cache (nom du fichier de cache)"""
+    description = repr((FORMAT_VERSION, marshal.version, sys.version_info[0], repr(vocabulary))).encode("utf-8")
+    return hashlib.sha1(description + content).hexdigest()
+
+def load(profile, vocabulary, cache_dir=CACHE_DIR):
+    """
+    :param profile: nom d'un profil de profils/ ou chemin d'un fichier JSON
+    :param vocabulary: valeurs admises (Vocabulary)
+    :return: liste de modes compiles (voir compile_profile)
+    :raise ValueError: si le profil est invalide
+    """
+    path = path_of(profile)
+    with open(path, "rb") as fic:
+        content = fic.read()
+    cache = None
+    if cache_dir is not None:
+        name = os.path.splitext(os.path.basename(path))[0]
+        cache = os.path.join(cache_dir, "profil_{}_{}.bin".format(name, key(content, vocabulary)))
+        if os.path.exists(cache):
+            with open(cache, "rb") as fic:
+                return marshal.loads(fic.read())
+    import json # Seulement pour compiler : le demarrage habituel ne lit que le cache
+    try:
+        data = json.loads(content.decode("utf-8"))
+    except ValueError as e:
+        raise ValueError("{} : JSON invalide ({})".format(path, e))
+    modes = compile_profile(validate(data, vocabulary, path), vocabulary)
+    if cache is not None:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = cache + ".tmp"
+            with open(tmp, "wb") as fic:
+                fic.write(marshal.dumps(modes))
+            os.rename(tmp, cache)
+        except (IOError, OSError) as e:
+            logger.warning("Cache du profil %s non ecrit : %s", path, e)
+    return modes
+
+
+def validate(data, vocabulary, where="profil"):
+    """
+    Verifie la structure et les valeurs d'un profil
+    :param data: profil lu du fichier JSON
+    :return: data
+    :raise ValueError: a la premiere erreur, en indiquant le mode et l'enveloppe concernes
+    """
+    _check_keys(data, PROFILE_KEYS, {"modes"}, where)
+    modes = data["modes"]
+    _check(isinstance(modes, list) and modes, where, "'modes' doit etre une liste non vide")
+    names = set()
+    for (i, mode) in enumerate(modes):
+        here = "{} : mode {}".format(where, i)
+        _check_keys(mode, MODE_KEYS, {"name", "abs", "ord", "enveloppes"}, here)
+        _check(_is_text(mode["name"]), here, "'name' doit etre une chaine")
+        here = "{} : {}".format(where, mode["name"])
+        _check(mode["name"] not in names, here, "nom de mode repete")
+        names.add(mode["name"])
+        for axis in ("abs", "ord"):
+            _check(mode[axis] in vocabulary.axes, here, "'{}' doit etre parmi {}".format(axis, sorted(vocabulary.axes)))
+        _check_values(mode.get("phases"), vocabulary.phases, here, "phases")
+        _check(isinstance(mode.get("on", True), bool), here, "'on' doit etre true ou false")
+        enveloppes = mode["enveloppes"]
+        _check(isinstance(enveloppes, list) and enveloppes, here, "'enveloppes' doit etre une liste non vide")
+        for (j, env) in enumerate(enveloppes):
+            _validate_enveloppe(env, vocabulary, "{} : enveloppe {}".format(here, j))
+    return data
+
+def _validate_enveloppe(env, vocabulary, here):
+    _check_keys(env, ENVELOPPE_KEYS, ENVELOPPE_KEYS - {"pullup"}, here)
+    _check(_is_text(env["name"]), here, "'name' doit etre une chaine")
+    here = "{} ({})".format(here, env["name"])
+    vertexes = env["vertexes"]
+    _check(isinstance(vertexes, list) and len(vertexes) >= 3, here, "'vertexes' doit avoir au moins 3 sommets")
+    for P in vertexes:
+        _check(isinstance(P, list) and len(P) == 2 and all(_is_number(v) for v in P), here,
+               "sommet invalide : {} (attendu [x, y])".format(P))
+    _check(geometry.signed_area(vertexes) != 0, here, "polygone d'aire nulle")
+    _check(env["alertlevel"] in ALERT_LEVELS, here, "'alertlevel' doit etre parmi {}".format(list(ALERT_LEVELS)))
+    _check(_is_number(env["priority"]), here, "'priority' doit etre un nombre")
+    _check_values(env["flaps"], vocabulary.flaps, here, "flaps")
+    _check_values(env["gear"], vocabulary.gears, here, "gear")
+    _check(_is_text(env["sound"]), here, "'sound' doit etre une chaine")
+    _check(isinstance(env.get("pullup", False), bool), here, "'pullup' doit etre true ou false")
+
+def _check(condition, where, message):
+    if not condition:
+        raise ValueError("{} : {}".format(where, message))
+
+def _check_keys(obj, allowed, required, where):
+    _check(isinstance(obj, dict), where, "objet JSON attendu")
+    unknown = set(obj) - allowed
+    _check(not unknown, where, "cles inconnues : {}".format(", ".join(sorted(unknown))))
+    missing = required - set(obj)
+    _check(not missing, where, "cles manquantes : {}".format(", ".join(sorted(missing))))
+
+def _check_values(values, allowed, where, name):
+    """Verifie une liste de valeurs parmi allowed, null signifiant toutes les valeurs"""
+    if values is None:
+        return
+    _check(isinstance(values, list) and values, where, "'{}' doit etre null ou une liste non vide".format(name))
+    for value in values:
+        _check(value in allowed, where, "'{}' : valeur inconnue '{}' (attendu parmi {})".format(name, value, allowed))
+
+def _is_number(value):
+    return isinstance(value, NUMBERS) and not isinstance(value, bool) and not (math.isinf(value) or math.isnan(value))
+
+def _is_text(value):
+    return isinstance(value, type(u""))
+
+
+def compile_profile(data, vocabulary):
+    """
+    :param data: profil valide
+    :return: liste de modes (nom, phases, abscisse, ordonnee, actif, enveloppes), chaque enveloppe valant
+             (nom, sommets, niveau d'alerte, priorite, flaps, gear, son, pullup, (edges, bbox, convexe)) ;
+             uniquement des types de base (marshal), les listes 'toutes valeurs' valant (None,)
+    """
+    modes = []
+    for mode in data["modes"]:
+        enveloppes = []
+        for env in mode["enveloppes"]:
+            vertexes = geometry.normalize(env["vertexes"])
+            compiled = geometry.compile_polygon(vertexes) + (geometry.is_convex(vertexes),)
+            enveloppes.append((_str(env["name"]), vertexes, _str(env["alertlevel"]), env["priority"],
+                               _values(env["flaps"]), _values(env["gear"]), _str(env["sound"]),
+                               env.get("pullup", False), compiled))
+        modes.append((_str(mode["name"]), _values(mode.get("phases")), vocabulary.axes[mode["abs"]],
+                      vocabulary.axes[mode["ord"]], mode.get("on", True), tuple(enveloppes)))
+    return modes
+
+def _str(text):
+    """:return: le texte en str (chaine d'octets UTF-8 sous Python 2, ou json produit des unicode)"""
+    return text if isinstance(text, str) else text.encode("utf-8")
+
+def _values(values):
+    return (None,) if values is None else tuple(_str(value) for value in values)
+
+
+if __name__ == '__main__':
+    import gpws
+    usage = "usage: %prog [options] [profile...]"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(cache_dir=CACHE_DIR)
+    parser.add_option('-c', '--cache', type='string', dest='cache_dir',
+                      help='Cache directory')
+    (options, args) = parser.parse_args()
+    gpws.init_logging()
+
+    errors = 0
+    for profile in args or [DEFAULT]:
+        try:
+            modes = load(profile, gpws.VOCABULARY, options.cache_dir)
+        except (ValueError, IOError) as e:
+            logger.error("%s", e)
+            errors += 1
+            continue
+        logger.info("%s : %d modes, %d enveloppes", path_of(profile), len(modes), sum(len(mode[5]) for mode in modes))
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,99 @@
+"""
+Rejeu hors ligne des fichiers de test Ivy (ceux produits par test.create_test).
+
+Chaque ligne est decodee et traitee en memoire par les memes fonctions que le callback Ivy de
+gpws.py, sans bus ni attente entre les messages ; les alarmes sont collectees dans une
+chronologie au lieu d'etre emises.
+
+Usage : python replay.py [-j N] fichier1.txt [fichier2.txt ...]
+"""
+import sys, logging
+import gpws
+logger = logging.getLogger('Ivy')
+from optparse import OptionParser
+
+# Types d'evenements de la chronologie
+ALERT = "alert"
+SEND = "send"
+SOUND = "sound"
+
+
+class Timeline(gpws.Sortie):
+    """Sortie hors ligne d'un avion : ajoute les evenements (temps, avion, type, valeur) a une liste au lieu de les emettre"""
+
+    def __init__(self, events, aircraft, etat):
+        gpws.Sortie.__init__(self, aircraft, sound=False)
+        self.events = events
+        self.etat = etat
+
+    def send(self, msg):
+        self.events.append((self.etat.time, self.aircraft, SEND, msg))
+
+    def play(self, sound, priority):
+        self.events.append((self.etat.time, self.aircraft, SOUND, sound))
+
+    def emit(self, level, text, args=(), extra=None):
+        pass
+
+    def report(self, env):
+        self.events.append((self.etat.time, self.aircraft, ALERT, env.name))
+
+
+def replay(lines):
+    """
+    Rejoue une suite de messages
+    :param lines: iterable de messages Ivy (lignes d'un fichier de test)
+    :return: la chronologie des evenements : liste de (temps, avion, type, valeur)
+    """
+    events = []
+    fleet = gpws.Fleet(lambda aircraft, etat: Timeline(events, aircraft, etat))
+    for line in lines:
+        message = gpws.parse_message(line)
+        if message is not None:
+            fleet.handle(*message)
+    return events
+
+def replay_file(filename):
+    """:return: (nom du fichier, evenements) du rejeu d'un fichier de test"""
+    with open(filename, "r") as fic:
+        return filename, replay(fic)
+
+def replay_files(filenames, processes=1):
+    """
+    Rejoue plusieurs fichiers, eventuellement en parallele
+    :param processes: nombre de processus (None : autant que de coeurs)
+    :return: liste des (nom du fichier, evenements), dans l'ordre des fichiers
+    """
+    if processes == 1:
+        return [replay_file(filename) for filename in filenames]
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    chunksize = max(1, len(filenames) // (4 * (processes or multiprocessing.cpu_count())))
+    try:
+        return pool.map(replay_file, filenames, chunksize=chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] file..."
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(processes=1, all_events=False, lookahead=0)
+    parser.add_option('-j', '--jobs', type='int', dest='processes',
+                      help='Number of worker processes (0 : one per core)')
+    parser.add_option('-e', '--events', action='store_true', dest='all_events',
+                      help='Print bus messages and sounds, not only alerts')
+    parser.add_option('-k', '--lookahead', type='float', dest='lookahead',
+                      help='Also record the TimeToAlert messages, looking ahead this many seconds (see gpws.Lookahead)')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("no file to replay")
+    if options.lookahead > 0:
+        gpws.lookahead = gpws.Lookahead(options.lookahead)
+
+    for (filename, events) in replay_files(args, options.processes or None):
+        print("## {}".format(filename))
+        for (t, aircraft, kind, value) in events:
+            if options.all_events or kind == ALERT:
+                print("{}\t{}\t{}\t{}".format(t, "-" if aircraft is None else aircraft, kind, value))
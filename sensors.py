@@ -0,0 +1,96 @@
+"""
+Historique borne des mesures d'un avion.
+
+Chaque mesure garde ses derniers echantillons (temps, valeur) dans un tampon circulaire
+prealloue : la memoire est constante quel que soit le nombre de messages recus. Les sommes
+de la regression lineaire (moindres carres) sur la fenetre sont tenues a jour a chaque
+echantillon, ce qui donne en O(1) la pente de la mesure (sa derivee lissee) et sa valeur
+lissee au dernier instant, sans le bruit d'une difference entre deux echantillons.
+"""
+from __future__ import division
+from array import array
+
+
+class SensorHistory(object):
+    """Derniers echantillons (temps, valeur) d'une mesure et regression lineaire sur ces echantillons"""
+    __slots__ = ('times', 'values', 'size', 'count', 'head', 'origin', 's_t', 's_v', 's_tt', 's_tv')
+
+    def __init__(self, size):
+        """:param size: nombre d'echantillons de la fenetre (au moins 2)"""
+        self.times = array('d', [0.0]) * size
+        self.values = array('d', [0.0]) * size
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        """Oublie tous les echantillons"""
+        self.count = 0
+        self.head = 0 # Case du prochain echantillon
+        self.origin = 0.0 # Origine des temps des sommes, pour garder des sommes petites
+        self.s_t = self.s_v = self.s_tt = self.s_tv = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, t, value):
+        """
+        Ajoute un echantillon, qui remplace le plus ancien si le tampon est plein
+        ou le dernier s'il est au meme instant
+        """
+        if self.count == 0:
+            self.origin = t
+        last = self.head - 1
+        if self.count and self.times[last] == t:
+            self._account(last, -1)
+            self.values[last] = value
+            self._account(last, 1)
+            return
+        if self.count == self.size:
+            self._account(self.head, -1)
+        else:
+            self.count += 1
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self._account(self.head, 1)
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+            self._rebase()
+
+    def _account(self, i, sign):
+        """Ajoute (sign=1) ou retire (sign=-1) l'echantillon de la case i des sommes"""
+        u = self.times[i] - self.origin
+        v = self.values[i]
+        self.s_t += sign * u
+        self.s_v += sign * v
+        self.s_tt += sign * u * u
+        self.s_tv += sign * u * v
+
+    def _rebase(self):
+        """Recalcule les sommes depuis le plus ancien echantillon (une fois par tour du tampon : O(1) amorti)"""
+        oldest = self.head if self.count == self.size else 0
+        self.origin = self.times[oldest]
+        self.s_t = self.s_v = self.s_tt = self.s_tv = 0.0
+        for i in range(self.count):
+            self._account(i, 1)
+
+    def last(self):
+        """:return: la derniere valeur recue, None si aucune"""
+        return self.values[self.head - 1] if self.count else None
+
+    def slope(self):
+        """:return: la pente (unite de la mesure par unite de temps) de la regression sur la fenetre, None si moins de deux instants"""
+        n = self.count
+        denom = n * self.s_tt - self.s_t * self.s_t
+        if n < 2 or denom <= 0:
+            return None
+        return (n * self.s_tv - self.s_t * self.s_v) / denom
+
+    def estimate(self):
+        """:return: la valeur de la regression au dernier instant (la derniere valeur s'il n'y a qu'un echantillon), None si aucune"""
+        slope = self.slope()
+        if slope is None:
+            return self.last()
+        n = self.count
+        u = self.times[self.head - 1] - self.origin
+        return self.s_v / n + slope * (u - self.s_t / n)
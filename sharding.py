@@ -0,0 +1,154 @@
+"""
+Repartition des avions sur plusieurs processus de travail.
+
+Un superviseur lit le bus et transmet les messages de chaque avion au processus qui en
+a la charge (choisi par hachage de son identifiant). Les messages d'un meme tick sont
+regroupes et envoyes en un seul lot sur le tube du processus lorsque le message Time
+arrive (ou transmis aussitot si la politique de declenchement evalue sur entree) ;
+chaque processus evalue alors ses avions et renvoie en un seul lot les messages, sons et
+traces produits, que le superviseur emet sur le bus, ainsi que ses mesures (gpws.stats).
+"""
+import threading, zlib, logging, multiprocessing, time
+import gpws
+logger = logging.getLogger('Ivy')
+
+# Types des elements renvoyes par les processus de travail
+SEND = 0
+PLAY = 1
+LOG = 2
+STATS = 3
+
+STATS_DELAY = 1.0 # Intervalle minimal (s) entre deux envois des mesures (gpws.stats) d'un processus de travail
+
+HANDLERS = [gpws.MESSAGES[name][0] for name in sorted(gpws.MESSAGES)]
+HANDLER_INDEX = dict((handler, index) for (index, handler) in enumerate(HANDLERS))
+
+
+def shard_of(aircraft, shards):
+    """:return: le numero du processus charge de l'avion (stable d'une execution a l'autre)"""
+    if aircraft is None:
+        return 0
+    if not isinstance(aircraft, bytes): # str Python 3 ou unicode Python 2 ; une str Python 2 est deja en octets
+        aircraft = aircraft.encode("utf-8")
+    return (zlib.crc32(aircraft) & 0xffffffff) % shards
+
+
+class ShardSortie(gpws.Sortie):
+    """Sortie d'un avion dans un processus de travail : les alarmes sont mises en attente pour le superviseur"""
+
+    def __init__(self, outbox, aircraft, sound):
+        gpws.Sortie.__init__(self, aircraft, sound)
+        self.outbox = outbox
+
+    def send(self, msg):
+        self.outbox.append((SEND, msg + self.suffix))
+
+    def play(self, sound, priority):
+        if self.sound:
+            self.outbox.append((PLAY, sound, priority))
+
+    def emit(self, level, text, args=(), extra=None):
+        if logger.isEnabledFor(level): # Trace formatee par le superviseur
+            self.outbox.append((LOG, level, "%s" + text, (self.prefix,) + tuple(args), extra))
+
+
+def worker_main(reader, results, sound_aircraft, trigger):
+    """
+    Boucle d'un processus de travail
+    :param reader: tube des lots de messages (None pour s'arreter)
+    :param results: file des lots d'alarmes renvoyes au superviseur
+    :param trigger: politique de declenchement (gpws.Trigger)
+    """
+    gpws.trigger = trigger
+    gpws.stats = gpws.metrics.Metrics()
+    stats_time = time.time()
+    outbox = []
+    fleet = gpws.Fleet(lambda aircraft, etat: ShardSortie(outbox, aircraft, aircraft == sound_aircraft))
+    while True:
+        batch = reader.recv()
+        if batch is None:
+            results.put([(LOG, logging.INFO, "%s", (trigger.report(),), None)])
+            return
+        for (index, aircraft, args) in batch:
+            fleet.handle(HANDLERS[index], aircraft, args)
+        if time.time() - stats_time >= STATS_DELAY:
+            stats_time = time.time()
+            outbox.append((STATS, gpws.stats.take()))
+        if outbox:
+            results.put(list(outbox))
+            del outbox[:]
+
+
+class Supervisor(object):
+    """Frontal repartissant les avions sur des processus de travail"""
+
+    def __init__(self, workers, sound_aircraft=None, sortie=None, trigger=None):
+        """
+        :param workers: nombre de processus de travail
+        :param sound_aircraft: identifiant du seul avion dont les alarmes sont jouees
+        :param sortie: sortie (sans identifiant d'avion) par laquelle sont emises les alarmes des processus, gpws.bus par defaut
+        :param trigger: politique de declenchement des processus, gpws.trigger par defaut
+        """
+        self.sortie = gpws.bus if sortie is None else sortie
+        self.trigger = gpws.trigger if trigger is None else trigger
+        self.results = multiprocessing.Queue()
+        self.lock = threading.Lock()
+        self.writers = []
+        self.processes = []
+        self.buffers = [[] for _ in range(workers)]
+        for i in range(workers):
+            (reader, writer) = multiprocessing.Pipe(False)
+            process = multiprocessing.Process(target=worker_main, args=(reader, self.results, sound_aircraft, self.trigger),
+                                              name="gpws-shard-{}".format(i))
+            process.daemon = True
+            process.start()
+            self.writers.append(writer)
+            self.processes.append(process)
+        self.collector = threading.Thread(target=self._collect, name="gpws-shard-collector")
+        self.collector.daemon = True
+        self.collector.start()
+
+    def handle(self, handler, aircraft, args):
+        """
+        Transmet un message (voir gpws.Fleet.handle) au processus concerne ; le temps declenche l'envoi des lots,
+        les messages capteurs sont transmis aussitot si la politique de declenchement evalue sur entree
+        """
+        message = (HANDLER_INDEX[handler], aircraft, args)
+        with self.lock:
+            gpws.stats.count(handler)
+            if handler is gpws.on_time:
+                for i in range(len(self.buffers)):
+                    self.buffers[i].append(message)
+                    self.writers[i].send(self.buffers[i])
+                    self.buffers[i] = []
+            else:
+                i = shard_of(aircraft, len(self.buffers))
+                self.buffers[i].append(message)
+                if self.trigger.on_input: # Evaluation sur entree : pas d'attente du prochain tick
+                    self.writers[i].send(self.buffers[i])
+                    self.buffers[i] = []
+
+    def stop(self):
+        """Arrete les processus de travail apres traitement des lots en cours"""
+        with self.lock:
+            for writer in self.writers:
+                writer.send(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        self.collector.join()
+
+    def _collect(self):
+        while True:
+            items = self.results.get()
+            if items is None:
+                return
+            for item in items:
+                if item[0] == SEND:
+                    self.sortie.send(item[1])
+                elif item[0] == PLAY:
+                    self.sortie.play(item[1], item[2])
+                elif item[0] == STATS: # Les messages sont comptes par le superviseur
+                    gpws.stats.merge(item[1], messages=False)
+                else:
+                    self.sortie.emit(*item[1:])
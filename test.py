@@ -1,14 +1,17 @@
 import math, matplotlib.pyplot as plt, matplotlib, numpy as np
 from matplotlib.patches import Polygon, Circle
 from matplotlib.collections import PatchCollection
-import gpws
+import gpws, trajectoire, batch, emetteur
 
 from ivy.std_api import *
-import sys, logging
+import os, sys, logging
 logger = logging.getLogger('Ivy')
 from optparse import OptionParser
 
-from copy import copy
+
+FIGURE_SIZE = (16, 9) # Taille des figures enregistrees (pouces)
+RASTERIZED_POINTS = 5000 # Au-dela, les points sont inclus en image dans les figures vectorielles (SVG, PDF)
+
 
 def ftmin_to_ms(vz):
     return 0.00508*vz
@@ -26,7 +29,7 @@ def plot_mode(mode, fig=None, ax=None):
     patches = []
 
     for env in mode.list_enveloppes:
-        polygon = Polygon(env.vertexes, True)
+        polygon = Polygon(env.vertexes, closed=True)
         patches.append(polygon)
     p = PatchCollection(patches,  alpha=0.2)
 
@@ -38,15 +41,22 @@ def plot_mode(mode, fig=None, ax=None):
     if fig == None and ax==None:
         plt.show()
 
-def plot_trajectory(traj, modes, flaps, gear, gamma, phase, mode_test_name):
+def trajectory_states(traj):
+    """:return: tableau (N, NB_VARIABLES) des variables des etats de traj (liste d'etats ou gpws.Historique)"""
+    if isinstance(traj, gpws.Historique):
+        return traj.view()
+    return np.array([etat.list for etat in traj], dtype=float).reshape(-1, gpws.NB_VARIABLES)
+
+def plot_trajectory(traj, modes, flaps, gear, gamma, phase, mode_test_name, figure=None):
     """
-    :param traj: liste d'etats
+    :param traj: liste d'etats (ou gpws.Historique)
     :param modes: liste de modes
     :param flaps : configuration volets de l'avion
     :param gear : configuration train d'atterrissage de l'avion
     :param gamma : pente de l'avion
     :param phase : phase de vol de l'avion
     :param mode_test_name : nom du mode pour lequel la liste d'etats a ete creee pour le tester
+    :param figure : fichier (PNG, SVG...) ou enregistrer la figure, None pour l'afficher
     :return: Plot les points de la trajectoire de la forme associee a l'enveloppe dans laquelle ils se trouvent
     """
 
@@ -58,31 +68,37 @@ def plot_trajectory(traj, modes, flaps, gear, gamma, phase, mode_test_name):
     markers = ['o', 'v', '^', '<', '>', '8', 's', 'p']
     colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'w']
 
+    # Enveloppe de chaque point dans chaque mode, en une passe vectorisee (voir batch.py)
+    states = trajectory_states(traj)
+    classes = batch.BatchEvaluator(modes).classify(states, flaps, gear)
+
     for i in range(len(modes)):
         ax = plt.subplot(number_of_lines, number_of_columns, i+1)
         mode = modes[i]
         plot_mode(mode, fig ,ax)
-        for etat in traj:
-            x, y = etat.get_xy(mode)
-            env = mode.get_enveloppe((x,y), flaps, gear)
-            if env == None:
-                marker = markers[0]
-                color =  colors[0]
-            else:
-                i = mode.list_enveloppes.index(env)
-                marker = markers[i + 1]
-                color= colors[i + 1]
-            plt.title(mode.name)
-            plt.plot(x, y, marker, color=color)
+        plt.title(mode.name)
+        x = states[:, mode.abs]
+        y = states[:, mode.ord]
+        # Un seul nuage de points par classe (hors enveloppe, puis chaque enveloppe)
+        for k in range(-1, len(mode.list_enveloppes)):
+            inside = classes[:, i] == (batch.NO_ENV if k < 0 else k)
+            if inside.any():
+                ax.scatter(x[inside], y[inside], marker=markers[k + 1], color=colors[k + 1],
+                           rasterized=len(states) > RASTERIZED_POINTS)
 
         nb_env = len(mode.list_enveloppes)
         legends = [plt.Line2D((0,1),(0,0), marker=markers[0], linestyle='', color= colors[0])]
         description = ['Hors enveloppe']
-        for i in range(nb_env):
-            legends.append(plt.Line2D((0,1),(0,0), marker=markers[i+1], linestyle='', color= colors[i+1]))
-            description.append(mode.list_enveloppes[i].name)
+        for k in range(nb_env):
+            legends.append(plt.Line2D((0,1),(0,0), marker=markers[k+1], linestyle='', color= colors[k+1]))
+            description.append(mode.list_enveloppes[k].name)
         ax.legend(legends, description, prop={'size':8})
         plt.autoscale()
+    if figure is not None:
+        fig.set_size_inches(FIGURE_SIZE)
+        fig.savefig(figure)
+        plt.close(fig)
+        return
     try :
 
         plt.show()
@@ -141,33 +157,19 @@ def create_test(mode, phase, flaps, gear, gamma, absi, absf, ordi, ordf, nb_poin
 
     """
     etat = gpws.Etat(15, 5000, 0, 0, None, 0, 0, flaps, gear, phase)
-    pas_abs = (absf - absi) / nb_points
-    pas_ord = (ordf - ordi) / nb_points
-    abs = absi
-    ord = ordi
-    traj = []
-    fic = open(filename, "w")
-    for i in range(nb_points):
-        etat.set_xy(abs, ord, mode, gamma)
-        time = "Time t={}\n".format(i)
-        radio_alt =  etat.generate_radioalt()
-        statevector = etat.generate_statevector(gamma)
-        fms = etat.generate_fms()
-        config = etat.generate_config()
-        fic.write(time)
-        fic.write(radio_alt)
-        fic.write(statevector)
-        fic.write(fms)
-        fic.write(config)
-        traj.append(copy(etat))
-        abs += pas_abs
-        ord += pas_ord
-    fic.write("Time t={}\n".format(nb_points))
-    fic.close()
+    traj = gpws.Historique(nb_points)
+    trajectoire.write(filename, etat, mode, gamma, absi, absf, ordi, ordf, nb_points, traj)
     if modes_to_plot == None:
         modes_to_plot = [mode]
 
-    plot_trajectory(traj, modes_to_plot, flaps, gear, gamma, phase, mode.name)
+    plot_trajectory(traj, modes_to_plot, flaps, gear, gamma, phase, mode.name, figure_path(filename))
+
+def figure_path(filename):
+    """:return: fichier ou enregistrer la figure d'un fichier de test (option --figures), None pour l'afficher"""
+    if not options.figures:
+        return None
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(options.figures, "{}.{}".format(name, options.figure_format))
 
 def create_test_global(mode,list_modes, phase, flaps, gear, gamma, nb_points):
     """Automatise le test d'un mode sur plusieurs listes d'etats test en appelant la fonction create_test pour plusieurs pour ces listes d'etats test crees par les fonctions segm_test
@@ -199,7 +201,8 @@ def create_test_global(mode,list_modes, phase, flaps, gear, gamma, nb_points):
 #parse
 usage = "usage: %prog [options]"
 parser = OptionParser(usage=usage)
-parser.set_defaults(ivy_bus="127.255.255.255:2010", interval=5, verbose=False, app_name="Test")
+parser.set_defaults(ivy_bus="127.255.255.255:2010", interval=5, verbose=False, app_name="Test", figures=None,
+                    figure_format="png", speed=emetteur.SPEED)
 parser.add_option('-v', '--verbose', action='store_true', dest='verbose',
                   help='Be verbose.')
 parser.add_option('-i', '--interval', type='int', dest='interval',
@@ -208,7 +211,17 @@ parser.add_option('-b', '--ivybus', type='string', dest='ivy_bus',
                   help='Bus id (format @IP:port, default to 127.255.255.255:2010)')
 parser.add_option('-a', '--appname', type='string', dest='app_name',
                   help='Application Name')
+parser.add_option('-o', '--figures', type='string', dest='figures',
+                  help='Save the figures in this directory (headless Agg backend) instead of showing them')
+parser.add_option('-f', '--format', type='string', dest='figure_format',
+                  help='Format of the saved figures (png, svg, pdf... default to png)')
+parser.add_option('-x', '--speed', type='float', dest='speed',
+                  help='Replay speed factor (1 : real time, 10 : ten times faster, 0 : as fast as possible)')
 (options, args) = parser.parse_args()
+if options.figures:
+    plt.switch_backend("Agg")
+    if not os.path.isdir(options.figures):
+        os.makedirs(options.figures)
 
 # init log
 level = logging.INFO
@@ -225,21 +238,21 @@ def start_test(nom_fichier_test):
     :return:des que le time est lance, active la fonction send_fic_test qui simule le vol de l'avion avec la liste d'etats test de nom_fichier_test
 
     """
-    IvyBindMsg(send_fic_test(nom_fichier_test), "^Time t=")
+    IvyBindMsg(send_fic_test(nom_fichier_test, options.speed), "^Time t=")
 
-def send_fic_test(nom_fichier_test):
+def send_fic_test(nom_fichier_test, speed=emetteur.SPEED):
     """
 
     :param nom_fichier_test: le fichier contenant la liste d'etats test
-    :return: simule le vol de l'avion en envoyant sur le bus les etats, le time et la radioaltitude du fichier texte test
+    :param speed: facteur de vitesse (1 : temps reel, 0 : aussi vite que possible)
+    :return: simule le vol de l'avion en envoyant sur le bus les etats, le time et la radioaltitude du fichier texte test,
+             chaque tick d'un bloc au rythme des messages Time (voir emetteur.Scheduler)
 
     """
     import time
     time.sleep(0.2)
-    with open(nom_fichier_test, "r") as fic:
-        for line in fic.readlines():
-            IvySendMsg(line)
-            time.sleep(0.5)
+    scheduler = emetteur.Scheduler(IvySendMsg, speed).play_file(nom_fichier_test)
+    logger.info("%s : %s", nom_fichier_test, emetteur.format_report(scheduler.report()))
 
 
 #ivy connection
@@ -278,9 +291,9 @@ def test_mode2():
         x = traj_abs[i]
         y = traj_ord[i]
         etat = gpws.Etat(100,0,0,0,0,0,0,"0","up",gpws.APP)
-        etat.set_xy(x, y, gpws.L_Modes[1])
+        etat.set_xy(x, y, gpws.get_modes()[1])
         etats.append(etat)
-    plot_trajectory(etats, [gpws.L_Modes[1]], "0", "up", 0, gpws.APP, "mode2")
+    plot_trajectory(etats, [gpws.get_modes()[1]], "0", "up", 0, gpws.APP, "mode2")
     fic = open("test_mode2.txt", 'w')
     for i in range(len(etats)):
         etat = etats[i]
@@ -310,9 +323,9 @@ def test_mode3():
         (vz, gamma) = (-10, -10) if (i == 0 or traj_ord[i-1] < traj_ord[i]) else (10, 10)
         gammas.append(gamma)
         etat = gpws.Etat(vz, 0, 0, 0, 0, 0, 0, "0", "up", phase)
-        etat.set_xy(x, y, gpws.L_Modes[2], gammas[i])
+        etat.set_xy(x, y, gpws.get_modes()[2], gammas[i])
         etats.append(etat)
-    plot_trajectory(etats, gpws.L_Modes, "0", "up", 0, phase, "mode3")
+    plot_trajectory(etats, gpws.get_modes(), "0", "up", 0, phase, "mode3")
     fic = open("test_mode3.txt", 'w')
     for i in range(len(etats)):
         etat = etats[i]
@@ -330,12 +343,12 @@ def test_mode3():
 
 
 #Tests
-modes = gpws.L_Modes
+modes = gpws.get_modes()
 
 
 
 ## Mode 1 ##
-create_test_global(modes[0],gpws.L_Modes, gpws.APP, "0", gpws.DOWN, -10*math.pi/180, 20)
+create_test_global(modes[0],gpws.get_modes(), gpws.APP, "0", gpws.DOWN, -10*math.pi/180, 20)
 start_test("mode1_traj_diag_gd.txt")
 
 ## Mode 2 ##
@@ -347,11 +360,11 @@ start_test("mode1_traj_diag_gd.txt")
 # start_test("test_mode3.txt")
 
 ## Mode 4 ##
-# create_test_global(modes[3],gpws.L_Modes, gpws.APP, "0", gpws.UP, -10*math.pi/180, 20)
+# create_test_global(modes[3],gpws.get_modes(), gpws.APP, "0", gpws.UP, -10*math.pi/180, 20)
 # start_test("mode4_traj_rect_2.txt")
 
 ## Mode 6 ##
-# create_test_global(modes[5],gpws.L_Modes, gpws.LDG, "0", gpws.DOWN, -10*math.pi/180, 20)
+# create_test_global(modes[5],gpws.get_modes(), gpws.LDG, "0", gpws.DOWN, -10*math.pi/180, 20)
 # start_test("mode6_traj_rect_2.txt")
 
 IvyStop()
\ No newline at end of file
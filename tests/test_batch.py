@@ -0,0 +1,47 @@
+"""
+Evaluation vectorisee apres rechargement d'un profil d'enveloppes.
+
+Usage : python -m unittest discover tests
+"""
+import json, os, shutil, sys, tempfile, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpws, batch, profil
+
+
+class EvaluateBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        with open(profil.path_of(profil.DEFAULT)) as fic:
+            data = json.load(fic)
+        # Second profil : le mode 1 seul
+        data["name"] = "mode1"
+        data["modes"] = data["modes"][:1]
+        self.second = os.path.join(self.tmp, "mode1.json")
+        with open(self.second, "w") as fic:
+            json.dump(data, fic)
+        # Etats : au sol sans vitesse verticale, puis en fort taux de descente pres du sol
+        self.states = np.zeros((2, gpws.NB_VARIABLES))
+        self.states[1, gpws.VZ] = -30.
+        self.states[1, gpws.RADIOALT] = 100.
+
+    def tearDown(self):
+        gpws.load_profile()
+        shutil.rmtree(self.tmp)
+
+    def test_second_profile(self):
+        gpws.load_profile()
+        before = batch.evaluate_batch(self.states, "0", gpws.UP, gpws.CRZ)[0]
+        self.assertEqual(before.shape, (2, len(gpws.get_modes())))
+        gpws.load_profile(self.second)
+        (par_mode, best) = batch.evaluate_batch(self.states, "0", gpws.UP, gpws.CRZ)
+        (expected_mode, expected) = batch.BatchEvaluator(gpws.get_modes()).evaluate(self.states, "0", gpws.UP, gpws.CRZ)
+        self.assertEqual(par_mode.shape, (2, 1))
+        self.assertEqual(par_mode.tolist(), expected_mode.tolist())
+        self.assertEqual(best.tolist(), expected.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
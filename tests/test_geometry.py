@@ -0,0 +1,80 @@
+"""
+Test des points du bord des enveloppes convexes a coordonnees non entieres.
+
+Usage : python -m unittest discover tests
+"""
+import os, random, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpws, batch, geometry
+
+
+def baseline_collision(vertexes, P):
+    """Test d'origine de Enveloppe.collision : produit vectoriel AB x AP de chaque arete"""
+    nbp = len(vertexes)
+    for i in range(nbp):
+        (A, B) = (vertexes[i], vertexes[(i + 1) % nbp])
+        if (B[0] - A[0]) * (P[1] - A[1]) - (B[1] - A[1]) * (P[0] - A[0]) > 0:
+            return False
+    return True
+
+def convex_hull(points):
+    """:return: enveloppe convexe des points, dans le sens horaire (chaine monotone)"""
+    points = sorted(set(points))
+
+    def half(points):
+        hull = []
+        for P in points:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (P[1] - hull[-2][1]) -
+                                      (hull[-1][1] - hull[-2][1]) * (P[0] - hull[-2][0])) >= 0:
+                hull.pop()
+            hull.append(P)
+        return hull
+    (upper, lower) = (half(points), half(points[::-1]))
+    return upper[:-1] + lower[:-1]
+
+def random_polygons(n, rng):
+    """:return: n polygones convexes aux sommets arrondis au centieme"""
+    polygons = []
+    while len(polygons) < n:
+        hull = convex_hull([(round(rng.uniform(-10, 10), 2), round(rng.uniform(-10, 10), 2)) for _ in range(12)])
+        if len(hull) >= 3 and geometry.is_convex(hull):
+            polygons.append(hull)
+    return polygons
+
+def enveloppe(vertexes):
+    return gpws.Enveloppe(vertexes, "W", 1, [None], [None], "test", None)
+
+
+class BoundaryTest(unittest.TestCase):
+
+    def test_vertex(self):
+        env = enveloppe([(7.73, -1.29), (4.46, -6.98), (2.4, -8.88), (-1.25, -7.79), (-6.31, -4.41), (-5.2, 3.44),
+                         (-0.09, 4.24)])
+        for P in env.vertexes:
+            self.assertTrue(env.collision(P), P)
+
+    def test_random_polygons(self):
+        rng = random.Random(0)
+        for vertexes in random_polygons(50, rng):
+            env = enveloppe(vertexes)
+            self.assertIsNone(env.index)
+            mode = gpws.Mode([env], None, gpws.VZ, gpws.RADIOALT, "test")
+            points = list(vertexes) + [((A[0] + B[0]) / 2., (A[1] + B[1]) / 2.)
+                                       for (A, B) in zip(vertexes, vertexes[1:] + vertexes[:1])]
+            points += [(rng.uniform(-11, 11), rng.uniform(-11, 11)) for _ in range(50)]
+            states = np.zeros((len(points), gpws.NB_VARIABLES))
+            states[:, gpws.VZ] = [x for (x, y) in points]
+            states[:, gpws.RADIOALT] = [y for (x, y) in points]
+            inside = batch.BatchEvaluator([mode]).inside(states)[:, 0]
+            for (P, vectorised) in zip(points, inside.tolist()):
+                expected = baseline_collision(env.vertexes, P)
+                self.assertEqual(env.collision(P), expected, (vertexes, P))
+                self.assertEqual(vectorised, expected, (vertexes, P))
+            for P in vertexes:
+                self.assertTrue(env.collision(P), (vertexes, P))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Decodage des messages du bus (gpws.parse_message).
+
+Usage : python -m unittest discover tests
+"""
+import logging, os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpws
+
+
+class ParseMessageTest(unittest.TestCase):
+
+    def setUp(self):
+        gpws.logger.addHandler(logging.NullHandler())
+
+    def test_valid(self):
+        self.assertEqual(gpws.parse_message("Time t=3"), (gpws.on_time, None, (3.0,)))
+        self.assertEqual(gpws.parse_message("RadioAltimeter groundAlt=12.5 ac=AF1"), (gpws.on_radioalt, "AF1", (12.5,)))
+        self.assertEqual(gpws.parse_message("StateVector x=1 y=2 z=3 Vp=50 fpa=-0.1 psi=0 phi=0.2"),
+                         (gpws.on_statevector, None, (50.0, -0.1, 0.2)))
+        self.assertEqual(gpws.parse_message("FMS_TO_GPWS phase=APPROACH, da=10, dh=20 ac=AF1"),
+                         (gpws.on_fms, "AF1", ("APPROACH", 10.0, 20.0)))
+        self.assertEqual(gpws.parse_message("Config GEAR=Down FLAPS=3"), (gpws.on_config, None, ("Down", "3")))
+
+    def test_other_messages(self):
+        self.assertIsNone(gpws.parse_message("Alert mode=1"))
+        self.assertIsNone(gpws.parse_message(""))
+
+    def test_rejected(self):
+        for msg in ["Time", "Time x=3", "RadioAltimeter groundAlt=", "RadioAltimeter groundAlt=abc",
+                    "RadioAltimeter altitude=12", "RadioAltimeter groundAlt=12 xx=3",
+                    "StateVector x=1 y=2 z=3 fpa=-0.1 Vp=50 psi=0 phi=0.2", # Champs dans un autre ordre
+                    "StateVector x=1 y=2 z=3 Vp=50 fpa=-0.1 psi=0", # Champ manquant
+                    "FMS_TO_GPWS phase=APPROACH da=10, dh=20", # Virgule manquante
+                    "Config FLAPS=3 GEAR=Down", "Config GEAR=Down FLAPS=3 ac=AF1 extra"]:
+            self.assertIsNone(gpws.parse_message(msg), msg)
+
+
+if __name__ == '__main__':
+    unittest.main()
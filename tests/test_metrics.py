@@ -0,0 +1,61 @@
+"""
+Mesures enregistrees pendant leur publication.
+
+Usage : python -m unittest discover tests
+"""
+import os, pickle, sys, threading, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+
+
+class TakeTest(unittest.TestCase):
+
+    def test_concurrent_take(self):
+        stats = metrics.Metrics()
+        (threads, records) = (4, 20000)
+
+        def work():
+            for _ in range(records):
+                stats.count(work)
+                stats.record("tick", 1e-4)
+
+        def published(period):
+            """Comptes lus des que la periode est retiree, comme par publish_stats"""
+            return period.messages.get(work, 0), period.tick.count
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        switch = sys.getswitchinterval() if hasattr(sys, "getswitchinterval") else sys.getcheckinterval()
+        if hasattr(sys, "setswitchinterval"): # Changements de fil frequents
+            sys.setswitchinterval(1e-6)
+        else:
+            sys.setcheckinterval(1)
+        try:
+            for worker in workers:
+                worker.start()
+            periods = []
+            while any(worker.is_alive() for worker in workers):
+                periods.append(published(stats.take()))
+            for worker in workers:
+                worker.join()
+        finally:
+            if hasattr(sys, "setswitchinterval"):
+                sys.setswitchinterval(switch)
+            else:
+                sys.setcheckinterval(switch)
+        periods.append(published(stats.take()))
+        self.assertEqual(sum(messages for (messages, ticks) in periods), threads * records)
+        self.assertEqual(sum(ticks for (messages, ticks) in periods), threads * records)
+
+    def test_pickle(self):
+        stats = metrics.Metrics()
+        stats.skip()
+        stats.record("alert", 0.5)
+        copy = pickle.loads(pickle.dumps(stats.take(), pickle.HIGHEST_PROTOCOL)) # Comme multiprocessing
+        self.assertEqual(copy.not_init, 1)
+        self.assertEqual(copy.alert.count, 1)
+        copy.skip()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Index de localisation (geometry.SlabIndex) des enveloppes non convexes, compare au nombre d'enroulement.
+
+Usage : python -m unittest discover tests
+"""
+import math, os, random, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpws, geometry
+
+
+def star_polygon(n, rng, center=(0., 0.)):
+    """:return: polygone simple (en etoile autour du centre) de n sommets aux coordonnees arrondies au centieme"""
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(n))
+    polygon = []
+    for angle in angles:
+        r = rng.uniform(2, 10)
+        polygon.append((round(center[0] + r * math.cos(angle), 2), round(center[1] + r * math.sin(angle), 2)))
+    return polygon
+
+def concave_polygon(n, rng, center=(0., 0.)):
+    """:return: polygone simple non convexe de n sommets distincts"""
+    while True:
+        polygon = star_polygon(n, rng, center)
+        if len(set(polygon)) == n and not geometry.is_convex(geometry.normalize(polygon)):
+            return polygon
+
+def sample_points(polygons, rng, n=300):
+    """:return: sommets, milieux des aretes et points tires au hasard autour des polygones"""
+    points = [(rng.uniform(-13, 13), rng.uniform(-13, 13)) for _ in range(n)]
+    for polygon in polygons:
+        points.extend(polygon)
+        points.extend(((A[0] + B[0]) / 2., (A[1] + B[1]) / 2.) for (A, B) in zip(polygon, polygon[1:] + polygon[:1]))
+    return points
+
+
+class SlabIndexTest(unittest.TestCase):
+
+    def test_single_polygons(self):
+        rng = random.Random(0)
+        for n in (5, 8, 12, 20, 40):
+            for _ in range(10):
+                polygon = concave_polygon(n, rng)
+                index = geometry.SlabIndex([geometry.normalize(polygon)])
+                self.assertEqual(index.validate(sample_points([polygon], rng)), [], polygon)
+
+    def test_overlapping_polygons(self):
+        rng = random.Random(1)
+        for _ in range(10):
+            polygons = [concave_polygon(12, rng, (rng.uniform(-3, 3), rng.uniform(-3, 3))) for _ in range(3)]
+            index = geometry.SlabIndex([geometry.normalize(polygon) for polygon in polygons])
+            self.assertEqual(index.validate(sample_points(polygons, rng)), [], polygons)
+
+    def test_mode_index(self):
+        rng = random.Random(2)
+        for _ in range(5):
+            polygons = [concave_polygon(n, rng, (rng.uniform(-3, 3), rng.uniform(-3, 3))) for n in (40, 24, 8)]
+            envs = [gpws.Enveloppe(polygon, "W", priority, [None], [None], "env{}".format(priority), None)
+                    for (priority, polygon) in enumerate(polygons)]
+            mode = gpws.Mode(envs, [None], gpws.VZ, gpws.RADIOALT, "test")
+            self.assertGreaterEqual(len(envs[0].vertexes), gpws.SLAB_INDEX_MIN_VERTEXES)
+            self.assertIsNotNone(mode.index)
+            self.assertEqual(mode.index.validate(sample_points(polygons, rng)), [])
+            # Pas de milieux d'aretes : le test exact des enveloppes et le nombre d'enroulement peuvent s'y
+            # departager differemment a l'arrondi pres
+            points = [(rng.uniform(-13, 13), rng.uniform(-13, 13)) for _ in range(300)]
+            points += [P for polygon in polygons for P in polygon]
+            for P in points:
+                expected = None
+                for env in envs: # Par priorite croissante
+                    if geometry.winding_number(env.vertexes, P[0], P[1]):
+                        expected = env
+                        break
+                self.assertIs(mode.get_enveloppe(P, "0", gpws.DOWN), expected, P)
+
+
+if __name__ == '__main__':
+    unittest.main()
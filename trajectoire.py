@@ -0,0 +1,146 @@
+"""
+Generation vectorisee des fichiers de trajectoire de test (voir test.create_test).
+
+Un segment de test parcourt le plan (abscisse, ordonnee) d'un mode en nb_points etapes.
+Les variables de l'etat sont calculees par blocs de points avec NumPy, selon les memes
+regles que Etat.set_xy (vitesse air deduite de la vitesse verticale et de la pente, ou
+l'inverse), puis les cinq messages de chaque point (memes lignes que Etat.generate_*)
+sont formates bloc par bloc et ecrits d'un coup. La memoire utilisee ne depend que de
+la taille des blocs : des millions de points passent en flux.
+
+Le fichier produit est identique, octet pour octet, a celui de l'ancienne boucle point par
+point (mises a jour de Etat.set_xy et abscisses accumulees pas a pas) lorsque, pour chaque
+axe, l'une au moins des deux bornes est un flottant, ce qui est le cas des segments de
+test.segm_test_* et de la ligne de commande. Avec deux bornes entieres, l'ancienne boucle
+sous Python 2 tronquait le pas (division entiere) et s'arretait avant la borne d'arrivee ;
+le pas est ici toujours la division exacte, comme sous Python 3.
+
+Usage : python trajectoire.py [options] FICHIER pour ecrire un segment de test.
+"""
+from __future__ import division
+import math
+import numpy as np
+import gpws
+from optparse import OptionParser
+
+CHUNK = 16384 # Points par bloc
+
+
+def segment(start, stop, nb_points, chunk=CHUNK):
+    """
+    Coordonnees successives start, start + pas, ... (pas = (stop - start) / nb_points), accumulees pas a pas
+    comme dans une boucle (les arrondis sont les memes)
+    :return: generateur de tableaux d'au plus chunk coordonnees
+    """
+    step = (stop - start) / nb_points
+    value = start
+    for first in range(0, nb_points, chunk):
+        n = min(chunk, nb_points - first)
+        steps = np.full(n, step)
+        steps[0] = value
+        block = np.cumsum(steps) # Somme sequentielle : memes arrondis que value += step
+        value = block[-1] + step
+        yield block
+
+def states(etat, mode, gamma, x, y):
+    """
+    :param etat: etat de depart (ses variables hors du plan du mode sont reprises)
+    :param x, y: tableaux des coordonnees dans le plan du mode
+    :return: tableau (n, NB_VARIABLES) des variables de etat apres etat.set_xy(x[k], y[k], mode, gamma), pour chaque k
+    """
+    values = np.empty((len(x), gpws.NB_VARIABLES))
+    values[:] = np.frombuffer(etat.list, dtype=float)
+    values[:, mode.abs] = x
+    values[:, mode.ord] = y
+    vz = values[:, gpws.VZ]
+    cas = values[:, gpws.COMPUTED_AIR_SPEED]
+    sin_gamma = math.sin(gamma)
+    if mode.abs == gpws.VZ and gamma != 0:
+        cas[:] = np.abs(vz * gpws.FTMIN_TO_MS / (sin_gamma * gpws.KTS_TO_MS))
+    elif mode.abs == gpws.COMPUTED_AIR_SPEED:
+        vz[:] = -cas * sin_gamma * gpws.KTS_TO_MS / gpws.FTMIN_TO_MS
+    elif mode.abs == gpws.MSL_ALT_LOSS:
+        if sin_gamma == 0:
+            raise ValueError("pente nulle : vitesse air indefinie pour le mode {}".format(mode.name))
+        values[vz <= 0, gpws.MSL_ALT_LOSS] = 0
+        cas[:] = np.abs(vz * gpws.FTMIN_TO_MS / (sin_gamma * gpws.KTS_TO_MS))
+    cas[np.isnan(cas)] = 0
+    return values
+
+def template(etat, gamma):
+    """:return: format des cinq messages d'un point (Time, RadioAltimeter, StateVector, FMS, Config), a remplir
+                par t, radio altitude (m), vitesse propre (m/s) et roulis (rad)"""
+    constant = lambda text: text.replace("{", "{{").replace("}", "}}")
+    return ("Time t={}\nRadioAltimeter groundAlt={}\n" +
+            "StateVector x=0 y=0 z=0 Vp={} fpa=" + constant("{}".format(gamma)) + " psi=0 phi={}\n" +
+            constant(etat.generate_fms()) + constant(etat.generate_config()))
+
+def generate(etat, mode, gamma, absi, absf, ordi, ordf, nb_points, chunk=CHUNK):
+    """
+    Segment de test de (absi, ordi) a (absf, ordf) dans le plan du mode, sans le message Time final
+    :return: generateur de (texte, variables) par bloc : texte des messages des points du bloc, variables
+             des etats successifs (tableau (n, NB_VARIABLES), voir states)
+    """
+    line = template(etat, gamma)
+    first = 0
+    for (x, y) in zip(segment(absi, absf, nb_points, chunk), segment(ordi, ordf, nb_points, chunk)):
+        values = states(etat, mode, gamma, x, y)
+        n = len(values)
+        fields = [None] * (4 * n) # Valeurs a formater, point par point
+        fields[0::4] = range(first, first + n)
+        fields[1::4] = (values[:, gpws.RADIOALT] * gpws.FT_TO_M).tolist()
+        fields[2::4] = (values[:, gpws.COMPUTED_AIR_SPEED] / gpws.MS_TO_KTS).tolist()
+        fields[3::4] = (values[:, gpws.ROLL_ANGLE] * (math.pi / 180)).tolist()
+        yield (line * n).format(*fields), values
+        first += n
+
+def write(filename, etat, mode, gamma, absi, absf, ordi, ordf, nb_points, traj=None, chunk=CHUNK):
+    """
+    Ecrit le fichier de test d'un segment (voir generate), termine par le message Time suivant le dernier point
+    :param traj: historique (gpws.Historique) auquel ajouter les etats successifs, None pour ne pas les garder
+    """
+    with open(filename, "w") as fic:
+        for (text, values) in generate(etat, mode, gamma, absi, absf, ordi, ordf, nb_points, chunk):
+            fic.write(text)
+            if traj is not None:
+                traj.extend(values, etat)
+        fic.write("Time t={}\n".format(nb_points))
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] file"
+    parser = OptionParser(usage=usage)
+    parser.set_defaults(mode="mode1", phase=gpws.APP, flaps="0", gear=gpws.DOWN, gamma=-10, points=1000000,
+                        diagonal=False, position=0.33)
+    parser.add_option('-m', '--mode', type='string', dest='mode',
+                      help='Name of the tested mode')
+    parser.add_option('-p', '--phase', type='string', dest='phase',
+                      help='Flight phase')
+    parser.add_option('-f', '--flaps', type='string', dest='flaps',
+                      help='Flaps position')
+    parser.add_option('-g', '--gear', type='string', dest='gear',
+                      help='Gear position')
+    parser.add_option('-G', '--gamma', type='float', dest='gamma',
+                      help='Flight path angle (degrees)')
+    parser.add_option('-n', '--points', type='int', dest='points',
+                      help='Number of points of the segment')
+    parser.add_option('-d', '--diagonal', action='store_true', dest='diagonal',
+                      help='Cross the mode diagonally (default to a horizontal line)')
+    parser.add_option('-y', '--position', type='float', dest='position',
+                      help='Height of the horizontal line, as a fraction of the mode height')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("one output file expected")
+    modes = [mode for mode in gpws.get_modes() if mode.name == options.mode]
+    if not modes:
+        parser.error("unknown mode {}".format(options.mode))
+    mode = modes[0]
+
+    (xmin, ymin, xmax, ymax) = mode.get_xmin_ymin_xmax_ymax()
+    if options.diagonal:
+        (absi, ordi, absf, ordf) = (xmin, ymax + (ymax - ymin) * 0.2, xmax - 0.1 * (xmax - xmin), ymin + 0.1 * (ymax - ymin))
+    else:
+        ordi = ordf = options.position * (ymax - ymin) + ymin
+        (absi, absf) = (xmin, xmax - 0.1 * (xmax - xmin))
+    etat = gpws.Etat(15, 5000, 0, 0, None, 0, 0, options.flaps, options.gear, options.phase)
+    write(args[0], etat, mode, math.radians(options.gamma), absi, absf, ordi, ordf, options.points)